@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Module that calibrates the number of threads, the OpenMP schedule and chunk size of the kernels, and the number of BLAS threads on the current host
+The chosen settings are stored in a per-host tuning profile, which is applied automatically by the analysis jobs; the calibration takes a few seconds and is therefore run as a separate step by running this module as a script, so that it does not distort the timings of the jobs.
+"""
+
+import argparse
+from dataclasses import asdict, dataclass, field
+import fcntl
+import functools
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import (
+  Callable,
+  Dict,
+  List,
+  Optional,
+  Tuple,
+)
+
+import numpy as np
+
+import KernelLibrary
+import OpenMp
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+# environment variable with path of the tuning profile; overrides the default location in the kernel cache directory
+TUNING_PROFILE_ENV_VAR = "MOMENTS_TUNING_PROFILE"
+# environment variable that controls auto-tuning: '0' disables it and applies the default thread budget; '1' (default) applies an existing valid profile and otherwise the default thread budget;
+# 'calibrate' calibrates within the job if no valid profile exists; 'force' recalibrates even if a valid profile exists
+AUTOTUNE_ENV_VAR = "MOMENTS_AUTOTUNE"
+DEFAULT_NMB_THREADS = 5  # thread budget used if auto-tuning is disabled
+SCHEDULE_CANDIDATES   = ("static", "dynamic", "guided")
+CHUNK_SIZE_CANDIDATES = (0, 16, 256, 4096)  # 0 = default chunk size of the schedule
+THREAD_TOLERANCE = 0.05  # the smallest number of threads whose time is within this fraction of the fastest time is chosen, so that cores are not occupied for nothing
+
+
+def defaultProfileFileName() -> str:
+  """Returns path of the tuning profile of this host"""
+  return os.environ.get(TUNING_PROFILE_ENV_VAR) or os.path.join(KernelLibrary.KernelLibrary().cacheDir, f"tuning.{platform.node()}.json")
+
+
+@dataclass
+class TuningProfile:
+  """Settings chosen by the calibration on a given host and the timings they are based on"""
+  host:           str                                                          # name of host the profile was calibrated on
+  nmbCpus:        int                                                          # number of logical CPUs of the host
+  kernelLibrary:  str                                                          # file name of kernel library the profile was calibrated with
+  nmbThreads:     int                                                          # number of OpenMP threads
+  schedule:       str                                                          # OpenMP schedule of the event loops of the kernels
+  chunkSize:      int                                                          # chunk size of the OpenMP schedule; 0 = default chunk size
+  nmbBlasThreads: int                                                          # number of threads of the BLAS library
+  timings:        Dict[str, Dict[str, float]] = field(default_factory = dict)  # [s] minimum time of each calibrated candidate
+
+  def __str__(self) -> str:
+    return (f"host '{self.host}': OpenMP threads = {self.nmbThreads}, schedule = {self.schedule}, chunk size = {self.chunkSize or 'default'}, "
+            f"BLAS threads = {self.nmbBlasThreads}")
+
+  def isValid(self) -> bool:
+    """Returns whether profile was calibrated on this host with the current kernel library"""
+    return (self.host == platform.node() and self.nmbCpus == os.cpu_count()
+            and self.kernelLibrary == os.path.basename(KernelLibrary.kernelLibraryFileName()))
+
+  def save(self, fileName: str) -> None:
+    """Writes profile to JSON file; file is written to a temporary file and renamed, so that other processes never see a partially written profile"""
+    dirName = os.path.dirname(os.path.abspath(fileName))
+    os.makedirs(dirName, exist_ok = True)
+    fd, tmpFileName = tempfile.mkstemp(suffix = ".json", dir = dirName)
+    with os.fdopen(fd, "w") as profileFile:
+      json.dump(asdict(self), profileFile, indent = 2)
+    os.replace(tmpFileName, fileName)
+
+  @classmethod
+  def load(cls, fileName: str) -> Optional["TuningProfile"]:
+    """Reads profile from JSON file; returns None if the file does not exist or cannot be parsed"""
+    try:
+      with open(fileName) as profileFile:
+        return cls(**json.load(profileFile))
+    except (OSError, ValueError, TypeError):
+      return None
+
+
+def _threadCandidates(nmbCpus: int) -> List[int]:
+  """Returns powers of 2 up to the number of CPUs and the number of CPUs"""
+  candidates = [1 << exponent for exponent in range(nmbCpus.bit_length()) if (1 << exponent) <= nmbCpus]
+  return sorted(set(candidates + [nmbCpus]))
+
+
+def _minTime(
+  fcn:            Callable[[], None],
+  nmbRepetitions: int,
+) -> float:
+  """Returns minimum wall time in seconds of repeated calls of given function; the first call is a warm-up and is not timed"""
+  fcn()
+  times: List[float] = []
+  for _ in range(nmbRepetitions):
+    startTime = time.perf_counter()
+    fcn()
+    times.append(time.perf_counter() - startTime)
+  return min(times)
+
+
+def _kernelWorkload(
+  nmbEvents: int,
+  maxL:      int,
+  seed:      int,
+) -> Callable[[], None]:
+  """Returns function that evaluates the spherical-harmonics table of the integral matrix and the basis functions for measured moments on events uniformly distributed in phase space"""
+  rng   = np.random.default_rng(seed)
+  theta = np.arccos(rng.uniform(-1, +1, nmbEvents))
+  phi   = rng.uniform(-np.pi, +np.pi, nmbEvents)
+  Phi   = rng.uniform(-np.pi, +np.pi, nmbEvents)
+  kernels = KernelLibrary.kernels()
+  def evaluate() -> None:
+    kernels.ylmReImTable(maxL, theta, phi)
+    for momentIndex in range(3):
+      kernels.f_meas(momentIndex, maxL, maxL // 2, theta, phi, Phi, 0.3)
+  return evaluate
+
+
+def _blasWorkload(
+  nmbEvents: int,
+  maxL:      int,
+  seed:      int,
+) -> Callable[[], None]:
+  """Returns function that performs matrix products with the shapes of the integral-matrix accumulation and of the covariance sums of the measured moments"""
+  rng   = np.random.default_rng(seed)
+  nmbLM = (maxL + 1) * (maxL + 2) // 2
+  ylms         = rng.uniform(-1, +1, (2 * nmbLM, nmbEvents))
+  eventFactors = rng.uniform(-1, +1, (4, nmbEvents))
+  fMeas        = rng.uniform(-1, +1, (3 * nmbLM, nmbEvents)) + 1j * rng.uniform(-1, +1, (3 * nmbLM, nmbEvents))
+  weights      = rng.uniform(0, 1, nmbEvents)
+  def evaluate() -> None:
+    (ylms[None, :, :] * eventFactors[:, None, :]) @ ylms.T  # see AcceptanceIntegralMatrix.calculate()
+    weighted_fMeas = weights * fMeas
+    weighted_fMeas @ np.conjugate(fMeas).T  # see MomentCalculator._calcMeasMomentsFromData()
+    weighted_fMeas @ fMeas.T
+  return evaluate
+
+
+def calibrate(
+  nmbEvents:      int  = 20000,  # number of events used for the calibration
+  maxL:           int  = 4,      # maximum L of the moments used for the calibration
+  nmbRepetitions: int  = 3,      # number of timed calls per candidate
+  seed:           int  = 12345,  # seed for the synthetic events
+  verbose:        bool = True,
+) -> TuningProfile:
+  """Times the kernels and the matrix products for candidate settings and returns the fastest settings
+  The search is done in stages: first the OpenMP schedule and chunk size using all CPUs, then the number of OpenMP threads for the chosen schedule, and finally the number of BLAS threads.
+  The thread settings in effect before the calibration are restored.
+  """
+  nmbCpus = os.cpu_count() or 1
+  kernels = KernelLibrary.kernels()
+  kernelWorkload = _kernelWorkload(nmbEvents, maxL, seed)
+  blasWorkload   = _blasWorkload  (nmbEvents, maxL, seed)
+  timings: Dict[str, Dict[str, float]] = {"schedule" : {}, "nmbThreads" : {}, "nmbBlasThreads" : {}}
+  previous = OpenMp.effectiveThreadSettings()
+  try:
+    # stage 1: schedule and chunk size
+    OpenMp.setThreadBudget(nmbCpus, verbose = False)
+    scheduleTimes: Dict[Tuple[str, int], float] = {}
+    for schedule in SCHEDULE_CANDIDATES:
+      for chunkSize in CHUNK_SIZE_CANDIDATES:
+        kernels.setOpenMpSchedule(schedule, chunkSize)
+        scheduleTimes[(schedule, chunkSize)] = _minTime(kernelWorkload, nmbRepetitions)
+        timings["schedule"][f"{schedule},{chunkSize}"] = scheduleTimes[(schedule, chunkSize)]
+    schedule, chunkSize = min(scheduleTimes, key = scheduleTimes.get)  # type: ignore
+    kernels.setOpenMpSchedule(schedule, chunkSize)
+    # stage 2: number of OpenMP threads
+    threadTimes: Dict[int, float] = {}
+    for nmbThreads in _threadCandidates(nmbCpus):
+      OpenMp.setThreadBudget(nmbThreads, verbose = False)
+      threadTimes[nmbThreads] = _minTime(kernelWorkload, nmbRepetitions)
+      timings["nmbThreads"][str(nmbThreads)] = threadTimes[nmbThreads]
+    fastestTime = min(threadTimes.values())
+    nmbThreads = min(nmbThreads for nmbThreads, time_ in threadTimes.items() if time_ <= (1 + THREAD_TOLERANCE) * fastestTime)
+    # stage 3: number of BLAS threads
+    blasTimes: Dict[int, float] = {}
+    for nmbBlasThreads in _threadCandidates(nmbCpus):
+      OpenMp.setThreadBudget(nmbThreads, nmbBlasThreads, verbose = False)
+      blasTimes[nmbBlasThreads] = _minTime(blasWorkload, nmbRepetitions)
+      timings["nmbBlasThreads"][str(nmbBlasThreads)] = blasTimes[nmbBlasThreads]
+    fastestTime = min(blasTimes.values())
+    nmbBlasThreads = min(nmbBlasThreads for nmbBlasThreads, time_ in blasTimes.items() if time_ <= (1 + THREAD_TOLERANCE) * fastestTime)
+  finally:
+    OpenMp.restoreThreadSettings(previous)
+  profile = TuningProfile(
+    host           = platform.node(),
+    nmbCpus        = nmbCpus,
+    kernelLibrary  = os.path.basename(KernelLibrary.kernelLibraryFileName()),
+    nmbThreads     = nmbThreads,
+    schedule       = schedule,
+    chunkSize      = chunkSize,
+    nmbBlasThreads = nmbBlasThreads,
+    timings        = timings,
+  )
+  if verbose:
+    print(f"Calibrated tuning profile for {profile}")
+  return profile
+
+
+def loadOrCalibrate(
+  fileName:    Optional[str] = None,   # path of tuning profile; if None, defaultProfileFileName() is used
+  recalibrate: bool          = False,  # if set, the calibration is run even if a valid profile exists
+  verbose:     bool          = True,
+) -> TuningProfile:
+  """Returns tuning profile of this host; the profile is calibrated and saved if it does not exist, if it was calibrated on another host or with another kernel library, or if recalibration is requested
+  Concurrent calibrations are serialized by a lock file, so that jobs started at the same time neither disturb each other's timings nor calibrate more than once.
+  """
+  fileName = fileName or defaultProfileFileName()
+  profile = None if recalibrate else TuningProfile.load(fileName)
+  if profile is not None and profile.isValid():
+    return profile
+  os.makedirs(os.path.dirname(os.path.abspath(fileName)), exist_ok = True)
+  with open(f"{fileName}.lock", "w") as lockFile:
+    fcntl.flock(lockFile, fcntl.LOCK_EX)
+    profile = None if recalibrate else TuningProfile.load(fileName)  # another process may have calibrated in the meantime
+    if profile is None or not profile.isValid():
+      if verbose:
+        print(f"Calibrating thread settings for host '{platform.node()}'; this takes a few seconds")
+      profile = calibrate(verbose = verbose)
+      profile.save(fileName)
+      if verbose:
+        print(f"Wrote tuning profile to '{fileName}'")
+  return profile
+
+
+def applyProfile(
+  profile: TuningProfile,
+  verbose: bool = True,  # if set, the effective settings are printed
+) -> OpenMp.ThreadSettings:
+  """Applies thread counts and OpenMP schedule of the given profile; returns the previous settings, which can be restored by calling OpenMp.restoreThreadSettings()"""
+  previous = OpenMp.setThreadBudget(profile.nmbThreads, profile.nmbBlasThreads, verbose = False)
+  KernelLibrary.kernels().setOpenMpSchedule(profile.schedule, profile.chunkSize)
+  if verbose:
+    print(f"Tuned thread settings: {OpenMp.effectiveThreadSettings()}")
+  return previous
+
+
+def autoTune(verbose: bool = True) -> OpenMp.ThreadSettings:
+  """Applies the tuning profile of this host; if no valid profile exists or auto-tuning is disabled via the environment, the default thread budget is applied instead
+  By default, the calibration is not run within the job, so that it does not add to the job's timings; it is run by executing this module as a script or, if requested via the environment, on demand.
+  Returns the previous settings, which can be restored by calling OpenMp.restoreThreadSettings().
+  """
+  mode = os.environ.get(AUTOTUNE_ENV_VAR, "1")
+  if mode in ("calibrate", "force"):
+    return applyProfile(loadOrCalibrate(recalibrate = (mode == "force"), verbose = verbose), verbose)
+  if mode != "0":
+    fileName = defaultProfileFileName()
+    profile  = TuningProfile.load(fileName)
+    if profile is not None and profile.isValid():
+      return applyProfile(profile, verbose)
+    print(f"No valid tuning profile '{fileName}' for this host; using default thread budget of {DEFAULT_NMB_THREADS} threads. "
+          f"Run `{os.path.basename(__file__)}` once to calibrate or set ${AUTOTUNE_ENV_VAR}=calibrate.")
+  return OpenMp.setThreadBudget(DEFAULT_NMB_THREADS, verbose = verbose)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--events",      type = int, default = 20000, help = "number of events used for the calibration (default: %(default)s)")
+  parser.add_argument("--maxL",        type = int, default = 4,     help = "maximum L of the moments used for the calibration (default: %(default)s)")
+  parser.add_argument("--repetitions", type = int, default = 3,     help = "number of timed calls per candidate (default: %(default)s)")
+  parser.add_argument("--output",      default = None, help = f"file the profile is written to (default: ${TUNING_PROFILE_ENV_VAR} or kernel cache directory)")
+  parser.add_argument("--show",        action = "store_true", help = "print existing profile instead of recalibrating")
+  args = parser.parse_args()
+
+  fileName = args.output or defaultProfileFileName()
+  if args.show:
+    profile = TuningProfile.load(fileName)
+    print(f"Tuning profile '{fileName}': {profile if profile is not None else 'not found'}{'' if profile is None or profile.isValid() else ' (outdated)'}")
+  else:
+    profile = calibrate(args.events, args.maxL, args.repetitions)
+    profile.save(fileName)
+    print(f"Wrote tuning profile to '{fileName}'")
@@ -0,0 +1,332 @@
+"""Module that builds the C++ kernels in `wignerD.C` into a versioned shared library and loads it either into ROOT or via ctypes"""
+
+import ctypes
+from dataclasses import dataclass, field
+import fcntl
+import functools
+import hashlib
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+from typing import (
+  Any,
+  Dict,
+  List,
+  Optional,
+  Tuple,
+)
+
+import numpy as np
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+KERNEL_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# environment variable that points to an already built library; is set by build() so that worker processes inherit it and never invoke the compiler
+KERNEL_LIBRARY_ENV_VAR = "WIGNERD_KERNEL_LIBRARY"
+# environment variable that enables the instrumentation of the batch kernels if set to a value other than '0'; see WIGNERD_INSTRUMENT in `wignerD.h`
+KERNEL_INSTRUMENT_ENV_VAR = "WIGNERD_INSTRUMENT"
+# names of batch kernels and timed functions in the order of the enums KernelId and TimerId in `wignerD.h`
+INSTRUMENTED_KERNEL_NAMES = ("ylmReImTable", "f_phys", "f_physReal", "f_meas", "f_measReal", "intensityPhotoProd", "wignerDReflConj", "wignerD")
+INSTRUMENTED_TIMER_NAMES  = ("sph_legendre", "trig")
+# OpenMP schedule kinds of the batch kernels; values of omp_sched_t
+OPENMP_SCHEDULE_KINDS = {"static" : 1, "dynamic" : 2, "guided" : 3, "auto" : 4}
+
+
+def _rootConfig(*options: str) -> str:
+  """Returns output of `root-config` for the given options"""
+  try:
+    return subprocess.run(["root-config", *options], check = True, stdout = subprocess.PIPE, universal_newlines = True).stdout.strip()
+  except FileNotFoundError:
+    # the kernels use ROOT::Math::sph_legendre() and TF3, so the library is always built against and linked to the ROOT libraries
+    raise RuntimeError("Cannot build kernel library: `root-config` not found. The kernels require the ROOT libraries (including MathMore) at build time and at runtime, "
+                       f"also when moments are calculated from NumPy arrays via ctypes; set up ROOT or point ${KERNEL_LIBRARY_ENV_VAR} to a library built on a machine with the same ROOT installation.") from None
+
+
+def _openMpFlags() -> Tuple[List[str], List[str]]:
+  """Returns compiler and linker flags for OpenMP; see also OpenMp.enableRootACLiCOpenMp()"""
+  if sys.platform == "darwin":
+    # !Note! MacOS (Apple does not ship libomp; needs to be installed via MacPorts or Homebrew)
+    return ["-Xpreprocessor", "-fopenmp", "-I/opt/local/include/libomp"], ["-L/opt/local/lib/libomp", "-lomp"]
+  return ["-fopenmp"], ["-lgomp"]
+
+
+@dataclass
+class KernelLibrary:
+  """Builds the kernels into a shared library whose file name contains a hash of the sources, the compiler, and the flags, so that the library is built only once and can be shared by all jobs"""
+  sourceFileName: str             = os.path.join(KERNEL_SOURCE_DIR, "wignerD.C")
+  headerFileName: str             = os.path.join(KERNEL_SOURCE_DIR, "wignerD.h")
+  cacheDir:       str             = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "photoProdKernels")  # shared by all jobs of the user
+  optFlags:       Tuple[str, ...] = ("-O3", "-fPIC")
+  instrument:     bool            = field(default_factory = lambda: os.environ.get(KERNEL_INSTRUMENT_ENV_VAR, "0") not in ("", "0"))  # if set, the kernels are built with hot-path counters
+  _buildConfig:   Optional[Tuple[List[str], List[str], List[str]]] = field(default = None, init = False, repr = False)  # cached (compiler, compiler flags, linker flags)
+
+  @property
+  def buildConfig(self) -> Tuple[List[str], List[str], List[str]]:
+    """Returns compiler command, compiler flags, and linker flags; the compiler defaults to the one used to build ROOT"""
+    if self._buildConfig is None:
+      compiler = shlex.split(os.environ.get("CXX", _rootConfig("--cxx")))
+      ompCompileFlags, ompLinkFlags = _openMpFlags()
+      compileFlags = shlex.split(_rootConfig("--cflags")) + list(self.optFlags) + ompCompileFlags + (["-DWIGNERD_INSTRUMENT"] if self.instrument else [])
+      linkFlags    = ["-shared"] + shlex.split(_rootConfig("--libs")) + ["-lMathMore"] + ompLinkFlags
+      self._buildConfig = (compiler, compileFlags, linkFlags)
+    return self._buildConfig
+
+  @property
+  def buildKey(self) -> str:
+    """Hash of the kernel sources, the compiler version, and all flags"""
+    compiler, compileFlags, linkFlags = self.buildConfig
+    compilerVersion = subprocess.run(compiler + ["--version"], check = True, stdout = subprocess.PIPE, universal_newlines = True).stdout
+    hasher = hashlib.sha256()
+    for fileName in (self.sourceFileName, self.headerFileName):
+      with open(fileName, "rb") as sourceFile:
+        hasher.update(sourceFile.read())
+    hasher.update("\0".join([compilerVersion] + compiler + compileFlags + linkFlags).encode())
+    return hasher.hexdigest()[:16]
+
+  @property
+  def libraryFileName(self) -> str:
+    """Path of the versioned shared library"""
+    return os.path.join(self.cacheDir, f"libWignerD.{self.buildKey}.so")
+
+  def build(self) -> str:
+    """Builds the shared library unless it is already in the cache and returns its path; concurrent builds are serialized by a lock file"""
+    libraryFileName = self.libraryFileName
+    if not os.path.exists(libraryFileName):
+      os.makedirs(self.cacheDir, exist_ok = True)
+      with open(os.path.join(self.cacheDir, ".lock"), "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        if not os.path.exists(libraryFileName):  # another process may have built the library in the meantime
+          compiler, compileFlags, linkFlags = self.buildConfig
+          print(f"Building kernel library '{libraryFileName}'")
+          # compile into temporary file and rename it, so that other processes never see a partially written library
+          fd, tmpFileName = tempfile.mkstemp(suffix = ".so", dir = self.cacheDir)
+          os.close(fd)
+          try:
+            subprocess.run(compiler + compileFlags + [self.sourceFileName, "-o", tmpFileName] + linkFlags, check = True)
+            os.replace(tmpFileName, libraryFileName)
+          finally:
+            if os.path.exists(tmpFileName):
+              os.remove(tmpFileName)
+    os.environ[KERNEL_LIBRARY_ENV_VAR] = libraryFileName
+    return libraryFileName
+
+
+def kernelLibraryFileName() -> str:
+  """Returns path of the kernel library; uses library given by environment variable if set, otherwise the library is built if needed"""
+  return os.environ.get(KERNEL_LIBRARY_ENV_VAR) or KernelLibrary().build()
+
+
+@functools.lru_cache(maxsize = None)
+def loadKernelsInRoot() -> None:
+  """Loads kernel library into ROOT and declares the kernels to the ROOT interpreter, so that they can be used in PyROOT, TFormula, and RDataFrame expressions"""
+  import ROOT
+  if ROOT.gSystem.Load(kernelLibraryFileName()) < 0:
+    raise RuntimeError(f"Could not load kernel library '{kernelLibraryFileName()}'")
+  # the header must see the same instrumentation setting as the library
+  ROOT.gInterpreter.Declare(("#define WIGNERD_INSTRUMENT\n" if kernels().instrumented else "") + f'#include "{KernelLibrary().headerFileName}"')
+
+
+_doublePtr = np.ctypeslib.ndpointer(dtype = np.float64, flags = "C_CONTIGUOUS")
+
+
+class KernelBinding:
+  """Lightweight ctypes binding to the C interface of the kernel library that works on NumPy arrays and does not require the ROOT interpreter; the library itself is linked to the ROOT libraries, which therefore must be installed"""
+
+  def __init__(self, libraryFileName: str) -> None:
+    self._lib = ctypes.CDLL(libraryFileName)
+    self._lib.getNmbOpenMpThreadsC.restype  = ctypes.c_int
+    self._lib.getNmbOpenMpThreadsC.argtypes = []
+    self._lib.setNmbOpenMpThreadsC.restype  = None
+    self._lib.setNmbOpenMpThreadsC.argtypes = [ctypes.c_int]
+    self._lib.getOpenMpScheduleC.restype  = None
+    self._lib.getOpenMpScheduleC.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+    self._lib.setOpenMpScheduleC.restype  = None
+    self._lib.setOpenMpScheduleC.argtypes = [ctypes.c_int, ctypes.c_int]
+    self._lib.wignerDC.restype  = None
+    self._lib.wignerDC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr]
+    self._lib.wignerDReflConjC.restype  = None
+    self._lib.wignerDReflConjC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr]
+    self._lib.ylmReImTableC.restype  = None
+    self._lib.ylmReImTableC.argtypes = [ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr]
+    self._lib.f_physC.restype  = None
+    self._lib.f_physC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr, ctypes.c_double, _doublePtr]
+    self._lib.f_physRealC.restype  = None
+    self._lib.f_physRealC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr, ctypes.c_double, _doublePtr]
+    self._lib.f_measC.restype  = None
+    self._lib.f_measC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr, ctypes.c_double, _doublePtr]
+    self._lib.f_measRealC.restype  = None
+    self._lib.f_measRealC.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr, ctypes.c_double, _doublePtr]
+    self._lib.intensityPhotoProdC.restype  = None
+    self._lib.intensityPhotoProdC.argtypes = [ctypes.c_size_t, _doublePtr, _doublePtr, _doublePtr, _doublePtr, _doublePtr]
+    self._lib.instrumentationEnabledC.restype  = ctypes.c_int
+    self._lib.instrumentationEnabledC.argtypes = []
+    self._lib.maxNmbInstrumentedThreadsC.restype  = ctypes.c_int
+    self._lib.maxNmbInstrumentedThreadsC.argtypes = []
+    self._lib.resetKernelCountersC.restype  = None
+    self._lib.resetKernelCountersC.argtypes = []
+    self._lib.getKernelCountersC.restype  = None
+    self._lib.getKernelCountersC.argtypes = [ctypes.c_int, _doublePtr, _doublePtr]
+    self._lib.getTimerCountersC.restype  = None
+    self._lib.getTimerCountersC.argtypes = [ctypes.c_int, _doublePtr, _doublePtr]
+
+  def getNmbOpenMpThreads(self) -> int:
+    """Returns number of threads used by OpenMP"""
+    return self._lib.getNmbOpenMpThreadsC()
+
+  def setNmbOpenMpThreads(self, nmbThreads: int) -> None:
+    """Sets number of threads used by OpenMP"""
+    self._lib.setNmbOpenMpThreadsC(nmbThreads)
+
+  def getOpenMpSchedule(self) -> Tuple[str, int]:
+    """Returns OpenMP schedule kind and chunk size of the event loops of the batch kernels; chunk size 0 means the default chunk size of the schedule"""
+    kind      = ctypes.c_int()
+    chunkSize = ctypes.c_int()
+    self._lib.getOpenMpScheduleC(ctypes.byref(kind), ctypes.byref(chunkSize))
+    kindNames = {value: name for name, value in OPENMP_SCHEDULE_KINDS.items()}
+    return kindNames.get(kind.value, str(kind.value)), max(chunkSize.value, 0)
+
+  def setOpenMpSchedule(self, kind: str, chunkSize: int = 0) -> None:
+    """Sets OpenMP schedule kind, i.e. 'static', 'dynamic', 'guided', or 'auto', and chunk size of the event loops of the batch kernels; chunk size 0 selects the default chunk size of the schedule"""
+    if kind not in OPENMP_SCHEDULE_KINDS:
+      raise ValueError(f"Unknown OpenMP schedule '{kind}'; must be one of {list(OPENMP_SCHEDULE_KINDS.keys())}")
+    self._lib.setOpenMpScheduleC(OPENMP_SCHEDULE_KINDS[kind], chunkSize)
+
+  def wignerD(self, twoJ: int, twoM1: int, twoM2: int, phi: np.ndarray, theta: np.ndarray) -> np.ndarray:
+    """Returns complex Wigner D-function values D^J_{M1 M2}^*(phi, theta, 0) for each event; quantum numbers are given in units of hbar/2"""
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    DFuncVals = np.empty(2 * len(theta), dtype = np.float64)
+    self._lib.wignerDC(twoJ, twoM1, twoM2, len(theta), phi, theta, DFuncVals)
+    return DFuncVals.view(np.complex128)
+
+  def wignerDReflConj(self, twoJ: int, twoM1: int, twoM2: int, P: int, refl: int, phi: np.ndarray, theta: np.ndarray) -> np.ndarray:
+    """Returns complex conjugated Wigner D-function values in reflectivity basis for each event; see wignerDReflConj() in `wignerD.C`"""
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    DFuncVals = np.empty(2 * len(theta), dtype = np.float64)
+    self._lib.wignerDReflConjC(twoJ, twoM1, twoM2, P, refl, len(theta), phi, theta, DFuncVals)
+    return DFuncVals.view(np.complex128)
+
+  def ylmReImTable(self, maxL: int, theta: np.ndarray, phi: np.ndarray) -> np.ndarray:
+    """Returns table with real and imaginary parts of spherical harmonics of shape (2 * nmbLM, nmbEvents); see ylmReImTable() in `wignerD.C`"""
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    nmbLM = (maxL + 1) * (maxL + 2) // 2
+    table = np.empty((2 * nmbLM, len(theta)), dtype = np.float64)
+    self._lib.ylmReImTableC(maxL, len(theta), theta, phi, table)
+    return table
+
+  def f_phys(self, momentIndex: int, L: int, M: int, theta: np.ndarray, phi: np.ndarray, Phi: np.ndarray, polarization: float) -> np.ndarray:
+    """Returns complex values of basis function for physical moments for each event; see f_phys() in `wignerD.C`"""
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    Phi   = np.ascontiguousarray(Phi,   dtype = np.float64)
+    fcnValues = np.empty(2 * len(theta), dtype = np.float64)
+    self._lib.f_physC(momentIndex, L, M, len(theta), theta, phi, Phi, polarization, fcnValues)
+    return fcnValues.view(np.complex128)
+
+  def f_physReal(self, momentIndex: int, L: int, M: int, theta: np.ndarray, phi: np.ndarray, Phi: np.ndarray, polarization: float) -> np.ndarray:
+    """Returns values of real-valued basis function for physical moments for each event; see f_physReal() in `wignerD.C`"""
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    Phi   = np.ascontiguousarray(Phi,   dtype = np.float64)
+    fcnValues = np.empty(len(theta), dtype = np.float64)
+    self._lib.f_physRealC(momentIndex, L, M, len(theta), theta, phi, Phi, polarization, fcnValues)
+    return fcnValues
+
+  def f_meas(self, momentIndex: int, L: int, M: int, theta: np.ndarray, phi: np.ndarray, Phi: np.ndarray, polarization: float) -> np.ndarray:
+    """Returns complex values of basis function for measured moments for each event; see f_meas() in `wignerD.C`"""
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    Phi   = np.ascontiguousarray(Phi,   dtype = np.float64)
+    fcnValues = np.empty(2 * len(theta), dtype = np.float64)
+    self._lib.f_measC(momentIndex, L, M, len(theta), theta, phi, Phi, polarization, fcnValues)
+    return fcnValues.view(np.complex128)
+
+  def f_measReal(self, momentIndex: int, L: int, M: int, theta: np.ndarray, phi: np.ndarray, Phi: np.ndarray, polarization: float) -> np.ndarray:
+    """Returns values of real-valued basis function for measured moments for each event; see f_measReal() in `wignerD.C`"""
+    theta = np.ascontiguousarray(theta, dtype = np.float64)
+    phi   = np.ascontiguousarray(phi,   dtype = np.float64)
+    Phi   = np.ascontiguousarray(Phi,   dtype = np.float64)
+    fcnValues = np.empty(len(theta), dtype = np.float64)
+    self._lib.f_measRealC(momentIndex, L, M, len(theta), theta, phi, Phi, polarization, fcnValues)
+    return fcnValues
+
+  def intensityPhotoProd(self, cosTheta: np.ndarray, phiDeg: np.ndarray, PhiDeg: np.ndarray, par: np.ndarray) -> np.ndarray:
+    """Returns intensity for each event; see intensityPhotoProd() in `wignerD.C` for the parameters"""
+    cosTheta = np.ascontiguousarray(cosTheta, dtype = np.float64)
+    phiDeg   = np.ascontiguousarray(phiDeg,   dtype = np.float64)
+    PhiDeg   = np.ascontiguousarray(PhiDeg,   dtype = np.float64)
+    par      = np.ascontiguousarray(par,      dtype = np.float64)
+    intensities = np.empty(len(cosTheta), dtype = np.float64)
+    self._lib.intensityPhotoProdC(len(cosTheta), cosTheta, phiDeg, PhiDeg, par, intensities)
+    return intensities
+
+  @property
+  def instrumented(self) -> bool:
+    """Returns whether the library was built with hot-path counters"""
+    return bool(self._lib.instrumentationEnabledC())
+
+  def resetKernelCounters(self) -> None:
+    """Sets all hot-path counters to zero"""
+    self._lib.resetKernelCountersC()
+
+  def kernelCounters(self) -> Dict[str, Dict[str, Any]]:
+    """Returns hot-path counters accumulated since the library was loaded or the counters were reset
+    For each batch kernel: number of calls and events, wall time, event throughput, time each OpenMP thread spent in the event loops, and load imbalance, i.e. time of the slowest thread divided by the mean time per thread averaged over calls weighted by time.
+    For sph_legendre and the trigonometric functions: number of calls and time per thread.
+    Timing individual function calls has an overhead of a few 10 ns per call, so that the timers indicate relative rather than absolute costs.
+    """
+    if not self.instrumented:
+      raise RuntimeError(f"Kernel library was built without instrumentation; set the environment variable {KERNEL_INSTRUMENT_ENV_VAR}=1 to build an instrumented library")
+    maxNmbThreads = self._lib.maxNmbInstrumentedThreadsC()
+    counters: Dict[str, Dict[str, Any]] = {}
+    for kernelId, kernelName in enumerate(INSTRUMENTED_KERNEL_NAMES):
+      stats       = np.empty(5,             dtype = np.float64)
+      threadTimes = np.empty(maxNmbThreads, dtype = np.float64)
+      self._lib.getKernelCountersC(kernelId, stats, threadTimes)
+      nmbCalls, nmbEvents, wallTime, sumOfMeanThreadTimes, sumOfMaxThreadTimes = stats
+      counters[kernelName] = {
+        "nmbCalls"      : int(nmbCalls),
+        "nmbEvents"     : int(nmbEvents),
+        "wallTime"      : wallTime,
+        "eventsPerSec"  : nmbEvents / wallTime if wallTime > 0 else None,
+        "threadTimes"   : np.trim_zeros(threadTimes, "b"),
+        "loadImbalance" : sumOfMaxThreadTimes / sumOfMeanThreadTimes if sumOfMeanThreadTimes > 0 else None,
+      }
+    for timerId, timerName in enumerate(INSTRUMENTED_TIMER_NAMES):
+      times  = np.empty(maxNmbThreads, dtype = np.float64)
+      counts = np.empty(maxNmbThreads, dtype = np.float64)
+      self._lib.getTimerCountersC(timerId, times, counts)
+      counters[timerName] = {
+        "nmbCalls"    : int(np.sum(counts)),
+        "time"        : float(np.sum(times)),
+        "threadTimes" : np.trim_zeros(times, "b"),
+      }
+    return counters
+
+  def kernelCountersSummary(self) -> str:
+    """Returns table with hot-path counters"""
+    counters = self.kernelCounters()
+    lines = [f"{'kernel':<20}{'calls':>8} {'events':>12} {'wall [s]':>10} {'events/s':>12} {'threads':>8} {'imbalance':>10}"]
+    for kernelName in INSTRUMENTED_KERNEL_NAMES:
+      kernel = counters[kernelName]
+      if kernel["nmbCalls"] == 0:
+        continue
+      lines.append(f"{kernelName:<20}{kernel['nmbCalls']:>8} {kernel['nmbEvents']:>12} {kernel['wallTime']:10.3f} {kernel['eventsPerSec'] or 0:12.4g} "
+                   f"{len(kernel['threadTimes']):>8} {kernel['loadImbalance'] or 0:10.3f}")
+    for timerName in INSTRUMENTED_TIMER_NAMES:
+      timer = counters[timerName]
+      lines.append(f"{timerName:<20}{timer['nmbCalls']:>8} calls; {timer['time']:.3f} s summed over threads")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize = None)
+def kernels() -> KernelBinding:
+  """Returns ctypes binding to the kernel library; the library is loaded on first call"""
+  return KernelBinding(kernelLibraryFileName())
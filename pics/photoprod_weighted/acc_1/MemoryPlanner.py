@@ -0,0 +1,255 @@
+"""Module that predicts the peak memory consumption of the moment calculation from the problem size and picks chunk sizes that fit into a memory budget before any work starts"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import functools
+import os
+from typing import (
+  Callable,
+  Dict,
+  Optional,
+  Union,
+)
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+MEMORY_BUDGET_ENV_VAR_NAME = "MOMENTS_MEMORY_BUDGET"  # environment variable that overrides the default memory budget, e.g. '8G'
+DEFAULT_MEMORY_FRACTION    = 0.5     # fraction of the available physical memory that is used as default memory budget
+FALLBACK_MEMORY_BUDGET     = 4 << 30  # [bytes] default memory budget if the available memory cannot be determined
+PREFERRED_NMB_EVENTS_PER_CHUNK = 100000  # larger chunks do not make the calculation faster but increase the memory footprint
+MIN_NMB_EVENTS_PER_CHUNK       = 1000    # smaller chunks make the calculation prohibitively slow; configurations that would require them are refused
+FLOAT_SIZE   = 8   # [bytes] size of np.float64 and np.int64
+COMPLEX_SIZE = 16  # [bytes] size of np.complex128
+
+
+def parseMemorySize(size: Union[int, float, str]) -> int:
+  """Returns memory size in bytes; strings may have one of the suffixes K, M, G, or T, which denote powers of 1024"""
+  if not isinstance(size, str):
+    return int(size)
+  size = size.strip().upper().rstrip("B").rstrip("I")  # accept e.g. '8G', '8GB', and '8GiB'
+  exponents = {"K" : 1, "M" : 2, "G" : 3, "T" : 4}
+  if size and size[-1] in exponents:
+    return int(float(size[:-1]) * 1024**exponents[size[-1]])
+  return int(float(size))
+
+
+def formatMemorySize(nmbBytes: float) -> str:
+  """Returns memory size in human-readable form"""
+  for unit in ("B", "KiB", "MiB", "GiB"):
+    if abs(nmbBytes) < 1024:
+      return f"{nmbBytes:.1f} {unit}"
+    nmbBytes /= 1024
+  return f"{nmbBytes:.1f} TiB"
+
+
+def availableMemory() -> Optional[int]:
+  """Returns available physical memory in bytes or None if it cannot be determined
+  On Linux, MemAvailable from /proc/meminfo is used, which includes reclaimable page cache; the free memory reported by SC_AVPHYS_PAGES excludes it and is far too small on long-running nodes.
+  """
+  try:
+    with open("/proc/meminfo") as memInfoFile:
+      for line in memInfoFile:
+        if line.startswith("MemAvailable:"):
+          return int(line.split()[1]) * 1024  # kB
+  except (OSError, ValueError, IndexError):
+    pass
+  try:
+    import psutil
+    return int(psutil.virtual_memory().available)
+  except ImportError:
+    pass
+  try:
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+  except (AttributeError, ValueError, OSError):  # not available on all platforms
+    return None
+
+
+def defaultMemoryBudget() -> int:
+  """Returns memory budget in bytes that is used if none is given; it is taken from the environment variable MOMENTS_MEMORY_BUDGET or is a fraction of the available physical memory"""
+  if MEMORY_BUDGET_ENV_VAR_NAME in os.environ:
+    return parseMemorySize(os.environ[MEMORY_BUDGET_ENV_VAR_NAME])
+  available = availableMemory()
+  return int(DEFAULT_MEMORY_FRACTION * available) if available is not None else FALLBACK_MEMORY_BUDGET
+
+
+@dataclass
+class MemoryEstimate:
+  """Stores predicted memory consumption in bytes for each component of a calculation"""
+  components: Dict[str, int] = field(default_factory = dict)  # predicted number of bytes for each component
+
+  @property
+  def total(self) -> int:
+    """Returns predicted peak memory consumption"""
+    return sum(self.components.values())
+
+  def __str__(self) -> str:
+    return ", ".join(f"{name} = {formatMemorySize(nmbBytes)}" for name, nmbBytes in self.components.items()) + f"; total = {formatMemorySize(self.total)}"
+
+
+@dataclass(frozen = True)  # immutable
+class MemoryPlan:
+  """Stores chunk sizes and number of workers picked by the planner together with the predicted memory consumption"""
+  calculation:         str                   # name of calculation the plan was made for
+  estimate:            MemoryEstimate        # predicted memory consumption for the picked settings
+  memoryBudget:        int                   # [bytes] memory budget the plan was made for
+  nmbEventsPerChunk:   Optional[int] = None  # number of events that are processed at once; None if not applicable
+  nmbReplicasPerBlock: Optional[int] = None  # number of bootstrap replicas that are processed at once; None if not applicable
+  nmbWorkers:          int           = 1     # number of workers that run in parallel
+  downscaled:          bool          = False  # indicates whether requested settings were reduced to fit into the budget
+
+  def __str__(self) -> str:
+    settings = [f"{name} = {value}" for name, value in (("nmbEventsPerChunk", self.nmbEventsPerChunk), ("nmbReplicasPerBlock", self.nmbReplicasPerBlock), ("nmbWorkers", self.nmbWorkers)) if value is not None]
+    return (f"Memory plan for {self.calculation}: {', '.join(settings)}{' (downscaled)' if self.downscaled else ''}; "
+            f"predicted peak = {formatMemorySize(self.estimate.total)} of budget {formatMemorySize(self.memoryBudget)}\n    {self.estimate}")
+
+
+def integralMatrixMemory(
+  nmbEvents:         int,  # number of phase-space events
+  maxL:              int,  # maximum L of moments
+  nmbEventsPerChunk: int,  # number of phase-space events that are processed at once
+  nmbWeightSets:     int = 1,  # number of sets of per-event weights; see AcceptanceIntegralMatrix.calculateForWeights()
+  nmbWorkers:        int = 1,  # number of kinematic bins that are processed in parallel
+) -> MemoryEstimate:
+  """Returns predicted memory consumption of AcceptanceIntegralMatrix.calculate() and calculateForWeights()"""
+  nmbRows  = (maxL + 1) * (maxL + 2)  # number of rows of table returned by ylmReImTable()
+  nmbPairs = 5                        # number of products of Phi harmonics that are summed explicitly
+  chunk    = min(nmbEventsPerChunk, nmbEvents)
+  return MemoryEstimate({name : nmbWorkers * nmbBytes for name, nmbBytes in {
+    "input columns"         : (3 + nmbWeightSets) * nmbEvents * FLOAT_SIZE,
+    "Ylm table"             : nmbRows * chunk * FLOAT_SIZE,
+    "Phi harmonics"         : (3 + nmbPairs + nmbWeightSets * nmbPairs) * chunk * FLOAT_SIZE,
+    "shifted Ylm table"     : nmbRows * chunk * FLOAT_SIZE,  # relative to reference point
+    "weighted Ylm table"    : nmbRows * chunk * FLOAT_SIZE,  # one factor row at a time
+    "harmonic sums"         : nmbWeightSets * (nmbPairs + 2 * 9) * nmbRows**2 * FLOAT_SIZE,  # sums and sums about the mean
+  }.items()})
+
+
+def momentsMemory(
+  nmbEvents:         int,   # number of data events
+  nmbMoments:        int,   # number of moments, i.e. len(MomentIndices)
+  realValued:        bool,  # if set, moments are calculated in the real-valued layout
+  nmbEventsPerChunk: int,   # number of events that are processed at once
+  nmbWorkers:        int = 1,  # number of kinematic bins that are processed in parallel
+) -> MemoryEstimate:
+  """Returns predicted memory consumption of MomentCalculator.calculateMoments() with linear uncertainty propagation"""
+  itemSize = FLOAT_SIZE if realValued else COMPLEX_SIZE
+  chunk    = min(nmbEventsPerChunk, nmbEvents)
+  return MemoryEstimate({name : nmbWorkers * nmbBytes for name, nmbBytes in {
+    "input columns"         : 4 * nmbEvents * FLOAT_SIZE,
+    "basis-function values" : (3 * nmbMoments + 1) * chunk * itemSize,  # values, weighted values, conjugated values, and one kernel result
+    "sums of products"      : (1 if realValued else 2) * nmbMoments**2 * itemSize,
+    "covariance matrices"   : 2 * (1 if realValued else 4) * nmbMoments**2 * itemSize,  # measured and physical moments; augmented in complex-valued mode
+  }.items()})
+
+
+def bootstrapMemory(
+  nmbEvents:           int,   # number of data events
+  nmbMoments:          int,   # number of moments, i.e. len(MomentIndices)
+  realValued:          bool,  # if set, moments are calculated in the real-valued layout
+  nmbReplicas:         int,   # total number of bootstrap replicas
+  nmbReplicasPerBlock: int,   # number of replicas that are processed at once by one worker
+  nmbWorkers:          int,   # number of threads that process replica blocks in parallel
+) -> MemoryEstimate:
+  """Returns predicted memory consumption of MomentCalculator.calculateMoments() with bootstrap estimation of the covariances"""
+  itemSize = FLOAT_SIZE if realValued else COMPLEX_SIZE
+  return MemoryEstimate({
+    "input columns"         : 4 * nmbEvents * FLOAT_SIZE,
+    "basis-function values" : 2 * nmbMoments * nmbEvents * itemSize,  # values and transposed copy
+    "replica weights"       : nmbWorkers * 2 * nmbReplicasPerBlock * nmbEvents * FLOAT_SIZE,  # counts and weighted counts of each block
+    "replica moments"       : 4 * nmbReplicas * nmbMoments * itemSize,  # measured and physical moments of all replicas and their concatenation
+  })
+
+
+def _planNmbEventsPerChunk(
+  calculation:       str,  # name of calculation used in messages
+  estimate:          Callable[[int], MemoryEstimate],  # returns predicted memory consumption for given number of events per chunk
+  nmbEvents:         int,  # number of events
+  memoryBudget:      int,  # [bytes]
+  nmbEventsPerChunk: Optional[int],  # requested number of events per chunk; None lets the planner choose
+  allowDownscale:    bool,
+  nmbWorkers:        int,
+) -> MemoryPlan:
+  """Returns plan with the largest number of events per chunk up to the requested or preferred value that fits into the memory budget; raises MemoryError if no such value exists or if the requested value does not fit and downscaling is not allowed"""
+  # memory consumption is linear in the chunk size
+  fixedBytes    = estimate(0).total
+  bytesPerEvent = estimate(1).total - fixedBytes
+  maxNmbEventsPerChunk = (memoryBudget - fixedBytes) // bytesPerEvent if bytesPerEvent > 0 else nmbEvents
+  targetNmbEventsPerChunk = min(nmbEventsPerChunk or PREFERRED_NMB_EVENTS_PER_CHUNK, max(nmbEvents, 1))
+  if maxNmbEventsPerChunk >= targetNmbEventsPerChunk:
+    return MemoryPlan(calculation, estimate(targetNmbEventsPerChunk), memoryBudget, nmbEventsPerChunk = targetNmbEventsPerChunk, nmbWorkers = nmbWorkers)
+  message = (f"{calculation} with {nmbEvents} events and {targetNmbEventsPerChunk} events per chunk requires {formatMemorySize(estimate(targetNmbEventsPerChunk).total)} "
+             f"but memory budget is {formatMemorySize(memoryBudget)}")
+  if nmbEventsPerChunk is not None and not allowDownscale:
+    raise MemoryError(message + "; reduce the number of events per chunk or increase the budget")
+  if maxNmbEventsPerChunk < min(MIN_NMB_EVENTS_PER_CHUNK, targetNmbEventsPerChunk):
+    raise MemoryError(message + f"; even with the minimum chunk size the calculation would require {formatMemorySize(estimate(MIN_NMB_EVENTS_PER_CHUNK).total)}; "
+                      "reduce the number of events, the maximum L, or the number of workers, or increase the budget")
+  return MemoryPlan(calculation, estimate(maxNmbEventsPerChunk), memoryBudget, nmbEventsPerChunk = maxNmbEventsPerChunk, nmbWorkers = nmbWorkers, downscaled = True)
+
+
+def planIntegralMatrix(
+  nmbEvents:         int,  # number of phase-space events
+  maxL:              int,  # maximum L of moments
+  nmbWeightSets:     int = 1,     # number of sets of per-event weights
+  memoryBudget:      Optional[Union[int, str]] = None,  # if None, defaultMemoryBudget() is used
+  nmbEventsPerChunk: Optional[int] = None,  # requested number of events per chunk; None lets the planner choose
+  allowDownscale:    bool = True,  # if set, a requested number of events per chunk that does not fit is reduced; otherwise MemoryError is raised
+  nmbWorkers:        int = 1,     # number of kinematic bins that are processed in parallel
+) -> MemoryPlan:
+  """Returns number of events per chunk for the calculation of the acceptance integral matrix that fits into the memory budget"""
+  return _planNmbEventsPerChunk(
+    "acceptance integral matrix",
+    lambda chunk: integralMatrixMemory(nmbEvents, maxL, chunk, nmbWeightSets, nmbWorkers),
+    nmbEvents, parseMemorySize(memoryBudget) if memoryBudget is not None else defaultMemoryBudget(), nmbEventsPerChunk, allowDownscale, nmbWorkers)
+
+
+def planMoments(
+  nmbEvents:         int,   # number of data events
+  nmbMoments:        int,   # number of moments, i.e. len(MomentIndices)
+  realValued:        bool,  # if set, moments are calculated in the real-valued layout
+  memoryBudget:      Optional[Union[int, str]] = None,  # if None, defaultMemoryBudget() is used
+  nmbEventsPerChunk: Optional[int] = None,  # requested number of events per chunk; None lets the planner choose
+  allowDownscale:    bool = True,  # if set, a requested number of events per chunk that does not fit is reduced; otherwise MemoryError is raised
+  nmbWorkers:        int = 1,     # number of kinematic bins that are processed in parallel
+) -> MemoryPlan:
+  """Returns number of events per chunk for the calculation of the measured moments and their covariances that fits into the memory budget"""
+  return _planNmbEventsPerChunk(
+    "moments",
+    lambda chunk: momentsMemory(nmbEvents, nmbMoments, realValued, chunk, nmbWorkers),
+    nmbEvents, parseMemorySize(memoryBudget) if memoryBudget is not None else defaultMemoryBudget(), nmbEventsPerChunk, allowDownscale, nmbWorkers)
+
+
+def planBootstrap(
+  nmbEvents:           int,   # number of data events
+  nmbMoments:          int,   # number of moments, i.e. len(MomentIndices)
+  realValued:          bool,  # if set, moments are calculated in the real-valued layout
+  nmbReplicas:         int,   # total number of bootstrap replicas
+  nmbReplicasPerBlock: int,   # requested number of replicas per block
+  nmbWorkers:          int,   # requested number of threads
+  memoryBudget:        Optional[Union[int, str]] = None,  # if None, defaultMemoryBudget() is used
+  allowDownscale:      bool = True,  # if set, settings that do not fit are reduced; otherwise MemoryError is raised
+) -> MemoryPlan:
+  """Returns number of replicas per block and number of threads for the bootstrap estimation of the covariances that fit into the memory budget
+  The number of threads is reduced first, because the results do not depend on it; the number of replicas per block is reduced only if a single thread does not fit, which changes the random-number streams of the replicas.
+  """
+  budget   = parseMemorySize(memoryBudget) if memoryBudget is not None else defaultMemoryBudget()
+  estimate = lambda perBlock, workers: bootstrapMemory(nmbEvents, nmbMoments, realValued, nmbReplicas, perBlock, workers)
+  nmbReplicasPerBlock = min(nmbReplicasPerBlock, nmbReplicas)
+  if estimate(nmbReplicasPerBlock, nmbWorkers).total <= budget:
+    return MemoryPlan("bootstrap", estimate(nmbReplicasPerBlock, nmbWorkers), budget, nmbReplicasPerBlock = nmbReplicasPerBlock, nmbWorkers = nmbWorkers)
+  message = (f"bootstrap with {nmbEvents} events, {nmbReplicasPerBlock} replicas per block, and {nmbWorkers} threads requires "
+             f"{formatMemorySize(estimate(nmbReplicasPerBlock, nmbWorkers).total)} but memory budget is {formatMemorySize(budget)}")
+  if not allowDownscale:
+    raise MemoryError(message + "; reduce the number of replicas per block or of threads, or increase the budget")
+  for workers in range(nmbWorkers - 1, 0, -1):
+    if estimate(nmbReplicasPerBlock, workers).total <= budget:
+      return MemoryPlan("bootstrap", estimate(nmbReplicasPerBlock, workers), budget, nmbReplicasPerBlock = nmbReplicasPerBlock, nmbWorkers = workers, downscaled = True)
+  for perBlock in range(nmbReplicasPerBlock - 1, 0, -1):
+    if estimate(perBlock, 1).total <= budget:
+      return MemoryPlan("bootstrap", estimate(perBlock, 1), budget, nmbReplicasPerBlock = perBlock, nmbWorkers = 1, downscaled = True)
+  raise MemoryError(message + f"; even a single replica per block in a single thread would require {formatMemorySize(estimate(1, 1).total)}; "
+                    "reduce the number of events or replicas, or increase the budget")
@@ -4,28 +4,39 @@
 
 from __future__ import annotations
 
-import bidict as bd
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field, fields, InitVar
 import dataclasses
 from enum import Enum
 import functools
 import numpy as np
-import nptyping as npt
+import os
 from typing import (
+  ContextManager,
   Dict,
   Generator,
   Iterator,
   List,
+  Mapping,
   Optional,
   overload,
   Sequence,
   Tuple,
+  TYPE_CHECKING,
   Union,
 )
 #TODO switch from int for indices to SupportsIndex; but this requires Python 3.8+
 
-import py3nj
-import ROOT
+import KernelLibrary
+import MemoryPlanner
+import ProfilingUtilities
+
+# the numeric core of this module depends only on NumPy
+# the modules below are either needed only for type annotations or are imported on first use, so that importing this module is fast
+if TYPE_CHECKING:
+  import bidict as bd
+  import nptyping as npt
+  import ROOT
 
 
 # always flush print() to reduce garbling of log files due to buffering
@@ -133,6 +144,7 @@ class AmplitudeSet:
   ) -> Tuple[complex, complex, complex]:
     """Returns moments (H_0, H_1, H_2) with given quantum numbers calculated from partial-wave amplitudes assuming rank 1"""
     # Eqs. (154) to (156) assuming that rank is 1
+    import py3nj
     moments: List[complex] = 3 * [0 + 0j]
     for refl in (-1, +1):
       for amp1 in self.amplitudes(onlyRefl = refl):
@@ -159,7 +171,7 @@ class AmplitudeSet:
   ) -> MomentResult:
     """Returns moments calculated from partial-wave amplitudes assuming rank 1; the H_2(L, 0) are omitted"""
     momentIndices = MomentIndices(maxL)
-    momentsFlatIndex = np.zeros((len(momentIndices), ), dtype = npt.Complex128)
+    momentsFlatIndex = np.zeros((len(momentIndices), ), dtype = np.complex128)
     norm = 1.0
     for L in range(maxL + 1):
       for M in range(L + 1):
@@ -203,6 +215,7 @@ class MomentIndices:
   indexMap:  bd.BidictBase[int, QnMomentIndex] = field(init = False)  # bidirectional map for flat index <-> quantum-number index conversion
 
   def __post_init__(self) -> None:
+    import bidict as bd
     # create new bidict subclass
     QnIndexByFlatIndexBidict = bd.namedbidict(typename = 'QnIndexByFlatIndexBidict', keyname = 'flatIndex', valname = 'QnIndex')
     # instantiate bidict subclass
@@ -237,14 +250,72 @@ class MomentIndices:
     for flatIndex in range(len(self)):
       yield self[flatIndex]
 
+  def subsetFlatIndices(
+    self,
+    subset: MomentIndices,  # moment indices for smaller maximum L
+  ) -> npt.NDArray[npt.Shape["*"], npt.Int]:
+    """Returns the flat indices in this index scheme of all moments in the given index scheme with the same or smaller maximum L; can be used to slice arrays with flat indices"""
+    assert subset.photoProd == self.photoProd and subset.maxL <= self.maxL, f"Moment indices {subset} are not a subset of {self}"
+    return np.array([self.indexMap.flatIndex_for[qnIndex] for qnIndex in subset.QnIndices()], dtype = int)
+
+  @classmethod
+  def fromNmbMoments(
+    cls,
+    nmbMoments: int,          # number of moments
+    photoProd:  bool = True,  # switches between diffraction and photoproduction mode
+  ) -> Optional[MomentIndices]:
+    """Returns moment indices with given number of moments; returns None if there is no maximum L value that yields this number"""
+    maxL = 0
+    while True:
+      indices = cls(maxL, photoProd)
+      if len(indices) == nmbMoments:
+        return indices
+      if len(indices) > nmbMoments:
+        return None
+      maxL += 1
+
+  @property
+  def imagPartFlags(self) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+    """Returns flags that mark the flat indices of moments that are purely imaginary, i.e. H_2; in the real-valued layout these are represented by their imaginary parts, all other moments by their real parts"""
+    return np.array([qnIndex.momentIndex == 2 for qnIndex in self.QnIndices()], dtype = bool)
+
 
 @dataclass
 class DataSet:
-  """Stores information about a single dataset"""
-  polarization:   float            # photon-beam polarization
-  data:           ROOT.RDataFrame  # data from which to calculate moments
-  phaseSpaceData: ROOT.RDataFrame  # (accepted) phase-space data  #TODO make optional
-  nmbGenEvents:   int              # number of generated events
+  """Stores information about a single dataset; data are given either as ROOT.RDataFrame or as mapping of column names to NumPy arrays, which allows to calculate moments without loading PyROOT; the ROOT libraries are still needed by the kernel library"""
+  polarization:   float                                             # photon-beam polarization
+  data:           Union[ROOT.RDataFrame, Mapping[str, np.ndarray]]  # data from which to calculate moments
+  phaseSpaceData: Union[ROOT.RDataFrame, Mapping[str, np.ndarray]]  # (accepted) phase-space data  #TODO make optional
+  nmbGenEvents:   int                                               # number of generated events
+
+
+def dataColumns(
+  data:        Union[ROOT.RDataFrame, Mapping[str, np.ndarray]],
+  columnNames: Sequence[str],
+) -> Dict[str, np.ndarray]:
+  """Returns given columns of data, which are either given as ROOT.RDataFrame or as mapping of column names to NumPy arrays, as NumPy arrays"""
+  if isinstance(data, Mapping):
+    return {columnName: np.asarray(data[columnName]) for columnName in columnNames}
+  return data.AsNumpy(columns = list(columnNames))
+
+
+def hasColumn(
+  data:       Union[ROOT.RDataFrame, Mapping[str, np.ndarray]],
+  columnName: str,
+) -> bool:
+  """Returns whether data, which are either given as ROOT.RDataFrame or as mapping of column names to NumPy arrays, contain a column with the given name"""
+  if isinstance(data, Mapping):
+    return columnName in data
+  return columnName in data.GetColumnNames()
+
+
+def nmbEvents(
+  data: Union[ROOT.RDataFrame, Mapping[str, np.ndarray]],
+) -> Optional[int]:
+  """Returns number of events in data, which are either given as ROOT.RDataFrame or as mapping of column names to NumPy arrays; None for RDataFrames, whose events cannot be counted without an extra event loop"""
+  if isinstance(data, Mapping):
+    return len(next(iter(data.values())))
+  return None
 
 
 @dataclass(frozen = True)  # immutable
@@ -266,7 +337,20 @@ class AcceptanceIntegralMatrix:
   """Calculates and provides access to acceptance integral matrix"""
   indices:     MomentIndices  # index mapping and iterators
   dataSet:     DataSet        # info on data samples
-  _IFlatIndex: Optional[npt.NDArray[npt.Shape["Dim, Dim"], npt.Complex128]] = None  # integral matrix with flat indices; must either be given or set be calling load() or calculate()
+  realValued:  bool = False   # if set, integral matrix is calculated for real-valued moment layout (Re[H_0], Re[H_1], Im[H_2]) using real-valued basis functions
+  _IFlatIndex: Optional[npt.NDArray[npt.Shape["Dim, Dim"], npt.Inexact]] = None  # integral matrix with flat indices; must either be given or set be calling load() or calculate()
+  _harmonicSums: Optional[npt.NDArray[npt.Shape["3, 3, Dim, Dim"], npt.Float64]] = None  # polarization-independent sums from which the integral matrix is assembled; set by calculate() or load()
+  # Each basis function in Eqs. (175) and (176) is a product of Re[Ylm] or Im[Ylm], one of the Phi harmonics {1, cos 2Phi, sin 2Phi} (selected by the moment index), and a constant that depends on the polarization.
+  # Hence, the integral matrix is fully determined by the sums over phase-space events of Re[Ylm] and Im[Ylm] products for all pairs of (L, M) and (L', M') weighted by the product of the two Phi harmonics.
+  # _harmonicSums[k, k'] holds these sums for the harmonics k and k' as a matrix w.r.t. the rows of the table returned by ylmReImTable() in `wignerD.C`.
+  # Since the basis functions for the measured moments are built from the same factors, the sums also determine the moments of the accepted phase-space data and their covariances.
+  # If the phase-space data have a column 'eventWeight', e.g. a detection efficiency that is carried as per-event weight instead of being applied by accept-reject, all sums are weighted.
+  _centralHarmonicSums: Optional[npt.NDArray[npt.Shape["3, 3, Dim, Dim"], npt.Float64]] = None  # same sums as _harmonicSums but of the products taken about the (weighted) means; needed for covariances of moments of accepted phase-space data; set together with _harmonicSums
+  _sumOfSquaredWeights: Optional[float] = None  # sum of squared event weights of phase-space data; needed for covariances of moments of accepted phase-space data; None means that all weights are 1
+  _inverseCache: Optional[Tuple[npt.NDArray[npt.Shape["Dim, Dim"], npt.Inexact], npt.NDArray[npt.Shape["Dim, Dim"], npt.Inexact]]] = field(default = None, init = False, repr = False, compare = False)  # (matrix, inverse) pair; recalculated whenever _IFlatIndex is replaced
+  profiler:        Optional[ProfilingUtilities.Profiler] = field(default = None, repr = False, compare = False)  # if set, the stages of the calculation are timed
+  profileBinLabel: str = field(default = "", repr = False, compare = False)  # label of kinematic bin used for profiling records
+  memoryBudget:    Optional[Union[int, str]] = field(default = None, repr = False, compare = False)  # [bytes] or size string like '8G' used to pick the number of events per chunk; if None, MemoryPlanner.defaultMemoryBudget() is used
 
   # accessor that guarantees existence of optional field
   @property
@@ -283,8 +367,11 @@ class AcceptanceIntegralMatrix:
 
   @property
   def inverse(self) -> npt.NDArray[npt.Shape["Dim, Dim"], npt.Complex128]:
-    """Returns inverse of acceptance integral matrix"""
-    return np.linalg.inv(self.matrix)
+    """Returns inverse of acceptance integral matrix; the inverse is cached until the integral matrix is replaced"""
+    if self._inverseCache is None or self._inverseCache[0] is not self.matrix:
+      with self._profileStage("inversion"):
+        self._inverseCache = (self.matrix, np.linalg.inv(self.matrix))
+    return self._inverseCache[1]
 
   @property
   def eigenDecomp(self) -> Tuple[npt.NDArray[npt.Shape["*"], npt.Complex128], npt.NDArray[npt.Shape["Dim, Dim"], npt.Complex128]]:
@@ -334,33 +421,278 @@ class AcceptanceIntegralMatrix:
     else:
       return np.array2string(self._IFlatIndex, precision = 3, suppress_small = True, max_line_width = 150)
 
-  def calculate(self) -> None:
-    """Calculates integral matrix of basis functions from (accepted) phase-space data"""
-    # get phase-space data data as NumPy arrays
-    thetas = self.dataSet.phaseSpaceData.AsNumpy(columns = ["theta"])["theta"]
-    phis   = self.dataSet.phaseSpaceData.AsNumpy(columns = ["phi"]  )["phi"]
-    Phis   = self.dataSet.phaseSpaceData.AsNumpy(columns = ["Phi"]  )["Phi"]
+  def _profileStage(
+    self,
+    stage:     str,                   # name of stage
+    nmbEvents: Optional[int] = None,  # number of processed events
+  ) -> ContextManager[ProfilingUtilities.StageRecord]:
+    """Returns context manager that times the enclosed code if a profiler is set"""
+    return ProfilingUtilities.profileStage(self.profiler, stage, self.profileBinLabel, nmbEvents)
+
+  @property
+  def nmbLM(self) -> int:
+    """Returns number of (L, M) combinations with 0 <= M <= L <= maxL, i.e. half the number of rows of the table returned by ylmReImTable()"""
+    return (self.indices.maxL + 1) * (self.indices.maxL + 2) // 2
+
+  def _basisFcnCoeffs(
+    self,
+    polarization: float,  # photon-beam polarization
+  ) -> Tuple[npt.NDArray[npt.Shape["Dim"], npt.Int], npt.NDArray[npt.Shape["Dim, *"], npt.Inexact], npt.NDArray[npt.Shape["Dim, *"], npt.Inexact]]:
+    """Returns for each flat index the index of the Phi harmonic and the coefficients that express the measured and the physical basis functions, respectively, as linear combinations of the rows of the table returned by ylmReImTable()"""
+    nmbMoments = len(self.indices)
+    dtype      = np.float64 if self.realValued else np.complex128
+    harmonicIndices = np.empty((nmbMoments, ), dtype = int)
+    coeffsMeas      = np.zeros((nmbMoments, 2 * self.nmbLM), dtype = dtype)
+    coeffsPhys      = np.zeros((nmbMoments, 2 * self.nmbLM), dtype = dtype)
+    for flatIndex, qnIndex in enumerate(self.indices.QnIndices()):
+      harmonicIndices[flatIndex] = qnIndex.momentIndex
+      rowRe = qnIndex.L * (qnIndex.L + 1) // 2 + qnIndex.M  # row with Re[Ylm]
+      rowIm = self.nmbLM + rowRe                            # row with Im[Ylm]
+      normMeas = (1 / np.pi) * np.sqrt((4 * np.pi) / (2 * qnIndex.L + 1)) * (1 / 2 if qnIndex.momentIndex == 0 else 1 / polarization)  # Eq. (176)
+      normPhys = np.sqrt((2 * qnIndex.L + 1) / (4 * np.pi)) * (1 if qnIndex.M == 0 else 2) * (1 if qnIndex.momentIndex == 0 else polarization)  # Eq. (175)
+      if self.realValued:
+        # basis functions (Re[f_meas_0], Re[f_meas_1], Im[f_meas_2]) and (f_phys_0, f_phys_1, Re[i * f_phys_2]); see f_measReal() and f_physReal() in `wignerD.C`
+        if qnIndex.momentIndex < 2:
+          coeffsMeas[flatIndex, rowRe] = normMeas
+          coeffsPhys[flatIndex, rowRe] = normPhys
+        else:
+          coeffsMeas[flatIndex, rowIm] = -normMeas
+          coeffsPhys[flatIndex, rowIm] = -normPhys
+      else:
+        # f_meas is proportional to Ylm^* = Re[Ylm] - i Im[Ylm]; f_phys is proportional to Re[Ylm] for H_0 and H_1 and to i Im[Ylm] for H_2
+        coeffsMeas[flatIndex, rowRe] = normMeas
+        coeffsMeas[flatIndex, rowIm] = -1j * normMeas
+        if qnIndex.momentIndex < 2:
+          coeffsPhys[flatIndex, rowRe] = normPhys
+        else:
+          coeffsPhys[flatIndex, rowIm] = 1j * normPhys
+    return (harmonicIndices, coeffsMeas, coeffsPhys)
+
+  @property
+  def hasHarmonicSums(self) -> bool:
+    """Returns whether the polarization-independent sums and the corresponding sums about the means are available"""
+    return self._harmonicSums is not None and self._centralHarmonicSums is not None
+
+  def _sumOfProducts(
+    self,
+    harmonicIndices: npt.NDArray[npt.Shape["Dim"], npt.Int],       # index of Phi harmonic for each flat index
+    coeffs1:         npt.NDArray[npt.Shape["Dim, *"], npt.Inexact],  # coefficients of first function w.r.t. rows of Ylm table
+    coeffs2:         npt.NDArray[npt.Shape["Dim, *"], npt.Inexact],  # coefficients of second function w.r.t. rows of Ylm table
+    central:         bool = False,  # if set, the products are taken about the (weighted) means of the functions
+  ) -> npt.NDArray[npt.Shape["Dim, Dim"], npt.Inexact]:
+    """Returns matrix with sums over phase-space events of the products of the given functions for all pairs of flat indices"""
+    harmonicSums = self._centralHarmonicSums if central else self._harmonicSums
+    assert harmonicSums is not None, "harmonic sums must not be None; call calculate() or load() first"
+    nmbMoments = len(self.indices)
+    sums = np.zeros((nmbMoments, nmbMoments), dtype = np.result_type(coeffs1, coeffs2))
+    for harmonicIndex1 in range(3):
+      rows = harmonicIndices == harmonicIndex1
+      for harmonicIndex2 in range(3):
+        columns = harmonicIndices == harmonicIndex2
+        if rows.any() and columns.any():
+          sums[np.ix_(rows, columns)] = coeffs1[rows] @ harmonicSums[harmonicIndex1, harmonicIndex2] @ coeffs2[columns].T
+    return sums
+
+  def matrixForPolarization(
+    self,
+    polarization: float,  # photon-beam polarization
+  ) -> npt.NDArray[npt.Shape["Dim, Dim"], npt.Inexact]:
+    """Assembles integral matrix for given photon-beam polarization from the polarization-independent sums without revisiting the phase-space events"""
+    harmonicIndices, coeffsMeas, coeffsPhys = self._basisFcnCoeffs(polarization)
+    return (8 * np.pi**2 / self.dataSet.nmbGenEvents) * self._sumOfProducts(harmonicIndices, coeffsMeas, coeffsPhys)  # Eq. (178)
+
+  def phaseSpaceMeasMoments(
+    self,
+    polarization: float,  # photon-beam polarization
+  ) -> Tuple[npt.NDArray[npt.Shape["Dim"], npt.Inexact], npt.NDArray[npt.Shape["*, *"], npt.Inexact]]:
+    """Returns measured moments of the (accepted) phase-space data, i.e. the moments of the acceptance function, and their covariance matrix calculated from the polarization-independent sums without revisiting the phase-space events; in complex-valued mode, the augmented covariance matrix is returned"""
+    harmonicIndices, coeffsMeas, _ = self._basisFcnCoeffs(polarization)
+    # Re[Y_00] = 1 / sqrt(4 pi) is constant; hence the (weighted) number of events and the sums of the basis-function values follow from the corresponding row of the sums
+    sumOfWeights        = 4 * np.pi * self._harmonicSums[0, 0, 0, 0]
+    sumOfSquaredWeights = sumOfWeights if self._sumOfSquaredWeights is None else self._sumOfSquaredWeights
+    sums_fMeas = np.sqrt(4 * np.pi) * np.einsum("ir,ir->i", coeffsMeas, self._harmonicSums[harmonicIndices, 0, :, 0])
+    HMeasVals  = 2 * np.pi * sums_fMeas  # Eq. (179)
+    # calculate covariance matrix from (weighted) sums of products of basis-function values about their means like in MomentCalculator._calcMeasMomentsFromData()
+    # the sums about the means were accumulated relative to a reference point, so that they do not cancel catastrophically for (nearly) constant basis functions like that of H_0(0, 0)
+    V_Hermit = self._sumOfProducts(harmonicIndices, coeffsMeas, np.conjugate(coeffsMeas), central = True)
+    if self.realValued:
+      V_meas = V_Hermit  # for real-valued quantities the augmented covariance matrix reduces to the ordinary one
+    else:
+      V_pseudo = self._sumOfProducts(harmonicIndices, coeffsMeas, coeffsMeas, central = True)
+      V_meas = np.block([
+        [V_Hermit,               V_pseudo],
+        [np.conjugate(V_pseudo), np.conjugate(V_Hermit)],
+      ])  # augmented covariance matrix; Eq. (88)
+    besselCorrection = 1 / (sumOfWeights - 1)
+    V_meas = (2 * np.pi)**2 * sumOfSquaredWeights * besselCorrection * V_meas
+    return (HMeasVals, V_meas)
+
+  def sliced(
+    self,
+    indices: MomentIndices,  # moment indices for same or smaller maximum L
+  ) -> AcceptanceIntegralMatrix:
+    """Returns integral matrix for the given smaller set of moments; the integral matrix for a smaller maximum L is a sub-block of the one for a larger maximum L"""
+    flatIndices = self.indices.subsetFlatIndices(indices)
+    integralMatrix = AcceptanceIntegralMatrix(indices, self.dataSet, realValued = self.realValued, _sumOfSquaredWeights = self._sumOfSquaredWeights,
+      profiler = self.profiler, profileBinLabel = self.profileBinLabel, memoryBudget = self.memoryBudget)
+    if self._IFlatIndex is not None:
+      integralMatrix._IFlatIndex = self._IFlatIndex[np.ix_(flatIndices, flatIndices)]
+    # rows of Ylm table for smaller maximum L are the first rows of the real and the imaginary part, respectively
+    rows = np.concatenate((np.arange(integralMatrix.nmbLM), self.nmbLM + np.arange(integralMatrix.nmbLM)))
+    if self._harmonicSums is not None:
+      integralMatrix._harmonicSums = self._harmonicSums[:, :, rows[:, None], rows[None, :]]
+    if self._centralHarmonicSums is not None:
+      integralMatrix._centralHarmonicSums = self._centralHarmonicSums[:, :, rows[:, None], rows[None, :]]
+    return integralMatrix
+
+  def forDataSet(
+    self,
+    dataSet: DataSet,  # dataset for which integral matrix is to be provided
+  ) -> AcceptanceIntegralMatrix:
+    """Returns integral matrix for given dataset assembled from the sums of this integral matrix; the dataset is assumed to have the same (accepted) phase-space data but may have a different polarization"""
+    integralMatrix = AcceptanceIntegralMatrix(self.indices, dataSet, realValued = self.realValued, _harmonicSums = self._harmonicSums,
+      _centralHarmonicSums = self._centralHarmonicSums, _sumOfSquaredWeights = self._sumOfSquaredWeights,
+      profiler = self.profiler, profileBinLabel = self.profileBinLabel, memoryBudget = self.memoryBudget)
+    integralMatrix._IFlatIndex = integralMatrix.matrixForPolarization(dataSet.polarization)
+    return integralMatrix
+
+  def _readPhaseSpaceData(self) -> Tuple[npt.NDArray[npt.Shape["*"], npt.Float64], npt.NDArray[npt.Shape["*"], npt.Float64], npt.NDArray[npt.Shape["*"], npt.Float64], Optional[npt.NDArray[npt.Shape["*"], npt.Float64]]]:
+    """Returns angles and, if the column 'eventWeight' exists, event weights of phase-space data as NumPy arrays"""
+    with self._profileStage("dataIngest") as profileRecord:
+      weighted = hasColumn(self.dataSet.phaseSpaceData, "eventWeight")
+      columns = dataColumns(self.dataSet.phaseSpaceData, ["theta", "phi", "Phi"] + (["eventWeight"] if weighted else []))
+      profileRecord.nmbEvents = len(columns["theta"])
+    thetas = columns["theta"]
+    phis   = columns["phi"]
+    Phis   = columns["Phi"]
     print(f"Phase-space data column: {type(thetas)}; {thetas.shape}; {thetas.dtype}; {thetas.dtype.type}")
     nmbAccEvents = len(thetas)
     assert thetas.shape == (nmbAccEvents,) and thetas.shape == phis.shape == Phis.shape, (
       f"Not all NumPy arrays with input data have the correct shape. Expected ({nmbAccEvents},) but got theta: {thetas.shape}, phi: {phis.shape}, and Phi: {Phis.shape}")
-    # calculate basis-function values for physical and measured moments; Eqs. (175) and (176); defined in `wignerD.C`
-    nmbMoments = len(self.indices)
-    fMeas: npt.NDArray[npt.Shape["*"], npt.Complex128] = np.empty((nmbMoments, nmbAccEvents), dtype = np.complex128)
-    fPhys: npt.NDArray[npt.Shape["*"], npt.Complex128] = np.empty((nmbMoments, nmbAccEvents), dtype = np.complex128)
-    for flatIndex in self.indices.flatIndices():
-      qnIndex = self.indices[flatIndex]
-      fMeas[flatIndex] = np.asarray(ROOT.f_meas(qnIndex.momentIndex, qnIndex.L, qnIndex.M, thetas, phis, Phis, self.dataSet.polarization))
-      fPhys[flatIndex] = np.asarray(ROOT.f_phys(qnIndex.momentIndex, qnIndex.L, qnIndex.M, thetas, phis, Phis, self.dataSet.polarization))
-    # calculate integral-matrix elements; Eq. (178)
-    self._IFlatIndex = np.empty((nmbMoments, nmbMoments), dtype = np.complex128)
-    for flatIndexMeas in self.indices.flatIndices():
-      for flatIndexPhys in self.indices.flatIndices():
-        self._IFlatIndex[flatIndexMeas, flatIndexPhys] = (8 * np.pi**2 / self.dataSet.nmbGenEvents) * np.dot(fMeas[flatIndexMeas], fPhys[flatIndexPhys])
+    eventWeights = columns["eventWeight"] if weighted else None
+    assert eventWeights is None or eventWeights.shape == (nmbAccEvents,), f"NumPy arrays with event weights does not have the correct shape. Expected ({nmbAccEvents},) but got {eventWeights.shape}"
+    return (thetas, phis, Phis, eventWeights)
+
+  def _calcHarmonicSums(
+    self,
+    thetas:            npt.NDArray[npt.Shape["*"], npt.Float64],     # polar angles of phase-space events
+    phis:              npt.NDArray[npt.Shape["*"], npt.Float64],     # azimuthal angles of phase-space events
+    Phis:              npt.NDArray[npt.Shape["*"], npt.Float64],     # angles of photon polarization of phase-space events
+    eventWeights:      npt.NDArray[npt.Shape["K, *"], npt.Float64],  # K sets of per-event weights
+    nmbEventsPerChunk: int,  # number of phase-space events that are processed at once; limits memory footprint
+  ) -> Tuple[npt.NDArray[npt.Shape["K, 3, 3, Dim, Dim"], npt.Float64], npt.NDArray[npt.Shape["K, 3, 3, Dim, Dim"], npt.Float64]]:
+    """Returns Phi-harmonic-weighted sums of Re[Ylm] and Im[Ylm] products and the corresponding sums of the products taken about the (weighted) means for each of the K sets of event weights
+    The Ylm table is evaluated only once and the sums for all weights and harmonics are obtained by one matrix product per weight set and harmonic pair.
+    """
+    # only the products (1, 1), (1, cos), (1, sin), (cos, cos), and (cos, sin) of the Phi harmonics need to be summed explicitly
+    # the products for (1, 1) are taken relative to a reference point K, which are the values of the first event, so that the sums about the means do not cancel catastrophically for (nearly) constant functions like Re[Y_00]; see MomentCalculator._calcMeasMomentsFromData()
+    harmonicPairs = ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2))
+    nmbWeightSets = eventWeights.shape[0]
+    harmonicSums  = np.zeros((nmbWeightSets, 3, 3, 2 * self.nmbLM, 2 * self.nmbLM), dtype = np.float64)
+    shiftedSums   = np.zeros((nmbWeightSets, 2 * self.nmbLM), dtype = np.float64)  # sum_i w_i (Ylms_i - K)
+    reference: Optional[npt.NDArray[npt.Shape["Dim"], npt.Float64]] = None  # reference point K
+    for chunkStart in range(0, len(thetas), nmbEventsPerChunk):
+      chunk = slice(chunkStart, chunkStart + nmbEventsPerChunk)
+      nmbEventsInChunk = len(thetas[chunk])
+      with self._profileStage("basisEvaluation", nmbEventsInChunk):
+        ylms = KernelLibrary.kernels().ylmReImTable(self.indices.maxL, thetas[chunk], phis[chunk])  # defined in `wignerD.C`
+        harmonics = np.stack((np.ones_like(Phis[chunk]), np.cos(2 * Phis[chunk]), np.sin(2 * Phis[chunk])))
+      with self._profileStage("integralAccumulation", nmbEventsInChunk):
+        if reference is None:
+          reference = ylms[:, 0].copy()  # unlike the mean of a chunk, this shifts constant functions exactly to 0
+        shiftedYlms = ylms - reference[:, None]
+        shiftedSums += eventWeights[:, chunk] @ shiftedYlms.T
+        harmonicProducts = np.stack([harmonics[harmonicIndex1] * harmonics[harmonicIndex2] for harmonicIndex1, harmonicIndex2 in harmonicPairs])
+        # per-event factors for all weight sets and harmonic pairs with shape (K * number of pairs, number of events in chunk)
+        eventFactors = (eventWeights[:, chunk][:, None, :] * harmonicProducts[None, :, :]).reshape((nmbWeightSets * len(harmonicPairs), -1))
+        # one matrix product per factor row, so that only a temporary of the size of the Ylm table exists at a time, independent of K
+        sums = np.empty((nmbWeightSets * len(harmonicPairs), 2 * self.nmbLM, 2 * self.nmbLM), dtype = np.float64)
+        weightedYlms = np.empty_like(ylms)
+        for factorIndex, eventFactor in enumerate(eventFactors):
+          table = shiftedYlms if factorIndex % len(harmonicPairs) == 0 else ylms  # first pair is (1, 1)
+          np.multiply(table, eventFactor[None, :], out = weightedYlms)
+          np.matmul(weightedYlms, table.T, out = sums[factorIndex])
+        sums = sums.reshape((nmbWeightSets, len(harmonicPairs), 2 * self.nmbLM, 2 * self.nmbLM))
+        for pairIndex, (harmonicIndex1, harmonicIndex2) in enumerate(harmonicPairs):
+          harmonicSums[:, harmonicIndex1, harmonicIndex2] += sums[:, pairIndex]
+    assert reference is not None, "Phase-space data must not be empty"
+    sumsOfWeights = np.sum(eventWeights, axis = 1)
+    shiftedMeans  = shiftedSums / sumsOfWeights[:, None]  # weighted means of Ylm values relative to reference point
+    # sums about the means: sum_i w_i (Ylms_i - mean)(Ylms_i - mean)^T = sum_i w_i (Ylms_i - K)(Ylms_i - K)^T - W (mean - K)(mean - K)^T with W = sum_i w_i
+    centralSums00 = harmonicSums[:, 0, 0] - sumsOfWeights[:, None, None] * shiftedMeans[:, :, None] * shiftedMeans[:, None, :]
+    # sums of products: sum_i w_i Ylms_i Ylms_i^T = sum_i w_i (Ylms_i - K)(Ylms_i - K)^T + K s^T + s K^T + W K K^T with s = sum_i w_i (Ylms_i - K)
+    harmonicSums[:, 0, 0] += (reference[None, :, None] * shiftedSums[:, None, :] + shiftedSums[:, :, None] * reference[None, None, :]
+                              + sumsOfWeights[:, None, None] * np.outer(reference, reference)[None, :, :])
+    harmonicSums[:, 2, 2] = harmonicSums[:, 0, 0] - harmonicSums[:, 1, 1]  # sin^2 2Phi = 1 - cos^2 2Phi
+    for harmonicIndex1, harmonicIndex2 in ((0, 1), (0, 2), (1, 2)):
+      harmonicSums[:, harmonicIndex2, harmonicIndex1] = harmonicSums[:, harmonicIndex1, harmonicIndex2]
+    # the weighted means of the Ylm values multiplied by cos 2Phi and sin 2Phi follow from the column of the constant Re[Y_00] = 1 / sqrt(4 pi)
+    # they are small compared to the spread of the values, so that the sums about the means of the blocks involving these harmonics do not cancel catastrophically
+    means = np.stack((reference[None, :] + shiftedMeans, np.sqrt(4 * np.pi) * harmonicSums[:, 0, 1, :, 0] / sumsOfWeights[:, None],
+                      np.sqrt(4 * np.pi) * harmonicSums[:, 0, 2, :, 0] / sumsOfWeights[:, None]), axis = 1)  # shape (K, 3, Dim)
+    centralSums = harmonicSums - sumsOfWeights[:, None, None, None, None] * means[:, :, None, :, None] * means[:, None, :, None, :]
+    centralSums[:, 0, 0] = centralSums00
+    return (harmonicSums, centralSums)
+
+  def planMemory(
+    self,
+    nmbEvents:         int,  # number of phase-space events
+    nmbWeightSets:     int = 1,     # number of sets of per-event weights
+    nmbEventsPerChunk: Optional[int] = None,  # requested number of events per chunk; None lets the planner choose
+    nmbWorkers:        int = 1,     # number of kinematic bins that are processed in parallel
+  ) -> MemoryPlanner.MemoryPlan:
+    """Returns number of phase-space events per chunk that fits into the memory budget; raises MemoryError if the calculation does not fit"""
+    return MemoryPlanner.planIntegralMatrix(nmbEvents, self.indices.maxL, nmbWeightSets, self.memoryBudget, nmbEventsPerChunk, nmbWorkers = nmbWorkers)
+
+  def calculate(
+    self,
+    nmbEventsPerChunk: Optional[int] = None,  # number of phase-space events that are processed at once; limits memory footprint; if None, it is chosen by the memory planner; reduced if it does not fit into the memory budget
+  ) -> None:
+    """Calculates integral matrix of basis functions from (accepted) phase-space data; if the phase-space data have a column 'eventWeight', the events are weighted accordingly"""
+    thetas, phis, Phis, eventWeights = self._readPhaseSpaceData()
+    memoryPlan = self.planMemory(len(thetas), nmbEventsPerChunk = nmbEventsPerChunk)
+    print(memoryPlan)
+    weights = np.ones((1, len(thetas)), dtype = np.float64) if eventWeights is None else eventWeights[None, :]
+    harmonicSums, centralHarmonicSums = self._calcHarmonicSums(thetas, phis, Phis, weights, memoryPlan.nmbEventsPerChunk)
+    self._harmonicSums        = harmonicSums[0]
+    self._centralHarmonicSums = centralHarmonicSums[0]
+    self._sumOfSquaredWeights = None if eventWeights is None else float(np.sum(np.square(eventWeights)))
+    # assemble integral matrix for polarization of dataset
+    self._IFlatIndex = self.matrixForPolarization(self.dataSet.polarization)
     assert self.isValid(), f"Integral matrix data are inconsistent"
 
+  def calculateForWeights(
+    self,
+    eventWeights:      npt.NDArray[npt.Shape["K, *"], npt.Float64],  # K sets of per-event weights for the phase-space data, e.g. one for each efficiency model; replace the column 'eventWeight' if it exists
+    nmbGenEvents:      Optional[Sequence[int]] = None,  # number of generated events used to normalize the integral matrix for each set of weights; if None, the value of the dataset is used for all
+    nmbEventsPerChunk: Optional[int] = None,  # number of phase-space events that are processed at once; limits memory footprint; if None, it is chosen by the memory planner; reduced if it does not fit into the memory budget
+  ) -> List[AcceptanceIntegralMatrix]:
+    """Calculates K integral matrices for the same phase-space data and K different sets of event weights by evaluating the basis functions only once; the indices and the dataset of this object define the moments and the phase-space data"""
+    thetas, phis, Phis, _ = self._readPhaseSpaceData()
+    eventWeights = np.atleast_2d(eventWeights)
+    assert eventWeights.shape[1] == len(thetas), f"Event weights have wrong shape. Expected (K, {len(thetas)}) but got {eventWeights.shape}"
+    if nmbGenEvents is None:
+      nmbGenEvents = eventWeights.shape[0] * [self.dataSet.nmbGenEvents]
+    assert len(nmbGenEvents) == eventWeights.shape[0], f"Expect one number of generated events per set of weights but got {len(nmbGenEvents)} for {eventWeights.shape[0]} sets"
+    memoryPlan = self.planMemory(len(thetas), eventWeights.shape[0], nmbEventsPerChunk)
+    print(memoryPlan)
+    harmonicSums, centralHarmonicSums = self._calcHarmonicSums(thetas, phis, Phis, eventWeights, memoryPlan.nmbEventsPerChunk)
+    integralMatrices: List[AcceptanceIntegralMatrix] = []
+    for weightSetIndex, nmbGenEventsForWeights in enumerate(nmbGenEvents):
+      integralMatrix = AcceptanceIntegralMatrix(self.indices, dataclasses.replace(self.dataSet, nmbGenEvents = nmbGenEventsForWeights), realValued = self.realValued,
+        _harmonicSums = harmonicSums[weightSetIndex], _centralHarmonicSums = centralHarmonicSums[weightSetIndex], _sumOfSquaredWeights = float(np.sum(np.square(eventWeights[weightSetIndex]))),
+        profiler = self.profiler, profileBinLabel = self.profileBinLabel, memoryBudget = self.memoryBudget)
+      integralMatrix._IFlatIndex = integralMatrix.matrixForPolarization(self.dataSet.polarization)
+      assert integralMatrix.isValid(), f"Integral matrix data are inconsistent"
+      integralMatrices.append(integralMatrix)
+    return integralMatrices
+
   def isValid(self) -> bool:
-    return (self._IFlatIndex is not None) and self._IFlatIndex.shape == (len(self.indices), len(self.indices))
+    return (
+      (self._IFlatIndex is not None)
+      and self._IFlatIndex.shape == (len(self.indices), len(self.indices))
+      and np.isrealobj(self._IFlatIndex) == self.realValued
+    )
 
   def save(
     self,
@@ -371,29 +703,69 @@ class AcceptanceIntegralMatrix:
     if self._IFlatIndex is not None:
       print(f"Saving integral matrix to file '{fileName}'.")
       np.save(fileName, self._IFlatIndex)
+    if self._harmonicSums is not None and self._centralHarmonicSums is not None:
+      np.save(self.harmonicSumsFileName(fileName), np.stack((self._harmonicSums, self._centralHarmonicSums)))
+      sumOfSquaredWeightsFileName = self.sumOfSquaredWeightsFileName(fileName)
+      if self._sumOfSquaredWeights is not None:
+        np.save(sumOfSquaredWeightsFileName, np.array(self._sumOfSquaredWeights))
+      elif os.path.exists(sumOfSquaredWeightsFileName):
+        os.remove(sumOfSquaredWeightsFileName)  # remove stale file from calculation with weighted phase-space data
 
   def load(
     self,
     fileName: str = "./integralMatrix.npy",
   ) -> None:
-    """Loads NumPy array that holds the integral matrix from file with given name"""
+    """Loads NumPy array that holds the integral matrix from file with given name; if the file holds the integral matrix for a larger maximum L, the corresponding sub-block is used"""
     print(f"Loading integral matrix from file '{fileName}'.")
     array = np.load(fileName)
+    if not np.isrealobj(array) == self.realValued:
+      raise TypeError(f"Integral loaded from file '{fileName}' has wrong data type. Expected {'real' if self.realValued else 'complex'} values but got {array.dtype}.")
+    storedIndices = self.indices
     if not array.shape == (len(self.indices), len(self.indices)):
-      raise IndexError(f"Integral loaded from file '{fileName}' has wrong shape. Expected {(len(self.indices), len(self.indices))} but got {array.shape}.")
-    self._IFlatIndex = array
+      storedIndices = MomentIndices.fromNmbMoments(array.shape[0], self.indices.photoProd) if array.ndim == 2 and array.shape[0] == array.shape[1] else None
+      if storedIndices is None or storedIndices.maxL < self.indices.maxL:
+        raise IndexError(f"Integral loaded from file '{fileName}' has wrong shape. Expected {(len(self.indices), len(self.indices))} but got {array.shape}.")
+      print(f"Using sub-block for maxL = {self.indices.maxL} of integral matrix for maxL = {storedIndices.maxL}.")
+    stored = AcceptanceIntegralMatrix(storedIndices, self.dataSet, realValued = self.realValued, _IFlatIndex = array)
+    # load polarization-independent sums, if available; files written before the sums about the means were stored are ignored
+    harmonicSumsFileName = self.harmonicSumsFileName(fileName)
+    if os.path.exists(harmonicSumsFileName):
+      harmonicSums = np.load(harmonicSumsFileName)
+      if harmonicSums.shape == (2, 3, 3, 2 * stored.nmbLM, 2 * stored.nmbLM):
+        stored._harmonicSums, stored._centralHarmonicSums = harmonicSums
+        sumOfSquaredWeightsFileName = self.sumOfSquaredWeightsFileName(fileName)
+        if os.path.exists(sumOfSquaredWeightsFileName):
+          stored._sumOfSquaredWeights = float(np.load(sumOfSquaredWeightsFileName))
+    if storedIndices is not self.indices:
+      stored = stored.sliced(self.indices)
+    self._IFlatIndex          = stored._IFlatIndex
+    self._harmonicSums        = stored._harmonicSums
+    self._centralHarmonicSums = stored._centralHarmonicSums
+    self._sumOfSquaredWeights = stored._sumOfSquaredWeights
     assert self.isValid(), f"Integral matrix data are inconsistent"
 
+  @staticmethod
+  def harmonicSumsFileName(fileName: str) -> str:
+    """Returns name of file that holds the polarization-independent sums and the corresponding sums about the means for integral matrix file with given name"""
+    return os.path.splitext(fileName)[0] + ".harmonicSums.npy"
+
+  @staticmethod
+  def sumOfSquaredWeightsFileName(fileName: str) -> str:
+    """Returns name of file that holds the sum of squared weights of the phase-space events for integral matrix file with given name; only written for weighted phase-space data"""
+    return os.path.splitext(fileName)[0] + ".sumOfSquaredWeights.npy"
+
   def loadOrCalculate(
     self,
     fileName: str = "./integralMatrix.npy",
-  ) -> None:
-    """Loads NumPy array that holds the integral matrix from file with given name; and calculates the integral matrix if loading failed"""
+  ) -> bool:
+    """Loads NumPy array that holds the integral matrix from file with given name; and calculates the integral matrix if loading failed; returns whether the matrix was loaded"""
     try:
       self.load(fileName)
+      return True
     except Exception as e:
       print(f"Could not load integral matrix from file '{fileName}': {e} Calculating matrix instead.")
       self.calculate()
+      return False
 
 
 @dataclass
@@ -448,10 +820,10 @@ class MomentResult:
 
   def __post_init__(self) -> None:
     nmbMoments = len(self.indices)
-    self._valsFlatIndex    = np.zeros((nmbMoments, ), dtype = npt.Complex128)
-    self._covReReFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = npt.Float64)
-    self._covImImFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = npt.Float64)
-    self._covReImFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = npt.Float64)
+    self._valsFlatIndex    = np.zeros((nmbMoments, ), dtype = np.complex128)
+    self._covReReFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = np.float64)
+    self._covImImFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = np.float64)
+    self._covReImFlatIndex = np.zeros((nmbMoments, nmbMoments), dtype = np.float64)
 
   def __eq__(
     self,
@@ -512,6 +884,29 @@ class MomentResult:
     result = (str(self[flatIndex]) for flatIndex in self.indices.flatIndices())
     return "\n".join(result)
 
+  @property
+  def augmentedCovMatrix(self) -> npt.NDArray[npt.Shape["2 * Dim, 2 * Dim"], npt.Complex128]:
+    """Returns augmented covariance matrix; inverts MomentCalculator._calcReImCovMatrices(); Eqs. (88) and (91) to (93)"""
+    V_Hermit = (self._covReReFlatIndex + self._covImImFlatIndex) + 1j * (self._covReImFlatIndex.T - self._covReImFlatIndex)
+    V_pseudo = (self._covReReFlatIndex - self._covImImFlatIndex) + 1j * (self._covReImFlatIndex + self._covReImFlatIndex.T)
+    return np.block([
+      [V_Hermit,               V_pseudo],
+      [np.conjugate(V_pseudo), np.conjugate(V_Hermit)],
+    ])
+
+  def sliced(
+    self,
+    indices: MomentIndices,  # moment indices for same or smaller maximum L
+  ) -> MomentResult:
+    """Returns moment values and covariances for the given smaller set of moments"""
+    flatIndices = self.indices.subsetFlatIndices(indices)
+    result = MomentResult(indices, label = self.label)
+    result._valsFlatIndex    = self._valsFlatIndex   [flatIndices]
+    result._covReReFlatIndex = self._covReReFlatIndex[np.ix_(flatIndices, flatIndices)]
+    result._covImImFlatIndex = self._covImImFlatIndex[np.ix_(flatIndices, flatIndices)]
+    result._covReImFlatIndex = self._covReImFlatIndex[np.ix_(flatIndices, flatIndices)]
+    return result
+
   # def assignFrom(
   #   self,
   #   other: MomentResult,  # instance from which data are copied
@@ -524,6 +919,86 @@ class MomentResult:
   #   self._covReImFlatIndex = other._covReImFlatIndex
 
 
+@dataclass(eq = False)
+class MomentResultReal:
+  """Stores moment values in the real-valued layout (Re[H_0], Re[H_1], Im[H_2]), which fully describes photoproduction moments, and converts them to and from MomentResult"""
+  indices:        MomentIndices  # index mapping and iterators
+  label:          str = ""       # label used for printing
+  _valsFlatIndex: npt.NDArray[npt.Shape["*"], npt.Float64]        = field(init = False)  # flat array with real parts of H_0 and H_1 and imaginary parts of H_2
+  _covFlatIndex:  npt.NDArray[npt.Shape["Dim, Dim"], npt.Float64] = field(init = False)  # covariance matrix of the real-valued moment vector with flat indices
+
+  def __post_init__(self) -> None:
+    nmbMoments = len(self.indices)
+    self._valsFlatIndex = np.zeros((nmbMoments, ), dtype = np.float64)
+    self._covFlatIndex  = np.zeros((nmbMoments, nmbMoments), dtype = np.float64)
+
+  def __eq__(
+    self,
+    other: object,
+  )-> bool:
+    # custom equality check needed because of NumPy arrays
+    if not isinstance(other, MomentResultReal):
+      return NotImplemented
+    return (
+      self.indices == other.indices
+      and np.array_equal(self._valsFlatIndex, other._valsFlatIndex)
+      and np.array_equal(self._covFlatIndex,  other._covFlatIndex)
+    )
+
+  def __str__(self) -> str:
+    return str(self.toComplex())
+
+  def sliced(
+    self,
+    indices: MomentIndices,  # moment indices for same or smaller maximum L
+  ) -> MomentResultReal:
+    """Returns moment values and covariances for the given smaller set of moments"""
+    flatIndices = self.indices.subsetFlatIndices(indices)
+    result = MomentResultReal(indices, label = self.label)
+    result._valsFlatIndex = self._valsFlatIndex[flatIndices]
+    result._covFlatIndex  = self._covFlatIndex [np.ix_(flatIndices, flatIndices)]
+    return result
+
+  def toComplex(self) -> MomentResult:
+    """Returns moment values and covariances converted to complex-valued MomentResult; the real parts of H_2 and the imaginary parts of H_0 and H_1 are exactly zero"""
+    imag = self.indices.imagPartFlags
+    real = ~imag
+    result = MomentResult(self.indices, label = self.label)
+    result._valsFlatIndex    = np.where(imag, 1j * self._valsFlatIndex, self._valsFlatIndex + 0j)
+    result._covReReFlatIndex = np.where(np.outer(real, real), self._covFlatIndex, 0)
+    result._covImImFlatIndex = np.where(np.outer(imag, imag), self._covFlatIndex, 0)
+    result._covReImFlatIndex = np.where(np.outer(real, imag), self._covFlatIndex, 0)
+    return result
+
+  @classmethod
+  def fromComplex(
+    cls,
+    other: MomentResult,  # complex-valued moments to convert
+  ) -> MomentResultReal:
+    """Returns real-valued layout of given complex-valued moments; discards the imaginary parts of H_0 and H_1 and the real parts of H_2"""
+    imag = other.indices.imagPartFlags
+    real = ~imag
+    result = cls(other.indices, label = other.label)
+    result._valsFlatIndex = np.where(imag, other._valsFlatIndex.imag, other._valsFlatIndex.real)
+    result._covFlatIndex  = (
+        np.where(np.outer(real, real), other._covReReFlatIndex,   0)
+      + np.where(np.outer(imag, imag), other._covImImFlatIndex,   0)
+      + np.where(np.outer(real, imag), other._covReImFlatIndex,   0)
+      + np.where(np.outer(imag, real), other._covReImFlatIndex.T, 0)
+    )
+    return result
+
+
+@dataclass(frozen = True)  # immutable
+class BootstrapSettings:
+  """Stores settings for bootstrap estimation of moment uncertainties; for a given seed the results are reproducible independent of the number of threads"""
+  nmbReplicas:         int  = 1000   # number of bootstrap replicas
+  seed:                int  = 12345  # seed of random-number generation; the replica blocks use independent streams spawned from this seed
+  poissonWeights:      bool = True   # if set, replica weights are drawn from Poisson(1), otherwise the events are resampled with fixed total number of events, i.e. from a multinomial distribution
+  nmbReplicasPerBlock: int  = 25     # number of replicas whose weights are drawn and processed at once; memory consumption scales with nmbReplicasPerBlock * number of events
+  nmbThreads:          Optional[int] = None  # number of threads that process replica blocks in parallel; None uses default of ThreadPoolExecutor
+
+
 @dataclass
 class MomentCalculator:
   """Holds all information to calculate moments for a single kinematic bin"""
@@ -534,6 +1009,12 @@ class MomentCalculator:
   _HMeas:               Optional[MomentResult] = None  # measured moments; must either be given or calculated by calling calculateMoments()
   _HPhys:               Optional[MomentResult] = None  # physical moments; must either be given or calculated by calling calculateMoments()
   _binCenters:          Optional[Dict[KinematicBinningVariable, float]] = None # dictionary with bin centers
+  realValued:           bool = False  # if set, moments are calculated in the real-valued layout (Re[H_0], Re[H_1], Im[H_2]); HMeas and HPhys then provide the complex view of the results
+  _HMeasReal:           Optional[MomentResultReal] = None  # measured moments in real-valued layout; only set in real-valued mode
+  _HPhysReal:           Optional[MomentResultReal] = None  # physical moments in real-valued layout; only set in real-valued mode
+  profiler:             Optional[ProfilingUtilities.Profiler] = field(default = None, repr = False, compare = False)  # if set, wall time, CPU time, event throughput, and memory consumption of the calculation stages are recorded
+  memoryBudget:         Optional[Union[int, str]] = field(default = None, repr = False, compare = False)  # [bytes] or size string like '8G' used to pick chunk sizes; if None, MemoryPlanner.defaultMemoryBudget() is used
+  _nmbEventsRead:       Dict[str, int] = field(default_factory = dict, init = False, repr = False, compare = False)  # numbers of events of 'data' and 'phaseSpaceData' taken from the arrays once they were read
 
   # accessors that guarantee existence of optional fields
   @property
@@ -556,6 +1037,16 @@ class MomentCalculator:
     """Returns dictionary with kinematic variables and bin centers"""
     assert self._binCenters is not None, "self._binCenters must not be None"
     return self._binCenters
+  @property
+  def HMeasReal(self) -> MomentResultReal:
+    """Returns measured moments in real-valued layout"""
+    assert self._HMeasReal is not None, "self._HMeasReal must not be None"
+    return self._HMeasReal
+  @property
+  def HPhysReal(self) -> MomentResultReal:
+    """Returns physical moments in real-valued layout"""
+    assert self._HPhysReal is not None, "self._HPhysReal must not be None"
+    return self._HPhysReal
 
   # @property
   # def varNames(self) -> List[str]:
@@ -570,23 +1061,52 @@ class MomentCalculator:
       return []
     return [f"{var.name}_" + (f"{center:.{var.nmbDigits}f}" if var.nmbDigits is not None else f"{center}") for var, center in self.binCenters.items()]
 
+  def _profileStage(
+    self,
+    stage:     str,                   # name of stage
+    nmbEvents: Optional[int] = None,  # number of processed events
+  ) -> ContextManager[ProfilingUtilities.StageRecord]:
+    """Returns context manager that times the enclosed code if a profiler is set; the records are labeled by the kinematic bin"""
+    return ProfilingUtilities.profileStage(self.profiler, stage, "_".join(self.fileNameBinLabels), nmbEvents)
+
   @property
   def integralFileName(self) -> str:
-    """Returns file name used to save acceptance integral matrix; naming scheme is '<integralFileBaseName>_[<binning var>_<bin center>_...].npy'"""
-    return "_".join([self.integralFileBaseName, ] + self.fileNameBinLabels) + ".npy"
+    """Returns file name used to save acceptance integral matrix; naming scheme is '<integralFileBaseName>[_real]_[<binning var>_<bin center>_...].npy'"""
+    return "_".join([self.integralFileBaseName + ("_real" if self.realValued else ""), ] + self.fileNameBinLabels) + ".npy"
 
   def calculateIntegralMatrix(
     self,
     forceCalculation: bool = False,
   ) -> None:
     """Calculates acceptance integral matrix"""
-    self._integralMatrix = AcceptanceIntegralMatrix(self.indices, self.dataSet)
+    self._integralMatrix = AcceptanceIntegralMatrix(self.indices, self.dataSet, realValued = self.realValued,
+      profiler = self.profiler, profileBinLabel = "_".join(self.fileNameBinLabels), memoryBudget = self.memoryBudget)
     if forceCalculation:
       self._integralMatrix.calculate()
-    else:
-      self._integralMatrix.loadOrCalculate(self.integralFileName)
+    elif self._integralMatrix.loadOrCalculate(self.integralFileName):
+      return  # do not overwrite file, which may hold integral matrix for larger maxL
     self._integralMatrix.save(self.integralFileName)
 
+  def truncated(
+    self,
+    indices: MomentIndices,  # moment indices for same or smaller maximum L
+  ) -> MomentCalculator:
+    """Returns MomentCalculator for the given smaller set of moments without revisiting any events
+    The integral matrix and the measured moments including their covariances are slices of the ones of this instance.
+    The physical moments are recalculated from these assuming that the moments were calculated from data, i.e. with acceptance correction if an integral matrix is present.
+    """
+    momentsTruncated = MomentCalculator(indices, self.dataSet, self.integralFileBaseName, _binCenters = self._binCenters, realValued = self.realValued,
+      profiler = self.profiler, memoryBudget = self.memoryBudget)
+    if self._integralMatrix is not None:
+      momentsTruncated._integralMatrix = self._integralMatrix.sliced(indices)
+    if self.realValued and self._HMeasReal is not None:
+      HMeasReal = self._HMeasReal.sliced(indices)
+      momentsTruncated._calcMomentsReal(HMeasReal._valsFlatIndex, HMeasReal._covFlatIndex, momentsTruncated._integralMatrix)
+    elif not self.realValued and self._HMeas is not None:
+      HMeas = self._HMeas.sliced(indices)
+      momentsTruncated._calcMomentsComplex(HMeas._valsFlatIndex, HMeas.augmentedCovMatrix, momentsTruncated._integralMatrix)
+    return momentsTruncated
+
   def _calcReImCovMatrices(
     self,
     V_aug: npt.NDArray[npt.Shape["Dim, Dim"], npt.Complex128],  # augmentented covariance matrix
@@ -602,9 +1122,145 @@ class MomentCalculator:
 
   MomentDataSource = Enum("MomentDataSource", ("DATA", "ACCEPTED_PHASE_SPACE", "ACCEPTED_PHASE_SPACE_CORR"))
 
+  def _readData(
+    self,
+    dataSet: DataSet,  # dataset to read
+  ) -> Tuple[npt.NDArray[npt.Shape["*"], npt.Float64], npt.NDArray[npt.Shape["*"], npt.Float64], npt.NDArray[npt.Shape["*"], npt.Float64], npt.NDArray[npt.Shape["*"], npt.Float64]]:
+    """Returns angles and event weights of given dataset as NumPy arrays; if the data have no column 'eventWeight', all weights are 1"""
+    with self._profileStage("dataIngest") as profileRecord:
+      # read all columns in a single event loop; with implicit multi-threading, the row order of separate reads may differ, which would pair events with wrong weights
+      weighted = hasColumn(dataSet.data, "eventWeight")
+      columns = dataColumns(dataSet.data, ["theta", "phi", "Phi"] + (["eventWeight"] if weighted else []))
+      thetas = columns["theta"]
+      phis   = columns["phi"]
+      Phis   = columns["Phi"]
+      print(f"Input data column: {type(thetas)}; {thetas.shape}; {thetas.dtype}; {thetas.dtype.type}")
+      nmbEvents = len(thetas)
+      assert thetas.shape == (nmbEvents,) and thetas.shape == phis.shape == Phis.shape, (
+        f"Not all NumPy arrays with input data have the correct shape. Expected ({nmbEvents},) but got theta: {thetas.shape}, phi: {phis.shape}, and Phi: {Phis.shape}")
+      # read column with event weights if it exists
+      # !Note! event weights must be normalized such that sum_i event_i = number of background-subtracted events (see Eq. (63))
+      eventWeights = columns["eventWeight"] if weighted else np.ones(nmbEvents, dtype = np.float64)
+      self._nmbEventsRead["phaseSpaceData" if dataSet.data is self.dataSet.phaseSpaceData else "data"] = nmbEvents
+      assert eventWeights.shape == (nmbEvents,), f"NumPy arrays with event weights does not have the correct shape. Expected ({nmbEvents},) but got {eventWeights.shape}"
+      profileRecord.nmbEvents = nmbEvents
+    return (thetas, phis, Phis, eventWeights)
+
+  def _evalMeasBasisFcns(
+    self,
+    thetas:       npt.NDArray[npt.Shape["*"], npt.Float64],  # polar angles of events
+    phis:         npt.NDArray[npt.Shape["*"], npt.Float64],  # azimuthal angles of events
+    Phis:         npt.NDArray[npt.Shape["*"], npt.Float64],  # angles of photon polarization of events
+    polarization: float,  # photon-beam polarization
+  ) -> npt.NDArray[npt.Shape["Dim, *"], npt.Inexact]:
+    """Evaluates basis functions for measured moments for the given events; returns basis-function values with shape (number of moments, number of events)"""
+    # calculate basis-function values; Eq. (176)
+    # in real-valued mode, the real-valued basis functions (Re[f_meas_0], Re[f_meas_1], Im[f_meas_2]) are used
+    kernels = KernelLibrary.kernels()
+    f_meas, dtype = (kernels.f_measReal, np.float64) if self.realValued else (kernels.f_meas, np.complex128)
+    fMeas = np.empty((len(self.indices), len(thetas)), dtype = dtype)
+    with self._profileStage("basisEvaluation", len(thetas)):
+      for flatIndex in self.indices.flatIndices():
+        qnIndex = self.indices[flatIndex]
+        fMeas[flatIndex] = f_meas(qnIndex.momentIndex, qnIndex.L, qnIndex.M, thetas, phis, Phis, polarization)
+    return fMeas
+
+  def _knownNmbEvents(
+    self,
+    dataName: str,  # 'data' or 'phaseSpaceData'
+  ) -> Optional[int]:
+    """Returns number of events of the data or the phase-space data if it is known without an event loop, i.e. for NumPy arrays or once the columns were read; None otherwise"""
+    count = nmbEvents(getattr(self.dataSet, dataName))
+    return count if count is not None else self._nmbEventsRead.get(dataName)
+
+  def planMemory(
+    self,
+    dataSource: MomentDataSource = MomentDataSource.DATA,
+    bootstrap:  Optional[BootstrapSettings] = None,  # if set, the memory consumption of the bootstrap estimation of the covariances is planned
+    nmbWorkers: int = 1,  # number of kinematic bins that are processed in parallel
+  ) -> List[MemoryPlanner.MemoryPlan]:
+    """Returns memory plans for the calculation of the integral matrix and of the moments without processing any events; raises MemoryError if a calculation does not fit into the memory budget
+    Calculations on RDataFrames whose numbers of events are not yet known from previously read arrays are not planned here, because counting would require an extra event loop; they are planned when their data are read.
+    """
+    nmbMoments = len(self.indices)
+    memoryPlans: List[MemoryPlanner.MemoryPlan] = []
+    nmbPsEvents = self._knownNmbEvents("phaseSpaceData")
+    if nmbPsEvents is not None:
+      memoryPlans.append(AcceptanceIntegralMatrix(self.indices, self.dataSet, realValued = self.realValued, memoryBudget = self.memoryBudget).planMemory(
+        nmbPsEvents, nmbWorkers = nmbWorkers))
+    nmbDataEvents = self._knownNmbEvents("data" if dataSource == self.MomentDataSource.DATA else "phaseSpaceData")
+    if nmbDataEvents is not None:
+      if bootstrap is None:
+        memoryPlans.append(MemoryPlanner.planMoments(nmbDataEvents, nmbMoments, self.realValued, self.memoryBudget, nmbWorkers = nmbWorkers))
+      else:
+        memoryPlans.append(MemoryPlanner.planBootstrap(nmbDataEvents, nmbMoments, self.realValued, bootstrap.nmbReplicas, bootstrap.nmbReplicasPerBlock,
+          self._nmbBootstrapThreads(bootstrap), self.memoryBudget))
+    return memoryPlans
+
+  def _calcMeasMomentsFromData(
+    self,
+    dataSet: DataSet,  # dataset from which to calculate measured moments
+  ) -> Tuple[npt.NDArray[npt.Shape["Dim"], npt.Inexact], npt.NDArray[npt.Shape["*, *"], npt.Inexact]]:
+    """Calculates measured moments and their covariance matrix from given dataset; in complex-valued mode, the augmented covariance matrix is returned
+    The events are processed in chunks whose size is chosen by the memory planner, so that the basis-function values of all events are never held in memory at once.
+    """
+    thetas, phis, Phis, eventWeights = self._readData(dataSet)
+    memoryPlan = MemoryPlanner.planMoments(len(thetas), len(self.indices), self.realValued, self.memoryBudget)
+    print(memoryPlan)
+    sumOfWeights        = np.sum(eventWeights)
+    sumOfSquaredWeights = np.sum(np.square(eventWeights))
+    # accumulate weighted sums of basis-function values and of their products
+    # unfortunately, np.cov() does not accept negative weights
+    # hence the covariance is calculated from sum_i w_i (f_i - mean)(f_i - mean)^H = sum_i w_i (f_i - K)(f_i - K)^H - W (mean - K)(mean - K)^H with W = sum_i w_i
+    # the products are taken relative to a reference point K, which are the values of the first event, so that the subtraction does not cancel catastrophically for (nearly) constant basis functions like that of H_0(0, 0)
+    # unlike the mean of a chunk, which is subject to rounding, this reference shifts constant basis functions exactly to 0, so that their variance is exactly 0
+    # see also https://github.com/numpy/numpy/blob/d35cd07ea997f033b2d89d349734c61f5de54b0d/numpy/lib/function_base.py#L2530-L2749
+    nmbMoments   = len(self.indices)
+    dtype        = np.float64 if self.realValued else np.complex128
+    weightedSums = np.zeros((nmbMoments, ), dtype = dtype)
+    shiftedSums  = np.zeros((nmbMoments, ), dtype = dtype)  # sum_i w_i (f_i - K)
+    sumsOfProductsHermit = np.zeros((nmbMoments, nmbMoments), dtype = dtype)  # sum_i w_i (f_i - K) (f_i - K)^H
+    sumsOfProductsPseudo = np.zeros((nmbMoments, nmbMoments), dtype = dtype)  # sum_i w_i (f_i - K) (f_i - K)^T; only needed in complex-valued mode
+    reference: Optional[npt.NDArray[npt.Shape["Dim"], npt.Inexact]] = None  # reference point K
+    for chunkStart in range(0, len(thetas), memoryPlan.nmbEventsPerChunk):
+      chunk = slice(chunkStart, chunkStart + memoryPlan.nmbEventsPerChunk)
+      fMeas = self._evalMeasBasisFcns(thetas[chunk], phis[chunk], Phis[chunk], dataSet.polarization)
+      with self._profileStage("covariance", fMeas.shape[1]):
+        if reference is None:
+          reference = fMeas[:, 0].copy()  # copy, because fMeas is shifted in place
+        weightedSums += fMeas @ eventWeights[chunk]
+        fMeas -= reference[:, None]
+        weighted_fMeas = fMeas * eventWeights[chunk]
+        shiftedSums          += np.sum(weighted_fMeas, axis = 1)
+        sumsOfProductsHermit += weighted_fMeas @ np.conjugate(fMeas).T
+        if not self.realValued:
+          sumsOfProductsPseudo += weighted_fMeas @ fMeas.T
+    HMeasVals = 2 * np.pi * weightedSums  # Eq. (179)
+    # calculate covariance matrices for measured moments; Eqs. (88), (180), and (181)
+    with self._profileStage("covariance"):
+      shiftedMeans = shiftedSums / sumOfWeights  # weighted means of fMeas values relative to reference point
+      V_Hermit = sumsOfProductsHermit - sumOfWeights * np.outer(shiftedMeans, np.conjugate(shiftedMeans))
+      if self.realValued:
+        V_meas = V_Hermit  # for real-valued quantities the augmented covariance matrix reduces to the ordinary one
+      else:
+        V_pseudo = sumsOfProductsPseudo - sumOfWeights * np.outer(shiftedMeans, shiftedMeans)
+        V_meas = np.block([
+          [V_Hermit,               V_pseudo],
+          [np.conjugate(V_pseudo), np.conjugate(V_Hermit)],
+        ])  # augmented covariance matrix; Eq. (88)
+      # see https://juliastats.org/StatsBase.jl/stable/weights/#Implementations and https://juliastats.org/StatsBase.jl/stable/cov/
+      # for a sample of ~1000 background-subtracted events the uncertainty estimates using the various Bessel corrections differ only in the 4th decimal place
+      besselCorrection = 1 / (sumOfWeights - 1)  # assuming frequency weights, i.e. the sum of weights is the number of background-subtracted events
+      # besselCorrection = 1 / (sumOfWeights - sumOfSquaredWeights / sumOfWeights)  # assuming analytic weights that describe importance of each measurement
+      # nmbNonZeroWeights = np.count_nonzero(eventWeights)
+      # besselCorrection = nmbNonZeroWeights / ((nmbNonZeroWeights - 1) * sumOfWeights)  # assuming probability weights that represent the inverse of the sampling probability for each observation
+      V_meas = (2 * np.pi)**2 * sumOfSquaredWeights * besselCorrection * V_meas
+    return (HMeasVals, V_meas)
+
   def calculateMoments(
     self,
     dataSource: MomentDataSource = MomentDataSource.DATA,
+    bootstrap:  Optional[BootstrapSettings] = None,  # if set, covariances are estimated from bootstrap replicas instead of by linear uncertainty propagation
   ) -> None:
     """Calculates photoproduction moments and their covariances using given data source"""
     # define dataset and integral matrix to use for moment calculation
@@ -623,48 +1279,124 @@ class MomentCalculator:
       integralMatrix = self._integralMatrix
     else:
       raise ValueError(f"Unknown data source '{dataSource}'")
-    # get input data as NumPy arrays
-    thetas = dataSet.data.AsNumpy(columns = ["theta"])["theta"]
-    phis   = dataSet.data.AsNumpy(columns = ["phi"]  )["phi"]
-    Phis   = dataSet.data.AsNumpy(columns = ["Phi"]  )["Phi"]
-    print(f"Input data column: {type(thetas)}; {thetas.shape}; {thetas.dtype}; {thetas.dtype.type}")
-    nmbEvents = len(thetas)
-    assert thetas.shape == (nmbEvents,) and thetas.shape == phis.shape == Phis.shape, (
-      f"Not all NumPy arrays with input data have the correct shape. Expected ({nmbEvents},) but got theta: {thetas.shape}, phi: {phis.shape}, and Phi: {Phis.shape}")
-    # read column with event weights if it exists
-    # !Note! event weights must be normalized such that sum_i event_i = number of background-subtracted events (see Eq. (63))
-    eventWeights = (dataSet.data.AsNumpy(columns = ["eventWeight"]  )["eventWeight"] if "eventWeight" in dataSet.data.GetColumnNames()
-                    else np.ones(nmbEvents, dtype = npt.Float64))
-    assert eventWeights.shape == (nmbEvents,), f"NumPy arrays with event weights does not have the correct shape. Expected ({nmbEvents},) but got {eventWeights.shape}"
-    sumOfWeights        = np.sum(eventWeights)
-    sumOfSquaredWeights = np.sum(np.square(eventWeights))
-    # calculate basis-function values and values of measured moments
+    if bootstrap is not None:
+      self._calcMomentsBootstrap(dataSet, integralMatrix, bootstrap)
+      return
+    # calculate measured moments and their covariances
+    if dataSource != self.MomentDataSource.DATA and self._integralMatrix is not None and self._integralMatrix.hasHarmonicSums:
+      # the moments of the accepted phase-space data follow from the sums that were accumulated when the integral matrix was calculated
+      print("Calculating moments of accepted phase-space data from sums accumulated for acceptance integral matrix")
+      with self._profileStage("covariance"):
+        HMeasVals, V_meas = self._integralMatrix.phaseSpaceMeasMoments(dataSet.polarization)
+    else:
+      HMeasVals, V_meas = self._calcMeasMomentsFromData(dataSet)
+    if self.realValued:
+      self._calcMomentsReal(HMeasVals, V_meas, integralMatrix)
+    else:
+      self._calcMomentsComplex(HMeasVals, V_meas, integralMatrix)
+
+  @staticmethod
+  def _bootstrapReplicas(
+    fMeas:        npt.NDArray[npt.Shape["Dim, *"], npt.Inexact],  # basis-function values with shape (number of moments, number of events)
+    eventWeights: npt.NDArray[npt.Shape["*"], npt.Float64],       # event weights
+    bootstrap:    BootstrapSettings,
+  ) -> npt.NDArray[npt.Shape["*, Dim"], npt.Inexact]:
+    """Returns measured moments for all bootstrap replicas with shape (number of replicas, number of moments)"""
+    nmbEvents = fMeas.shape[1]
+    # complex basis-function values are viewed as interleaved real and imaginary parts so that each block of replicas requires only a single real-valued matrix product
+    fMeasT = np.ascontiguousarray(fMeas.T).view(np.float64)
+    blockSizes = [min(bootstrap.nmbReplicasPerBlock, bootstrap.nmbReplicas - start) for start in range(0, bootstrap.nmbReplicas, bootstrap.nmbReplicasPerBlock)]
+    seeds      = np.random.SeedSequence(bootstrap.seed).spawn(len(blockSizes))  # independent random-number streams for the blocks make the result independent of the execution order
+
+    def replicasForBlock(blockIndex: int) -> npt.NDArray[npt.Shape["*, *"], npt.Float64]:
+      """Draws replica weights for one block and returns the measured moments of the replicas; Eq. (179)"""
+      rng = np.random.default_rng(seeds[blockIndex])
+      if bootstrap.poissonWeights:
+        replicaCounts = rng.poisson(1.0, size = (blockSizes[blockIndex], nmbEvents))
+      else:
+        replicaCounts = rng.multinomial(nmbEvents, np.full(nmbEvents, 1 / nmbEvents), size = blockSizes[blockIndex])
+      return 2 * np.pi * ((replicaCounts * eventWeights) @ fMeasT)
+
+    print(f"Calculating {bootstrap.nmbReplicas} bootstrap replicas of measured moments in {len(blockSizes)} blocks")
+    with ThreadPoolExecutor(max_workers = bootstrap.nmbThreads) as executor:
+      replicas = np.concatenate(list(executor.map(replicasForBlock, range(len(blockSizes)))), axis = 0)
+    return replicas.view(fMeas.dtype)
+
+  @staticmethod
+  def _nmbBootstrapThreads(bootstrap: BootstrapSettings) -> int:
+    """Returns number of threads used to process bootstrap replica blocks; None in the settings corresponds to the default of ThreadPoolExecutor"""
+    return bootstrap.nmbThreads if bootstrap.nmbThreads is not None else min(32, (os.cpu_count() or 1) + 4)
+
+  def _calcMomentsBootstrap(
+    self,
+    dataSet:        DataSet,  # dataset from which to calculate moments
+    integralMatrix: Optional[AcceptanceIntegralMatrix],  # if None no acceptance correction is performed
+    bootstrap:      BootstrapSettings,
+  ) -> None:
+    """Calculates measured and physical moments from given dataset and estimates their covariances from bootstrap replicas
+    The basis functions are evaluated only once; each replica differs only in the event weights, which are multiplied by random counts.
+    """
+    thetas, phis, Phis, eventWeights = self._readData(dataSet)
+    memoryPlan = MemoryPlanner.planBootstrap(len(thetas), len(self.indices), self.realValued, bootstrap.nmbReplicas, bootstrap.nmbReplicasPerBlock,
+      self._nmbBootstrapThreads(bootstrap), self.memoryBudget)
+    print(memoryPlan)
+    if memoryPlan.downscaled:
+      if memoryPlan.nmbReplicasPerBlock != bootstrap.nmbReplicasPerBlock:
+        print(f"!Note! Reduced number of bootstrap replicas per block from {bootstrap.nmbReplicasPerBlock} to {memoryPlan.nmbReplicasPerBlock} to fit into memory budget; "
+              "the replicas differ from the ones obtained with the requested settings")
+      bootstrap = dataclasses.replace(bootstrap, nmbReplicasPerBlock = memoryPlan.nmbReplicasPerBlock, nmbThreads = memoryPlan.nmbWorkers)
+    fMeas     = self._evalMeasBasisFcns(thetas, phis, Phis, dataSet.polarization)
+    HMeasVals = 2 * np.pi * (fMeas @ eventWeights)  # Eq. (179)
+    with self._profileStage("covariance", fMeas.shape[1]):
+      HMeasReplicas = self._bootstrapReplicas(fMeas, eventWeights, bootstrap)
+    if integralMatrix is None:
+      # ideal detector: physical moments are identical to measured moments
+      HPhysVals     = HMeasVals.copy()
+      HPhysReplicas = HMeasReplicas.copy()
+    else:
+      # correct for detection efficiency; Eq. (83)
+      I_inv = integralMatrix.inverse
+      HPhysVals     = I_inv @ HMeasVals
+      HPhysReplicas = HMeasReplicas @ I_inv.T
+    # normalize moments such that H_0(0, 0) = 1; as for linear uncertainty propagation the normalization is treated as a constant
+    norm = HPhysVals[0]
+    HPhysVals     /= norm
+    HPhysReplicas /= norm
+    if self.realValued:
+      assert integralMatrix is None or integralMatrix.realValued, "Real-valued moments require real-valued acceptance integral matrix"
+      self._HMeasReal = MomentResultReal(self.indices, label = "meas")
+      self._HPhysReal = MomentResultReal(self.indices, label = "phys")
+      for result, vals, replicas in ((self._HMeasReal, HMeasVals, HMeasReplicas), (self._HPhysReal, HPhysVals, HPhysReplicas)):
+        result._valsFlatIndex = vals
+        result._covFlatIndex  = np.atleast_2d(np.cov(replicas, rowvar = False))
+      # provide complex view of results
+      self._HMeas = self._HMeasReal.toComplex()
+      self._HPhys = self._HPhysReal.toComplex()
+    else:
+      nmbMoments = len(self.indices)
+      self._HMeas = MomentResult(self.indices, label = "meas")
+      self._HPhys = MomentResult(self.indices, label = "phys")
+      for result, vals, replicas in ((self._HMeas, HMeasVals, HMeasReplicas), (self._HPhys, HPhysVals, HPhysReplicas)):
+        result._valsFlatIndex = vals
+        V = np.atleast_2d(np.cov(np.concatenate((replicas.real, replicas.imag), axis = 1), rowvar = False))  # covariance matrix of real and imaginary parts
+        result._covReReFlatIndex = V[:nmbMoments, :nmbMoments]
+        result._covImImFlatIndex = V[nmbMoments:, nmbMoments:]
+        result._covReImFlatIndex = V[:nmbMoments, nmbMoments:]
+
+  def _calcMomentsComplex(
+    self,
+    HMeasVals:      npt.NDArray[npt.Shape["Dim"], npt.Complex128],               # values of measured moments
+    V_meas_aug:     npt.NDArray[npt.Shape["2 * Dim, 2 * Dim"], npt.Complex128],  # augmented covariance matrix of measured moments
+    integralMatrix: Optional[AcceptanceIntegralMatrix],  # if None no acceptance correction is performed
+  ) -> None:
+    """Sets measured moments and calculates physical moments and their covariances"""
     nmbMoments = len(self.indices)
-    fMeas      = np.empty((nmbMoments, nmbEvents), dtype = npt.Complex128)
-    fMeasMeans = np.empty((nmbMoments,),           dtype = npt.Complex128)  # weighted means of fMeas values
     self._HMeas = MomentResult(self.indices, label = "meas")
-    for flatIndex in self.indices.flatIndices():
-      qnIndex = self.indices[flatIndex]
-      fMeas[flatIndex] = np.asarray(ROOT.f_meas(qnIndex.momentIndex, qnIndex.L, qnIndex.M, thetas, phis, Phis, dataSet.polarization))  # Eq. (176)
-      weightedSum = eventWeights.dot(fMeas[flatIndex])
-      self._HMeas._valsFlatIndex[flatIndex] = 2 * np.pi * weightedSum  # Eq. (179)
-      fMeasMeans[flatIndex] = weightedSum / sumOfWeights
-    # calculate covariance matrices for measured moments; Eqs. (88), (180), and (181)
-    # unfortunately, np.cov() does not accept negative weights
-    # reimplement code from https://github.com/numpy/numpy/blob/d35cd07ea997f033b2d89d349734c61f5de54b0d/numpy/lib/function_base.py#L2530-L2749
-    delta_fMeas = fMeas - fMeasMeans[:, None]
-    delta_fMeas_aug = np.concatenate((delta_fMeas, np.conjugate(delta_fMeas)), axis = 0)  # augmented vector, i.e. delta_fMeas stacked on top of delta_fMeas^*
-    # see https://juliastats.org/StatsBase.jl/stable/weights/#Implementations and https://juliastats.org/StatsBase.jl/stable/cov/
-    # for a sample of ~1000 background-subtracted events the uncertainty estimates using the various Bessel corrections differ only in the 4th decimal place
-    besselCorrection = 1 / (sumOfWeights - 1)  # assuming frequency weights, i.e. the sum of weights is the number of background-subtracted events
-    # besselCorrection = 1 / (sumOfWeights - sumOfSquaredWeights / sumOfWeights)  # assuming analytic weights that describe importance of each measurement
-    # nmbNonZeroWeights = np.count_nonzero(eventWeights)
-    # besselCorrection = nmbNonZeroWeights / ((nmbNonZeroWeights - 1) * sumOfWeights)  # assuming probability weights that represent the inverse of the sampling probability for each observation
-    V_meas_aug = (2 * np.pi)**2 * sumOfSquaredWeights * besselCorrection * ((eventWeights * delta_fMeas_aug) @ np.asmatrix(delta_fMeas_aug).H)
+    self._HMeas._valsFlatIndex = HMeasVals
     self._HMeas._covReReFlatIndex, self._HMeas._covImImFlatIndex, self._HMeas._covReImFlatIndex = self._calcReImCovMatrices(V_meas_aug)
     # calculate physical moments and propagate uncertainty
     self._HPhys = MomentResult(self.indices, label = "phys")
-    V_phys_aug = np.empty(V_meas_aug.shape, dtype = npt.Complex128)
+    V_phys_aug = np.empty(V_meas_aug.shape, dtype = np.complex128)
     if integralMatrix is None:
       # ideal detector: physical moments are identical to measured moments
       np.copyto(self._HPhys._valsFlatIndex, self._HMeas._valsFlatIndex)
@@ -675,24 +1407,65 @@ class MomentCalculator:
       # calculate physical moments, i.e. correct for detection efficiency
       self._HPhys._valsFlatIndex = I_inv @ self._HMeas._valsFlatIndex  # Eq. (83)
       # perform linear uncertainty propagation
-      J = I_inv  # Jacobian of efficiency correction; Eq. (101)
-      J_conj = np.zeros((nmbMoments, nmbMoments), dtype = npt.Complex128)  # conjugate Jacobian; Eq. (101)
-      J_aug = np.block([
-        [J,                    J_conj],
-        [np.conjugate(J_conj), np.conjugate(J)],
-      ])  # augmented Jacobian; Eq. (98)
-      V_phys_aug = J_aug @ (V_meas_aug @ np.asmatrix(J_aug).H)  #!Note! @ is left-associative; Eq. (85)
+      with self._profileStage("covariance"):
+        J = I_inv  # Jacobian of efficiency correction; Eq. (101)
+        J_conj = np.zeros((nmbMoments, nmbMoments), dtype = np.complex128)  # conjugate Jacobian; Eq. (101)
+        J_aug = np.block([
+          [J,                    J_conj],
+          [np.conjugate(J_conj), np.conjugate(J)],
+        ])  # augmented Jacobian; Eq. (98)
+        V_phys_aug = J_aug @ (V_meas_aug @ np.asmatrix(J_aug).H)  #!Note! @ is left-associative; Eq. (85)
     # normalize moments such that H_0(0, 0) = 1
     norm: complex = self._HPhys[0].val
     self._HPhys._valsFlatIndex /= norm
     V_phys_aug /= norm**2
     self._HPhys._covReReFlatIndex, self._HPhys._covImImFlatIndex, self._HPhys._covReImFlatIndex = self._calcReImCovMatrices(V_phys_aug)
 
+  def _calcMomentsReal(
+    self,
+    HMeasVals:      npt.NDArray[npt.Shape["Dim"], npt.Float64],       # values of measured moments in real-valued layout
+    V_meas:         npt.NDArray[npt.Shape["Dim, Dim"], npt.Float64],  # covariance matrix of measured moments in real-valued layout
+    integralMatrix: Optional[AcceptanceIntegralMatrix],  # if None no acceptance correction is performed
+  ) -> None:
+    """Sets measured moments and calculates physical moments and their covariances in the real-valued layout (Re[H_0], Re[H_1], Im[H_2]); the complex view of the results is provided via HMeas and HPhys"""
+    assert integralMatrix is None or integralMatrix.realValued, "Real-valued moments require real-valued acceptance integral matrix"
+    self._HMeasReal = MomentResultReal(self.indices, label = "meas")
+    self._HMeasReal._valsFlatIndex = HMeasVals
+    self._HMeasReal._covFlatIndex  = V_meas
+    # calculate physical moments and propagate uncertainty
+    self._HPhysReal = MomentResultReal(self.indices, label = "phys")
+    if integralMatrix is None:
+      # ideal detector: physical moments are identical to measured moments
+      np.copyto(self._HPhysReal._valsFlatIndex, self._HMeasReal._valsFlatIndex)
+      np.copyto(self._HPhysReal._covFlatIndex,  self._HMeasReal._covFlatIndex)
+    else:
+      # correct for detection efficiency and perform linear uncertainty propagation; the Jacobian is the inverse of the integral matrix
+      I_inv = integralMatrix.inverse
+      self._HPhysReal._valsFlatIndex = I_inv @ self._HMeasReal._valsFlatIndex
+      with self._profileStage("covariance"):
+        self._HPhysReal._covFlatIndex = I_inv @ (self._HMeasReal._covFlatIndex @ I_inv.T)
+    # normalize moments such that H_0(0, 0) = 1
+    norm: float = self._HPhysReal._valsFlatIndex[0]
+    self._HPhysReal._valsFlatIndex /= norm
+    self._HPhysReal._covFlatIndex  /= norm**2
+    # provide complex view of results
+    self._HMeas = self._HMeasReal.toComplex()
+    self._HPhys = self._HPhysReal.toComplex()
+
 
 @dataclass
 class MomentCalculatorsKinematicBinning:
   """Holds all information to calculate moments for several kinematic bins"""
-  moments: List[MomentCalculator]  # data for all bins of the kinematic binning
+  moments:  List[MomentCalculator]  # data for all bins of the kinematic binning
+  profiler:     Optional[ProfilingUtilities.Profiler] = field(default = None, repr = False, compare = False)  # if set, it is used by all bins that do not have their own profiler
+  memoryBudget: Optional[Union[int, str]] = field(default = None, repr = False, compare = False)  # if set, it is used by all bins that do not have their own memory budget
+
+  def __post_init__(self) -> None:
+    for momentsInBin in self.moments:
+      if momentsInBin.profiler is None:
+        momentsInBin.profiler = self.profiler
+      if momentsInBin.memoryBudget is None:
+        momentsInBin.memoryBudget = self.memoryBudget
 
   def __len__(self) -> int:
     """Returns number of kinematic bins"""
@@ -730,10 +1503,35 @@ class MomentCalculatorsKinematicBinning:
       print(f"Calculating the acceptance integral matrix for kinematic bin {momentsInBin.binCenters}")
       momentsInBin.calculateIntegralMatrix(forceCalculation)
 
+  def planMemory(
+    self,
+    dataSource: MomentCalculator.MomentDataSource = MomentCalculator.MomentDataSource.DATA,
+    bootstrap:  Optional[BootstrapSettings] = None,  # if set, the memory consumption of the bootstrap estimation of the covariances is planned
+    nmbWorkers: int = 1,  # number of kinematic bins that are processed in parallel
+  ) -> List[MemoryPlanner.MemoryPlan]:
+    """Returns memory plans for all kinematic bins before any events are processed; raises MemoryError if a calculation in any bin does not fit into the memory budget; see MomentCalculator.planMemory() for RDataFrame inputs"""
+    memoryPlans: List[MemoryPlanner.MemoryPlan] = []
+    for momentsInBin in self:
+      memoryPlansInBin = momentsInBin.planMemory(dataSource, bootstrap, nmbWorkers)
+      if not memoryPlansInBin:
+        print(f"Kinematic bin {momentsInBin.binCenters}: numbers of events are not known before the data are read; memory is planned when the data are read")
+      for memoryPlan in memoryPlansInBin:
+        print(f"Kinematic bin {momentsInBin.binCenters}: {memoryPlan}")
+        memoryPlans.append(memoryPlan)
+    return memoryPlans
+
   def calculateMoments(
     self,
     dataSource: MomentCalculator.MomentDataSource = MomentCalculator.MomentDataSource.DATA,
+    bootstrap:  Optional[BootstrapSettings] = None,  # if set, covariances are estimated from bootstrap replicas
   ) -> None:
     """Calculates moments for all kinematic bins using given data source"""
     for momentsInBin in self:
-      momentsInBin.calculateMoments(dataSource)
+      momentsInBin.calculateMoments(dataSource, bootstrap)
+
+  def truncated(
+    self,
+    indices: MomentIndices,  # moment indices for same or smaller maximum L
+  ) -> MomentCalculatorsKinematicBinning:
+    """Returns MomentCalculators for all kinematic bins for the given smaller set of moments without revisiting any events"""
+    return MomentCalculatorsKinematicBinning([momentsInBin.truncated(indices) for momentsInBin in self], profiler = self.profiler, memoryBudget = self.memoryBudget)
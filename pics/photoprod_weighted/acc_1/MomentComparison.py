@@ -0,0 +1,169 @@
+"""Module that compares moments extracted in kinematic bins with true values and returns pulls, chi^2/ndf, and p-values as arrays without rendering any plots"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import functools
+import json
+import numpy as np
+from typing import (
+  Any,
+  Dict,
+  List,
+  Optional,
+  Sequence,
+  Union,
+  TYPE_CHECKING,
+)
+
+import MomentCalculator
+
+# scipy is imported on first use, so that importing this module is fast
+if TYPE_CHECKING:
+  import nptyping as npt
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+MOMENT_PARTS = ("Re", "Im")  # order of the real and imaginary parts along the part axis of the arrays
+
+
+@dataclass
+class Chi2Summary:
+  """Stores chi^2, number of degrees of freedom, and p-values; all fields are arrays of the same shape"""
+  chi2:   npt.NDArray[Any, npt.Float64]  # sum of squared unmasked pulls
+  ndf:    npt.NDArray[Any, npt.Int]      # number of unmasked pulls
+  pValue: npt.NDArray[Any, npt.Float64]  # probability of chi^2 values larger than the observed one; NaN if ndf = 0
+
+  @property
+  def chi2PerNdf(self) -> npt.NDArray[Any, npt.Float64]:
+    """Returns chi^2/ndf; NaN if ndf = 0"""
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+      return np.where(self.ndf > 0, self.chi2 / self.ndf, np.nan)
+
+
+def chi2Summary(
+  pulls: np.ma.MaskedArray,  # pulls; masked entries are excluded
+  axis:  Union[None, int, tuple] = None,  # axis or axes along which the chi^2 is summed; None sums over all entries
+) -> Chi2Summary:
+  """Returns chi^2, number of degrees of freedom, and p-value of given pulls; ndf is the number of unmasked pulls"""
+  from scipy import stats
+  chi2 = np.ma.filled(np.ma.sum(pulls**2, axis = axis), 0.0)
+  ndf  = np.ma.count(pulls, axis = axis)
+  with np.errstate(invalid = "ignore"):
+    pValue = np.where(ndf > 0, stats.distributions.chi2.sf(chi2, np.maximum(ndf, 1)), np.nan)
+  return Chi2Summary(np.asarray(chi2, dtype = np.float64), np.asarray(ndf, dtype = int), np.asarray(pValue, dtype = np.float64))
+
+
+def pulls(
+  dataVals:   npt.NDArray[Any, npt.Complex128],  # moment values extracted from data
+  dataUncert: npt.NDArray[Any, npt.Float64],     # uncertainties of real and imaginary parts with shape (..., 2, nmbMoments)
+  truthVals:  npt.NDArray[Any, npt.Complex128],  # true moment values; NaN flags missing truth values
+  maskH000:   npt.NDArray[Any, npt.Bool],        # flags H_0(0, 0) for each moment
+  maskParts:  Optional[npt.NDArray[Any, npt.Bool]] = None,  # flags real and imaginary parts with shape (2, nmbMoments) that are excluded, e.g. the parts that are zero by construction in the real-valued layout
+) -> np.ma.MaskedArray:
+  """Returns pulls (data - truth) / sigma_data of real and imaginary parts with shape (..., 2, nmbMoments)
+  Pulls are 0 if the uncertainty is 0; they are masked for H_0(0, 0), which is always 1 by definition, and where the truth value is missing (same rules as in PlottingUtilities.plotMoments()), and for the parts flagged in maskParts.
+  """
+  diff = np.stack((dataVals.real - truthVals.real, dataVals.imag - truthVals.imag), axis = -2)
+  with np.errstate(divide = "ignore", invalid = "ignore"):
+    pullVals = np.where(dataUncert > 0, diff / dataUncert, np.where(np.isnan(diff), np.nan, 0.0))
+  mask = np.isnan(pullVals) | np.broadcast_to(maskH000, pullVals.shape)
+  if maskParts is not None:
+    mask |= np.broadcast_to(maskParts, pullVals.shape)
+  return np.ma.masked_array(pullVals, mask = mask)
+
+
+@dataclass
+class MomentComparison:
+  """Pulls of the physical moments in all kinematic bins with respect to the true values; the pulls have shape (nmbBins, 2, nmbMoments) with the real and imaginary parts along the second axis"""
+  indices:    MomentCalculator.MomentIndices  # moment indices of the last axis
+  binCenters: List[Dict[MomentCalculator.KinematicBinningVariable, float]]  # bin centers of the first axis
+  pulls:      np.ma.MaskedArray               # masked pulls
+
+  @property
+  def momentIndices(self) -> npt.NDArray[npt.Shape["nmbMoments"], npt.Int]:
+    """Returns moment index, i.e. 0, 1, or 2, for each moment"""
+    return np.array([qnIndex.momentIndex for qnIndex in self.indices.QnIndices()], dtype = int)
+
+  def chi2PerBin(self) -> Chi2Summary:
+    """Returns chi^2 summed over L and M for each kinematic bin, moment part, and moment index with shape (nmbBins, 2, 3); corresponds to PlottingUtilities.plotMomentsInBin()"""
+    momentIndices = self.momentIndices
+    summaries = [chi2Summary(self.pulls[..., momentIndices == momentIndex], axis = -1) for momentIndex in range(3)]
+    return Chi2Summary(*(np.stack([getattr(summary, name) for summary in summaries], axis = -1) for name in ("chi2", "ndf", "pValue")))
+
+  def chi2PerMoment(self) -> Chi2Summary:
+    """Returns chi^2 summed over kinematic bins for each moment part and moment with shape (2, nmbMoments); corresponds to PlottingUtilities.plotMoments1D()"""
+    return chi2Summary(self.pulls, axis = 0)
+
+  def chi2Total(self) -> Chi2Summary:
+    """Returns chi^2 summed over all kinematic bins, moment parts, and moments"""
+    return chi2Summary(self.pulls)
+
+  def summary(self) -> str:
+    """Returns table with chi^2/ndf and p-values for each kinematic bin and moment index and the total chi^2/ndf"""
+    perBin = self.chi2PerBin()
+    lines = [f"{'bin':<30}{'moment':>8}{'part':>6}{'chi2':>10}{'ndf':>5}{'chi2/ndf':>10}{'p-value':>10}"]
+    for binIndex, binCenters in enumerate(self.binCenters):
+      binLabel = ", ".join(f"{var.name} = {center:.{var.nmbDigits if var.nmbDigits is not None else 3}f}" for var, center in binCenters.items())
+      for partIndex, part in enumerate(MOMENT_PARTS):
+        for momentIndex in range(3):
+          chi2, ndf, pValue = perBin.chi2[binIndex, partIndex, momentIndex], perBin.ndf[binIndex, partIndex, momentIndex], perBin.pValue[binIndex, partIndex, momentIndex]
+          lines.append(f"{binLabel:<30}{'H' + str(momentIndex):>8}{part:>6}{chi2:10.2f}{ndf:>5}{perBin.chi2PerNdf[binIndex, partIndex, momentIndex]:10.3f}{pValue:10.3f}")
+    total = self.chi2Total()
+    lines.append(f"Total: chi2/ndf = {total.chi2:.2f}/{total.ndf} = {total.chi2PerNdf:.3f}, p-value = {total.pValue:.3f}")
+    return "\n".join(lines)
+
+  def toJson(self, fileName: str) -> None:
+    """Writes pulls and chi^2 summaries to JSON file; masked pulls are written as null"""
+    def asList(array: np.ndarray) -> Any:
+      return np.where(np.isnan(array), None, array).tolist() if np.issubdtype(array.dtype, np.floating) else array.tolist()
+    perBin, perMoment, total = self.chi2PerBin(), self.chi2PerMoment(), self.chi2Total()
+    with open(fileName, "w") as jsonFile:
+      json.dump({
+        "moments"       : [f"H{qnIndex.momentIndex}_{qnIndex.L}_{qnIndex.M}" for qnIndex in self.indices.QnIndices()],
+        "parts"         : MOMENT_PARTS,
+        "binCenters"    : [{var.name : center for var, center in binCenters.items()} for binCenters in self.binCenters],
+        "pulls"         : asList(np.ma.filled(self.pulls.astype(np.float64), np.nan)),
+        "chi2PerBin"    : {"chi2" : asList(perBin.chi2),    "ndf" : asList(perBin.ndf),    "pValue" : asList(perBin.pValue)},
+        "chi2PerMoment" : {"chi2" : asList(perMoment.chi2), "ndf" : asList(perMoment.ndf), "pValue" : asList(perMoment.pValue)},
+        "chi2Total"     : {"chi2" : float(total.chi2),      "ndf" : int(total.ndf),        "pValue" : float(total.pValue)},
+      }, jsonFile, indent = 2)
+
+
+def _truthVals(
+  truth:   MomentCalculator.MomentResult,   # true moment values
+  indices: MomentCalculator.MomentIndices,  # moment indices of the data
+) -> npt.NDArray[npt.Shape["nmbMoments"], npt.Complex128]:
+  """Returns true values for given moment indices; NaN flags moments that are not in the truth"""
+  if truth.indices == indices:
+    return truth._valsFlatIndex
+  flatIndexFor = truth.indices.indexMap.flatIndex_for
+  return np.array([truth._valsFlatIndex[flatIndexFor[qnIndex]] if qnIndex in flatIndexFor else np.nan for qnIndex in indices.QnIndices()], dtype = np.complex128)
+
+
+def compareMoments(
+  moments: MomentCalculator.MomentCalculatorsKinematicBinning,  # moments extracted from data
+  truth:   Union[MomentCalculator.MomentCalculatorsKinematicBinning, Sequence[MomentCalculator.MomentResult], MomentCalculator.MomentResult],  # true moments for each kinematic bin or for all bins
+) -> MomentComparison:
+  """Returns pulls of the physical moments in all kinematic bins with respect to the true values
+  In the real-valued layout, the imaginary parts of H_0 and H_1 and the real parts of H_2 are zero by construction and have zero uncertainty; their pulls are masked, so that they do not count as degrees of freedom.
+  """
+  indices = moments[0].HPhys.indices
+  if isinstance(truth, MomentCalculator.MomentResult):
+    truthResults: Sequence[MomentCalculator.MomentResult] = [truth] * len(moments)
+  elif isinstance(truth, MomentCalculator.MomentCalculatorsKinematicBinning):
+    truthResults = [momentsInBin.HPhys for momentsInBin in truth]
+  else:
+    truthResults = truth
+  assert len(truthResults) == len(moments), f"Number of kinematic bins of data ({len(moments)}) and truth ({len(truthResults)}) differ"
+  for momentsInBin in moments:
+    assert momentsInBin.HPhys.indices == indices, f"Moment indices differ between kinematic bins: {momentsInBin.HPhys.indices} vs. {indices}"
+  dataVals   = np.stack([momentsInBin.HPhys._valsFlatIndex for momentsInBin in moments])
+  dataUncert = np.sqrt(np.stack([np.stack((np.diag(momentsInBin.HPhys._covReReFlatIndex), np.diag(momentsInBin.HPhys._covImImFlatIndex))) for momentsInBin in moments]))
+  truthVals  = np.stack([_truthVals(truthResult, indices) for truthResult in truthResults])
+  maskH000   = np.array([qnIndex == MomentCalculator.QnMomentIndex(momentIndex = 0, L = 0, M = 0) for qnIndex in indices.QnIndices()])
+  maskParts  = np.stack((indices.imagPartFlags, ~indices.imagPartFlags)) if moments[0].realValued else None  # order of MOMENT_PARTS
+  return MomentComparison(indices, [momentsInBin.binCenters for momentsInBin in moments], pulls(dataVals, dataUncert, truthVals, maskH000, maskParts))
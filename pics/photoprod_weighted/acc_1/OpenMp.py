@@ -1,10 +1,21 @@
-"""Module that provides helper function to use OpenMp in ACLiC compiled code"""
+"""Module that provides helper functions to control the number of threads used by OpenMP, the BLAS library, and ROOT and to use OpenMp in ACLiC compiled code"""
 
 # set number of OpenMP threads
-# make sure this is executed before loading NumPy and user code
-# !NOTE! a more elaborate way to control OpenMP threads is provided by the `threadpoolctl` package
+# setting OMP_NUM_THREADS via setNmbOpenMpThreads() has an effect only if this is executed before the OpenMP runtime is initialized, i.e. before loading NumPy and user code
+# threadBudget() sets the number of threads at runtime and also limits the BLAS thread pools via the optional `threadpoolctl` package and ROOT's implicit multi-threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 import functools
 import os
+import sys
+from typing import (
+  Dict,
+  Generator,
+  List,
+  Optional,
+  Tuple,
+  Union,
+)
 OMP_NUM_THREADS_save = None
 
 
@@ -12,27 +23,139 @@ OMP_NUM_THREADS_save = None
 print = functools.partial(print, flush = True)
 
 
-#TODO turn into context manager
 def setNmbOpenMpThreads(nmbThreads: int) -> None:
   """Sets value of OMP_NUM_THREADS environment variable; current value is saved and can be restored by calling restoreNmbOpenMpThreads()"""
-  if "OMP_NUM_THREADS" in os.environ:
-    OMP_NUM_THREADS_save = os.environ["OMP_NUM_THREADS"]
+  global OMP_NUM_THREADS_save
+  OMP_NUM_THREADS_save = os.environ.get("OMP_NUM_THREADS")
   os.environ["OMP_NUM_THREADS"] = str(nmbThreads)
 
 
 def restoreNmbOpenMpThreads() -> None:
   """Restores OMP_NUM_THREADS environment variable to state when setNmbOpenMpThreads() was called, i.e. either value is restored or variable is unset"""
-  if OMP_NUM_THREADS_save:
+  if OMP_NUM_THREADS_save is not None:
     os.environ["OMP_NUM_THREADS"] = OMP_NUM_THREADS_save
   else:
-    del os.environ["OMP_NUM_THREADS"]
+    os.environ.pop("OMP_NUM_THREADS", None)
 
 
-import ROOT
+@dataclass
+class ThreadSettings:
+  """Effective numbers of threads of the thread pools that are used in the calculations and OpenMP schedule of the kernels"""
+  nmbOpenMpThreads:  int                                                        # number of OpenMP threads used by the kernel library
+  OMP_NUM_THREADS:   Optional[str]                                              # value of environment variable, which is inherited by child processes
+  nmbBlasThreads:    Dict[str, int]            = field(default_factory = dict)  # number of threads for each BLAS library loaded by NumPy; empty if `threadpoolctl` is not available
+  nmbRootImtThreads: Optional[int]             = None                           # number of threads used by ROOT's implicit multi-threading; 0 if disabled; None if ROOT is not loaded
+  openMpSchedule:    Optional[Tuple[str, int]] = None                           # OpenMP schedule kind and chunk size of the batch kernels; None if unknown
+
+  def __str__(self) -> str:
+    blasThreads = ", ".join(f"{library} = {nmbThreads}" for library, nmbThreads in self.nmbBlasThreads.items()) if self.nmbBlasThreads else "unknown (threadpoolctl not available)"
+    rootImtThreads = "ROOT not loaded" if self.nmbRootImtThreads is None else ("disabled" if self.nmbRootImtThreads == 0 else str(self.nmbRootImtThreads))
+    schedule = f", schedule = {self.openMpSchedule[0]}, chunk size = {self.openMpSchedule[1] or 'default'}" if self.openMpSchedule is not None else ""
+    return (f"OpenMP threads = {self.nmbOpenMpThreads} (OMP_NUM_THREADS = {self.OMP_NUM_THREADS}){schedule}; "
+            f"BLAS threads: {blasThreads}; ROOT IMT threads: {rootImtThreads}")
+
+
+def _blasThreadpoolInfo() -> List[Dict]:
+  """Returns information on BLAS thread pools if `threadpoolctl` is available"""
+  try:
+    import threadpoolctl
+  except ImportError:
+    return []
+  return [pool for pool in threadpoolctl.threadpool_info() if pool["user_api"] == "blas"]
+
+
+def _limitBlasThreads(limits: Union[int, Dict[str, int]]) -> None:
+  """Limits BLAS thread pools to given number of threads; if a dict is given, the limit is set for each BLAS library; no-op if `threadpoolctl` is not available"""
+  try:
+    import threadpoolctl
+  except ImportError:
+    return
+  threadpoolctl.threadpool_limits(limits = limits, user_api = "blas" if isinstance(limits, int) else None)
+
+
+def _nmbRootImtThreads() -> Optional[int]:
+  """Returns number of threads used by ROOT's implicit multi-threading, 0 if it is disabled, or None if ROOT has not been imported"""
+  if "ROOT" not in sys.modules:
+    return None
+  ROOT = sys.modules["ROOT"]
+  return ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() else 0
+
+
+def _setNmbRootImtThreads(nmbThreads: int) -> None:
+  """Sets number of threads used by ROOT's implicit multi-threading; nmbThreads = 0 disables it; the thread pool has to be recreated to change its size"""
+  ROOT = sys.modules["ROOT"]
+  if ROOT.IsImplicitMTEnabled():
+    if ROOT.GetThreadPoolSize() == nmbThreads:
+      return
+    ROOT.DisableImplicitMT()
+  if nmbThreads > 0:
+    ROOT.EnableImplicitMT(nmbThreads)
+
+
+def effectiveThreadSettings() -> ThreadSettings:
+  """Returns the numbers of threads that are currently in effect"""
+  import KernelLibrary
+  return ThreadSettings(
+    nmbOpenMpThreads  = KernelLibrary.kernels().getNmbOpenMpThreads(),
+    OMP_NUM_THREADS   = os.environ.get("OMP_NUM_THREADS"),
+    nmbBlasThreads    = {pool["prefix"]: pool["num_threads"] for pool in _blasThreadpoolInfo()},
+    nmbRootImtThreads = _nmbRootImtThreads(),
+    openMpSchedule    = KernelLibrary.kernels().getOpenMpSchedule(),
+  )
+
+
+def setThreadBudget(
+  nmbThreads:     int,                   # maximum number of threads used by OpenMP and ROOT
+  nmbBlasThreads: Optional[int] = None,  # maximum number of threads used by BLAS; if None, nmbThreads is used
+  verbose:        bool = True,           # if set, the effective settings are printed
+) -> ThreadSettings:
+  """Limits the number of threads of OpenMP, of the BLAS libraries, and, if enabled, of ROOT's implicit multi-threading to the given budget, so that the thread pools do not oversubscribe the cores; returns the previous settings, which can be restored by calling restoreThreadSettings()"""
+  import KernelLibrary
+  previous = effectiveThreadSettings()
+  # OpenMP threads are set at runtime via the kernel library; OMP_NUM_THREADS is set for child processes
+  KernelLibrary.kernels().setNmbOpenMpThreads(nmbThreads)
+  os.environ["OMP_NUM_THREADS"] = str(nmbThreads)
+  _limitBlasThreads(nmbBlasThreads if nmbBlasThreads is not None else nmbThreads)
+  if previous.nmbRootImtThreads:  # ROOT is loaded and implicit multi-threading is enabled
+    _setNmbRootImtThreads(nmbThreads)
+  if verbose:
+    print(f"Thread budget: {effectiveThreadSettings()}")
+  return previous
+
+
+def restoreThreadSettings(settings: ThreadSettings) -> None:
+  """Restores given settings that were returned by setThreadBudget()"""
+  import KernelLibrary
+  KernelLibrary.kernels().setNmbOpenMpThreads(settings.nmbOpenMpThreads)
+  if settings.OMP_NUM_THREADS is not None:
+    os.environ["OMP_NUM_THREADS"] = settings.OMP_NUM_THREADS
+  else:
+    os.environ.pop("OMP_NUM_THREADS", None)
+  if settings.nmbBlasThreads:
+    _limitBlasThreads(settings.nmbBlasThreads)
+  if settings.nmbRootImtThreads is not None:
+    _setNmbRootImtThreads(settings.nmbRootImtThreads)
+  if settings.openMpSchedule is not None:
+    KernelLibrary.kernels().setOpenMpSchedule(*settings.openMpSchedule)
+
+
+@contextmanager
+def threadBudget(
+  nmbThreads:     int,                   # maximum number of threads used by OpenMP and ROOT
+  nmbBlasThreads: Optional[int] = None,  # maximum number of threads used by BLAS; if None, nmbThreads is used
+  verbose:        bool = True,           # if set, the effective settings are printed
+) -> Generator[ThreadSettings, None, None]:
+  """Context manager that applies setThreadBudget() and restores the previous settings on exit; yields the effective settings"""
+  previous = setThreadBudget(nmbThreads, nmbBlasThreads, verbose)
+  try:
+    yield effectiveThreadSettings()
+  finally:
+    restoreThreadSettings(previous)
 
 
 def printRootACLiCSettings() -> None:
   """Prints ROOT settings that affect ACLiC compilation"""
+  import ROOT
   print(f" GetBuildArch()               = {ROOT.gSystem.GetBuildArch()}")
   print(f" GetBuildCompiler()           = {ROOT.gSystem.GetBuildCompiler()}")
   print(f" GetBuildCompilerVersion()    = {ROOT.gSystem.GetBuildCompilerVersion()}")
@@ -51,6 +174,7 @@ def printRootACLiCSettings() -> None:
 
 def enableRootACLiCOpenMp() -> None:
   """Enables OpenMP support for ROOT macros compiled via ACLiC"""
+  import ROOT
   arch = ROOT.gSystem.GetBuildArch()
   if "macos" in arch.lower():
     # !Note! MacOS (Apple does not ship libomp; needs to be installed via MacPorts or Homebrew see testOpenMp.c)
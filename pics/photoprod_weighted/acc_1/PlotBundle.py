@@ -0,0 +1,148 @@
+"""Module that collects the plot files of a run into a few multi-page PDF documents or into a single ZIP archive with an index, so that runs do not create thousands of small files on shared filesystems"""
+
+from dataclasses import dataclass
+import functools
+import json
+import os
+import tempfile
+from typing import (
+  Any,
+  Dict,
+  List,
+  Optional,
+  Set,
+)
+import zipfile
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+# environment variable that selects the output mode of the plots; see OUTPUT_MODES
+OUTPUT_MODE_ENV_VAR = "MOMENTS_PLOT_OUTPUT"
+OUTPUT_MODES = (
+  "files",  # one file per plot
+  "pdf",    # one multi-page PDF document per group of plots; requires the optional `pypdf` package
+  "zip",    # all plot files in one ZIP archive
+)
+
+
+def defaultOutputMode() -> str:
+  """Returns output mode selected by the environment; default is one file per plot"""
+  mode = os.environ.get(OUTPUT_MODE_ENV_VAR, "files")
+  if mode not in OUTPUT_MODES:
+    raise ValueError(f"Unknown plot output mode '{mode}' in ${OUTPUT_MODE_ENV_VAR}; must be one of {OUTPUT_MODES}")
+  return mode
+
+
+def _replaceAtomically(
+  fileName: str,
+  suffix:   str,
+  write:    Any,  # function that writes the file content to the given file name
+) -> None:
+  """Writes file via temporary file that is renamed, so that readers never see a partially written file"""
+  fd, tmpFileName = tempfile.mkstemp(suffix = suffix, dir = os.path.dirname(os.path.abspath(fileName)))
+  os.close(fd)
+  try:
+    write(tmpFileName)
+    os.replace(tmpFileName, fileName)
+  finally:
+    if os.path.exists(tmpFileName):
+      os.remove(tmpFileName)
+
+
+@dataclass
+class PlotBundle:
+  """Multi-page PDF documents or ZIP archive with plot files and a JSON index that maps each original plot file name to its location in the bundle"""
+  mode:      str            # 'pdf' or 'zip'
+  bundleDir: str            # directory the bundle and its index are written to
+  name:      str = "plots"  # name prefix of the bundle files
+
+  def __post_init__(self) -> None:
+    assert self.mode in ("pdf", "zip"), f"Plot bundle requires output mode 'pdf' or 'zip'; got '{self.mode}'"
+    if self.mode == "pdf":
+      try:
+        import pypdf  # noqa: F401
+      except ImportError:
+        print("Package `pypdf` is not available; writing plots into ZIP archive instead of multi-page PDF documents")
+        self.mode = "zip"
+
+  @property
+  def indexFileName(self) -> str:
+    """Path of JSON index of the bundle"""
+    return os.path.join(self.bundleDir, f"{self.name}.index.json")
+
+  def documentFileName(self, group: str) -> str:
+    """Path of multi-page PDF document or ZIP archive for the given group of plots; ZIP archives contain all groups"""
+    return os.path.join(self.bundleDir, f"{self.name}.zip" if self.mode == "zip" else f"{self.name}_{group}.pdf")
+
+  def index(self) -> Dict[str, Dict[str, Any]]:
+    """Returns for each plot file name in the bundle the document it is stored in and, for PDF documents, its first page and number of pages"""
+    try:
+      with open(self.indexFileName) as indexFile:
+        index = json.load(indexFile)
+    except (OSError, ValueError):
+      return {}
+    return index["entries"] if index.get("mode") == self.mode else {}
+
+  def bundledFileNames(self) -> Set[str]:
+    """Returns names of plot files that are stored in the bundle"""
+    index = self.index()
+    existingDocuments = {document for document in {entry["document"] for entry in index.values()} if os.path.exists(os.path.join(self.bundleDir, document))}
+    return {fileName for fileName, entry in index.items() if entry["document"] in existingDocuments}
+
+  def write(
+    self,
+    groups:        Dict[str, List[str]],        # plot file names for each group; defines the order of the plots in the bundle
+    renderedDir:   str,                         # directory with newly rendered plot files; plot file names are relative to it
+    keptFileNames: Optional[List[str]] = None,  # plot file names that are copied from the existing bundle instead of from renderedDir
+  ) -> None:
+    """Writes bundle and index; plots in keptFileNames are taken from the existing bundle, all other plots from renderedDir"""
+    os.makedirs(self.bundleDir, exist_ok = True)
+    kept     = set(keptFileNames or [])
+    oldIndex = self.index()
+    entries: Dict[str, Dict[str, Any]] = {}
+    if self.mode == "zip":
+      zipFileName = self.documentFileName("")
+      def writeZip(tmpFileName: str) -> None:
+        oldZip = zipfile.ZipFile(zipFileName) if kept and os.path.exists(zipFileName) else None
+        # PDFs are already compressed
+        with zipfile.ZipFile(tmpFileName, "w", compression = zipfile.ZIP_STORED) as newZip:
+          for group, fileNames in groups.items():
+            for fileName in fileNames:
+              if fileName in kept and oldZip is not None:
+                newZip.writestr(fileName, oldZip.read(fileName))
+              else:
+                newZip.write(os.path.join(renderedDir, fileName), arcname = fileName)
+              entries[fileName] = {"document" : os.path.basename(zipFileName), "group" : group}
+        if oldZip is not None:
+          oldZip.close()
+      _replaceAtomically(zipFileName, ".zip", writeZip)
+    else:
+      import pypdf
+      for group, fileNames in groups.items():
+        documentFileName = self.documentFileName(group)
+        def writePdf(tmpFileName: str) -> None:
+          oldReaders: Dict[str, pypdf.PdfReader] = {}
+          writer = pypdf.PdfWriter()
+          for fileName in fileNames:
+            firstPage = len(writer.pages)
+            if fileName in kept:
+              oldEntry = oldIndex[fileName]
+              if oldEntry["document"] not in oldReaders:
+                oldReaders[oldEntry["document"]] = pypdf.PdfReader(os.path.join(self.bundleDir, oldEntry["document"]))
+              oldPages = oldReaders[oldEntry["document"]].pages
+              for page in range(oldEntry["page"], oldEntry["page"] + oldEntry["nmbPages"]):
+                writer.add_page(oldPages[page])
+            else:
+              writer.append(os.path.join(renderedDir, fileName))
+            entries[fileName] = {"document" : os.path.basename(documentFileName), "group" : group, "page" : firstPage, "nmbPages" : len(writer.pages) - firstPage}
+          with open(tmpFileName, "wb") as documentFile:
+            writer.write(documentFile)
+        _replaceAtomically(documentFileName, ".pdf", writePdf)
+    def writeIndex(tmpFileName: str) -> None:
+      with open(tmpFileName, "w") as indexFile:
+        json.dump({"mode" : self.mode, "entries" : entries}, indexFile, indent = 2)
+    _replaceAtomically(self.indexFileName, ".json", writeIndex)
+    print(f"Wrote {len(entries)} plots into {self.mode.upper()} bundle '{os.path.join(self.bundleDir, self.name)}' with index '{self.indexFileName}'")
@@ -1,12 +1,11 @@
 """Module that provides a collection of functions for plotting"""
 
+from __future__ import annotations
+
 from dataclasses import dataclass, astuple
 import functools
-import matplotlib.pyplot as plt
 import numpy as np
-import nptyping as npt
 import os
-from scipy import stats
 from typing import (
   Dict,
   Iterator,
@@ -14,11 +13,17 @@ from typing import (
   Optional,
   Sequence,
   Tuple,
+  TYPE_CHECKING,
 )
 
-import ROOT
-
 import MomentCalculator
+import MomentComparison
+
+# ROOT, matplotlib, and scipy are imported on first use, so that importing this module is fast
+if TYPE_CHECKING:
+  import nptyping as npt
+  import ROOT
+  import RenderQueue
 
 
 # always flush print() to reduce garbling of log files due to buffering
@@ -76,6 +81,11 @@ class HistAxisBinning:
     for i in range(len(self)):
       yield self[i]
 
+  @property
+  def binCenters(self) -> npt.NDArray[npt.Shape["nmbBins"], npt.Float64]:
+    """Returns array with all bin centers"""
+    return self.minVal + (np.arange(self.nmbBins) + 0.5) * self.binWidth
+
   # accessor that guarantees existence of optional field
   @property
   def var(self) -> MomentCalculator.KinematicBinningVariable:
@@ -110,6 +120,7 @@ class HistAxisBinning:
 
 def setupPlotStyle(rootlogonPath: str = "./rootlogon.C") -> None:
   """Defines ROOT plotting style"""
+  import ROOT
   ROOT.gROOT.LoadMacro(rootlogonPath)
   ROOT.gROOT.ForceStyle()
   ROOT.gStyle.SetCanvasDefW(600)
@@ -129,18 +140,22 @@ def setupPlotStyle(rootlogonPath: str = "./rootlogon.C") -> None:
 def plotComplexMatrix(
   matrix:            npt.NDArray[npt.Shape["*, *"], npt.Complex128],  # matrix to plot
   pdfFileNamePrefix: str,  # name prefix for output files
-) -> None:
-  """Draws real and imaginary parts of given 2D array"""
+) -> List[str]:
+  """Draws real and imaginary parts of given 2D array; returns names of written files"""
+  import matplotlib.pyplot as plt
   dataToPlot = {
     "real" : np.real(matrix),      # real part
     "imag" : np.imag(matrix),      # imaginary part
     "abs"  : np.absolute(matrix),  # absolute value
     "arg"  : np.angle(matrix),     # phase
   }
+  fileNames: List[str] = []
   for plotLabel, data in dataToPlot.items():
     plt.figure().colorbar(plt.matshow(data))
-    plt.savefig(f"{pdfFileNamePrefix}_{plotLabel}.pdf", transparent = True)
+    fileNames.append(f"{pdfFileNamePrefix}_{plotLabel}.pdf")
+    plt.savefig(fileNames[-1], transparent = True)
     plt.close()
+  return fileNames
 
 
 def drawTF3(
@@ -152,6 +167,8 @@ def drawTF3(
   maxVal:      Optional[float] = None,  # maximum plot range
 ) -> None:
   """Draws given TF3 into histogram"""
+  import ROOT
+  import RootUtilities
   if nmbPoints:
     fcn.SetNpx(nmbPoints)  # used in numeric integration performed by GetRandom()
     fcn.SetNpy(nmbPoints)
@@ -161,16 +178,14 @@ def drawTF3(
   # draw function "by hand" instead
   histName = os.path.splitext(os.path.basename(pdfFileName))[0]
   fistFcn = ROOT.TH3F(histName, histTitle, *binnings[0].astuple, *binnings[1].astuple, *binnings[2].astuple)
-  xAxis = fistFcn.GetXaxis()
-  yAxis = fistFcn.GetYaxis()
-  zAxis = fistFcn.GetZaxis()
-  for xBin in range(1, binnings[0].nmbBins + 1):
-    for yBin in range(1, binnings[1].nmbBins + 1):
-      for zBin in range(1, binnings[2].nmbBins + 1):
-        x = xAxis.GetBinCenter(xBin)
-        y = yAxis.GetBinCenter(yBin)
-        z = zAxis.GetBinCenter(zBin)
-        fistFcn.SetBinContent(xBin, yBin, zBin, fcn.Eval(x, y, z))
+  # evaluate function at all bin centers in one compiled call and write values into histogram buffer in bulk
+  # ROOT stores bins incl. under- and overflow bins in the order (z, y, x) with x running fastest
+  zCenters, yCenters, xCenters = np.meshgrid(binnings[2].binCenters, binnings[1].binCenters, binnings[0].binCenters, indexing = "ij")
+  RootUtilities.loadKernels()
+  fcnVals = np.asarray(ROOT.evalTF3(fcn, xCenters.ravel(), yCenters.ravel(), zCenters.ravel()))
+  content = np.zeros((binnings[2].nmbBins + 2, binnings[1].nmbBins + 2, binnings[0].nmbBins + 2), dtype = np.float64)
+  content[1:-1, 1:-1, 1:-1] = fcnVals.reshape(xCenters.shape)
+  fistFcn.SetContent(content.ravel())
   print(f"Drawing histogram '{histName}' for function '{fcn.GetName()}': minimum value = {fistFcn.GetMinimum()}, maximum value = {fistFcn.GetMaximum()}")
   fistFcn.SetMinimum(0)
   if maxVal:
@@ -187,8 +202,10 @@ def plotMoments(
   binning:           Optional[HistAxisBinning] = None,  # if not None data are plotted as function of binning variable
   momentLabel:       str = "H",  # label used in output file name
   pdfFileNamePrefix: str = "h",  # name prefix for output files
-) -> None:
-  """Plots moments extracted from data along categorical axis and overlays the corresponding true values if given"""
+) -> List[str]:
+  """Plots moments extracted from data along categorical axis and overlays the corresponding true values if given; returns names of written files"""
+  import ROOT
+  fileNames: List[str] = []
   histBinning = HistAxisBinning(len(HVals), 0, len(HVals)) if binning is None else binning
   xAxisTitle = "" if binning is None else binning.axisTitle
   trueValues = any((H.truth is not None for H in HVals))
@@ -238,7 +255,8 @@ def plotMoments(
     histStack.GetHistogram().SetLineStyle(ROOT.kDashed)
     # hStack.GetHistogram().SetLineWidth(0)  # remove zero line; see https://root-forum.cern.ch/t/continuing-the-discussion-from-an-unwanted-horizontal-line-is-drawn-at-y-0/50877/1
     canv.BuildLegend(0.7, 0.75, 0.99, 0.99)
-    canv.SaveAs(f"{histStack.GetName()}.pdf")
+    fileNames.append(f"{histStack.GetName()}.pdf")
+    canv.SaveAs(fileNames[-1])
 
     # (ii) plot residuals
     if trueValues:
@@ -264,9 +282,8 @@ def plotMoments(
       if residualsMasked.count() == 0:
         print(f"All residuals masked; skipping '{histResidualName}.pdf'.")
       else:
-        chi2     = np.sum(residualsMasked**2)
-        ndf      = residualsMasked.count()
-        chi2Prob = stats.distributions.chi2.sf(chi2, ndf)
+        chi2Result = MomentComparison.chi2Summary(residualsMasked)  # same masking rules as in MomentComparison.compareMoments()
+        chi2, ndf, chi2Prob = float(chi2Result.chi2), int(chi2Result.ndf), float(chi2Result.pValue)
         # fill histogram with residuals
         for (index,), residual in np.ma.ndenumerate(residualsMasked):  # set bin content only for unmasked residuals
           binIndex = index + 1
@@ -296,7 +313,9 @@ def plotMoments(
         label.SetNDC()
         label.SetTextAlign(ROOT.kHAlignLeft + ROOT.kVAlignBottom)
         label.DrawLatex(0.12, 0.9075, f"#it{{#chi}}^{{2}}/n.d.f. = {chi2:.2f}/{ndf}, prob = {chi2Prob * 100:.0f}%")
-        canv.SaveAs(f"{histResidualName}.pdf")
+        fileNames.append(f"{histResidualName}.pdf")
+        canv.SaveAs(fileNames[-1])
+  return fileNames
 
 
 def plotMomentsInBin(
@@ -304,13 +323,17 @@ def plotMomentsInBin(
   HTrue:             Optional[MomentCalculator.MomentResult] = None,  # true moment values
   momentLabel:       str = "H",                      # label used in output file name
   pdfFileNamePrefix: str = "h",                      # name prefix for output files
+  renderQueue:       Optional[RenderQueue.RenderQueue] = None,  # if given, plots are added to the queue instead of being rendered immediately
 ) -> None:
   """Plots H_0, H_1, and H_2 extracted from data along categorical axis and overlays the corresponding true values if given"""
   assert not HTrue or HData.indices == HTrue.indices, f"Moment sets don't match. Data moments: {HData.indices} vs. true moments: {HTrue.indices}."
   # generate separate plots for each moment index
   for momentIndex in range(3):
     HVals = tuple(MomentValueAndTruth(*HData[qnIndex], HTrue[qnIndex].val if HTrue else None) for qnIndex in HData.indices.QnIndices() if qnIndex.momentIndex == momentIndex)  # type: ignore
-    plotMoments(HVals, momentLabel = f"{momentLabel}{momentIndex}", pdfFileNamePrefix = pdfFileNamePrefix)
+    if renderQueue is not None:
+      renderQueue.add("plotMoments", HVals = HVals, momentLabel = f"{momentLabel}{momentIndex}", pdfFileNamePrefix = pdfFileNamePrefix)
+    else:
+      plotMoments(HVals, momentLabel = f"{momentLabel}{momentIndex}", pdfFileNamePrefix = pdfFileNamePrefix)
 
 
 def plotMoments1D(
@@ -320,6 +343,7 @@ def plotMoments1D(
   momentsTruth:      Optional[MomentCalculator.MomentCalculatorsKinematicBinning] = None,  # true moment values
   momentLabel:       str = "H",                                 # label used in output file name
   pdfFileNamePrefix: str = "h",                                 # name prefix for output files
+  renderQueue:       Optional[RenderQueue.RenderQueue] = None,  # if given, the plot is added to the queue instead of being rendered immediately
 ) -> None:
   """Plots moment H_i(L, M) extracted from data as function of kinematical variable and overlays the corresponding true values if given"""
   # filter out specific moment
@@ -328,4 +352,7 @@ def plotMoments1D(
       truth = None if momentsTruth is None else momentsTruth[binIndex].HPhys[qnIndex].val,
       _binCenters = HData.binCenters,
     ) for binIndex, HData in enumerate(moments))
-  plotMoments(HVals, binning, momentLabel = f"{momentLabel}{qnIndex.momentIndex}_{qnIndex.L}_{qnIndex.M}", pdfFileNamePrefix = f"{pdfFileNamePrefix}{binning.var.name}_")
+  if renderQueue is not None:
+    renderQueue.add("plotMoments", HVals = HVals, binning = binning, momentLabel = f"{momentLabel}{qnIndex.momentIndex}_{qnIndex.L}_{qnIndex.M}", pdfFileNamePrefix = f"{pdfFileNamePrefix}{binning.var.name}_")
+  else:
+    plotMoments(HVals, binning, momentLabel = f"{momentLabel}{qnIndex.momentIndex}_{qnIndex.L}_{qnIndex.M}", pdfFileNamePrefix = f"{pdfFileNamePrefix}{binning.var.name}_")
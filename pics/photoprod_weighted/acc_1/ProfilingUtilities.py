@@ -0,0 +1,174 @@
+"""Module that provides classes to record wall time, CPU time, event throughput, and memory consumption of the stages of the moment calculation"""
+
+from contextlib import contextmanager, nullcontext
+import csv
+from dataclasses import asdict, dataclass, field
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import (
+  Any,
+  ContextManager,
+  Dict,
+  Generator,
+  List,
+  Optional,
+)
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+def currentRssMb() -> Optional[float]:
+  """Returns current resident set size of this process in MB or None if it cannot be determined"""
+  try:
+    with open("/proc/self/statm") as statmFile:
+      return int(statmFile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+  except (OSError, ValueError, IndexError):  # not available outside Linux
+    return None
+
+
+def peakRssMb() -> Optional[float]:
+  """Returns peak resident set size of this process in MB or None if it cannot be determined; on Linux, this is the high-water mark since the last call of resetPeakRss(), otherwise since the start of the process"""
+  try:
+    with open("/proc/self/status") as statusFile:
+      for line in statusFile:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) / 1024  # kB
+  except (OSError, ValueError, IndexError):
+    pass
+  try:
+    import resource
+  except ImportError:  # not available on Windows
+    return None
+  maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return maxRss / 1024**2 if sys.platform == "darwin" else maxRss / 1024  # bytes on MacOS, kB on Linux
+
+
+def resetPeakRss() -> bool:
+  """Resets the high-water mark of the resident set size to the current value; returns whether this is supported, which requires Linux"""
+  try:
+    with open("/proc/self/clear_refs", "w") as clearRefsFile:
+      clearRefsFile.write("5")
+    return True
+  except OSError:
+    return False
+
+
+@dataclass
+class StageRecord:
+  """Stores wall time, CPU time, number of processed events, and memory consumption of one execution of a stage"""
+  stage:      str                     # name of stage, e.g. 'dataIngest', 'basisEvaluation', 'integralAccumulation', 'inversion', or 'covariance'
+  binLabel:   str             = ""    # label of kinematic bin
+  nmbEvents:  Optional[int]   = None  # number of processed events; None if not applicable
+  wallTime:   float           = 0.0   # [s]
+  cpuTime:    float           = 0.0   # [s] summed over all threads of the process
+  rssStartMb: Optional[float] = None  # [MB] resident set size of the process at the start of the stage
+  rssEndMb:   Optional[float] = None  # [MB] resident set size of the process at the end of the stage
+  peakRssMb:  Optional[float] = None  # [MB] peak resident set size of the process during the stage; None if the high-water mark cannot be reset, i.e. outside Linux
+
+  @property
+  def eventsPerSec(self) -> Optional[float]:
+    """Returns event throughput or None if not applicable"""
+    return self.nmbEvents / self.wallTime if self.nmbEvents is not None and self.wallTime > 0 else None
+
+  def asDict(self) -> Dict[str, Any]:
+    """Returns record as dict including the event throughput"""
+    return {**asdict(self), "eventsPerSec" : self.eventsPerSec}
+
+
+@dataclass
+class Profiler:
+  """Collects stage records; stages are timed by the stage() context manager
+  The peak memory of a stage is measured by resetting the high-water mark of the process at the start of the stage; the peaks of enclosing stages and of stages running concurrently in other threads are updated before each reset, so that they are not lost.
+  """
+  records:        List[StageRecord] = field(default_factory = list)
+  _activeRecords: List[StageRecord] = field(default_factory = list, init = False, repr = False)  # records of stages that are running
+  _lock:          threading.Lock    = field(default_factory = threading.Lock, init = False, repr = False)
+
+  def _updatePeaks(self) -> None:
+    """Updates peak memory of running stages with the current high-water mark; must be called with the lock held"""
+    peakRss = peakRssMb()
+    for record in self._activeRecords:
+      if record.peakRssMb is not None and peakRss is not None:
+        record.peakRssMb = max(record.peakRssMb, peakRss)
+
+  @contextmanager
+  def stage(
+    self,
+    stage:     str,                   # name of stage
+    binLabel:  str           = "",    # label of kinematic bin
+    nmbEvents: Optional[int] = None,  # number of processed events; can also be set via the yielded record
+  ) -> Generator[StageRecord, None, None]:
+    """Context manager that times the enclosed code and appends the record"""
+    record = StageRecord(stage, binLabel, nmbEvents, rssStartMb = currentRssMb())
+    with self._lock:
+      self._updatePeaks()
+      if resetPeakRss():
+        record.peakRssMb = peakRssMb()
+      self._activeRecords.append(record)
+    startWallTime = time.perf_counter()
+    startCpuTime  = time.process_time()
+    try:
+      yield record
+    finally:
+      record.wallTime = time.perf_counter() - startWallTime
+      record.cpuTime  = time.process_time() - startCpuTime
+      record.rssEndMb = currentRssMb()
+      with self._lock:
+        self._updatePeaks()
+        self._activeRecords.remove(record)
+        self.records.append(record)
+
+  def toJson(self, fileName: str) -> None:
+    """Writes records to JSON file"""
+    with open(fileName, "w") as jsonFile:
+      json.dump([record.asDict() for record in self.records], jsonFile, indent = 2)
+
+  def toCsv(self, fileName: str) -> None:
+    """Writes records to CSV file"""
+    with open(fileName, "w", newline = "") as csvFile:
+      writer = csv.DictWriter(csvFile, fieldnames = list(StageRecord("").asDict().keys()))
+      writer.writeheader()
+      for record in self.records:
+        writer.writerow(record.asDict())
+
+  def summaryTable(
+    self,
+    byBin: bool = False,  # if set, records are aggregated for each pair of stage and kinematic bin, otherwise only for each stage
+  ) -> str:
+    """Returns table with total wall and CPU time, event throughput, maximum peak memory, and maximum memory growth aggregated over records with the same stage (and bin)"""
+    groups: Dict[tuple, List[StageRecord]] = {}
+    for record in self.records:
+      groups.setdefault((record.stage, record.binLabel) if byBin else (record.stage, ), []).append(record)
+    totalWallTime = sum(record.wallTime for record in self.records)
+    binWidth = max([len("bin")] + [len(record.binLabel) for record in self.records]) + 2 if byBin else 0
+    lines = [f"{'stage':<22}{'bin' if byBin else '':<{binWidth}}{'calls':>6} {'wall [s]':>10} {'CPU [s]':>10} {'CPU/wall':>9} {'wall [%]':>9} {'events/s':>12} {'peak RSS [MB]':>14} {'RSS growth [MB]':>16}"]
+    for key, records in groups.items():
+      wallTime  = sum(record.wallTime for record in records)
+      cpuTime   = sum(record.cpuTime  for record in records)
+      nmbEvents = [record.nmbEvents for record in records if record.nmbEvents is not None]
+      eventsPerSec = f"{sum(nmbEvents) / wallTime:12.4g}" if nmbEvents and wallTime > 0 else f"{'-':>12}"
+      peakRss = max((record.peakRssMb for record in records if record.peakRssMb is not None), default = None)
+      rssGrowth = max((record.rssEndMb - record.rssStartMb for record in records if record.rssStartMb is not None and record.rssEndMb is not None), default = None)
+      lines.append(f"{key[0]:<22}{key[1] if byBin else '':<{binWidth}}{len(records):>6} {wallTime:10.3f} {cpuTime:10.3f} "
+                   f"{cpuTime / wallTime if wallTime > 0 else 0:9.2f} {100 * wallTime / totalWallTime if totalWallTime > 0 else 0:9.1f} {eventsPerSec} "
+                   + (f"{peakRss:14.1f}" if peakRss is not None else f"{'-':>14}")
+                   + (f" {rssGrowth:16.1f}" if rssGrowth is not None else f" {'-':>16}"))
+    return "\n".join(lines)
+
+
+def profileStage(
+  profiler:  Optional[Profiler],      # if None, nothing is recorded
+  stage:     str,                     # name of stage
+  binLabel:  str           = "",      # label of kinematic bin
+  nmbEvents: Optional[int] = None,    # number of processed events
+) -> ContextManager[StageRecord]:
+  """Returns context manager that times the enclosed code if a profiler is given; otherwise the context manager does nothing"""
+  if profiler is None:
+    return nullcontext(StageRecord(stage, binLabel, nmbEvents))
+  return profiler.stage(stage, binLabel, nmbEvents)
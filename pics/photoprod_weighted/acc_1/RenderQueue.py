@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Module that decouples plotting from the calculation: plot requests are collected in a render queue, which is processed by a pool of worker processes, each with its own batch-mode ROOT
+Plots whose inputs did not change since they were last rendered are skipped; queues can be saved and rendered later, e.g. by running this module as a script.
+"""
+
+import argparse
+from concurrent.futures import (
+  as_completed,
+  ProcessPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from typing import (
+  Any,
+  Dict,
+  List,
+  Optional,
+  Tuple,
+)
+
+import PlotBundle
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+PLOTTING_SOURCE_FILE_NAMES = ("PlottingUtilities.py", "MomentCalculator.py", "MomentComparison.py", "rootlogon.C")  # changes in these files invalidate all rendered plots; MomentCalculator.py defines the classes of the plotted objects and MomentComparison.py calculates the chi^2/ndf and p-values shown in the plots
+
+
+@dataclass
+class RenderJob:
+  """Call of a plotting function in PlottingUtilities with keyword arguments; arguments must be picklable"""
+  fcnName: str                                             # name of plotting function, e.g. 'plotMoments'
+  kwargs:  Dict[str, Any] = field(default_factory = dict)  # arguments of plotting function
+
+  @property
+  def jobId(self) -> str:
+    """Returns identifier of the job that is built from the function name and the string arguments, which define the output file names"""
+    return f"{self.fcnName}(" + ", ".join(f"{key} = '{value}'" for key, value in self.kwargs.items() if isinstance(value, str)) + ")"
+
+  def inputHash(
+    self,
+    sourceHash: str = "",  # hash of plotting code
+  ) -> str:
+    """Returns hash of the function name, the arguments, and the plotting code"""
+    hasher = hashlib.sha256(sourceHash.encode())
+    hasher.update(pickle.dumps((self.fcnName, self.kwargs), protocol = 4))
+    return hasher.hexdigest()
+
+
+def _plottingSourceHash() -> str:
+  """Returns hash of the plotting code"""
+  hasher = hashlib.sha256()
+  sourceDir = os.path.dirname(os.path.abspath(__file__))
+  for fileName in PLOTTING_SOURCE_FILE_NAMES:
+    filePath = os.path.join(sourceDir, fileName)
+    if os.path.exists(filePath):
+      with open(filePath, "rb") as sourceFile:
+        hasher.update(sourceFile.read())
+  return hasher.hexdigest()
+
+
+def _initWorker(
+  renderDir:     str,  # directory the plots are written to; output file names are relative to it
+  rootlogonPath: str,  # absolute path of ROOT style macro
+) -> None:
+  """Sets up batch-mode ROOT and plot style in worker process"""
+  os.chdir(renderDir)
+  import ROOT
+  import PlottingUtilities
+  ROOT.gROOT.SetBatch(True)
+  PlottingUtilities.setupPlotStyle(rootlogonPath)
+
+
+def _renderJob(job: RenderJob) -> Tuple[str, List[str], float, Optional[str]]:
+  """Calls plotting function of given job; returns job ID, names of written files, wall time, and error message if the plotting function raised an exception"""
+  import PlottingUtilities
+  startTime = time.perf_counter()
+  try:
+    for key, value in job.kwargs.items():
+      if key.startswith("pdfFileName"):  # output directories do not exist yet if plots are rendered into a scratch directory
+        os.makedirs(os.path.dirname(value) or ".", exist_ok = True)
+    fileNames = getattr(PlottingUtilities, job.fcnName)(**job.kwargs)
+  except Exception as e:
+    return (job.jobId, [], time.perf_counter() - startTime, f"{type(e).__name__}: {e}")
+  return (job.jobId, list(fileNames or []), time.perf_counter() - startTime, None)
+
+
+@dataclass
+class RenderQueue:
+  """Collects plot requests and renders them in parallel; plots whose inputs did not change since the last rendering are skipped"""
+  cacheFileName: str             = ".renderCache.json"  # JSON file that stores input hash and output files of each rendered job; relative to workDir
+  rootlogonPath: str             = "./rootlogon.C"       # ROOT style macro loaded by the workers; relative to workDir
+  workDir:       str             = field(default_factory = os.getcwd)  # directory relative to which all file names are interpreted
+  outputMode:    str             = field(default_factory = PlotBundle.defaultOutputMode)  # 'files' writes one file per plot; 'pdf' and 'zip' collect the plots into a bundle
+  bundleDir:     str             = "."  # directory the bundle is written to if plots are bundled; relative to workDir
+  jobs:          List[RenderJob] = field(default_factory = list)
+
+  def __len__(self) -> int:
+    """Returns number of queued jobs"""
+    return len(self.jobs)
+
+  def add(
+    self,
+    fcnName: str,  # name of plotting function in PlottingUtilities
+    **kwargs: Any,  # arguments of plotting function
+  ) -> None:
+    """Adds call of plotting function to the queue"""
+    self.jobs.append(RenderJob(fcnName, kwargs))
+
+  def save(self, fileName: str) -> None:
+    """Writes queue to pickle file, so that the plots can be rendered later"""
+    with open(fileName, "wb") as queueFile:
+      pickle.dump(self, queueFile, protocol = 4)
+
+  @staticmethod
+  def load(fileName: str) -> "RenderQueue":
+    """Reads queue from pickle file"""
+    with open(fileName, "rb") as queueFile:
+      return pickle.load(queueFile)
+
+  def _loadCache(self) -> Dict[str, Dict[str, Any]]:
+    """Returns input hashes and output files of previously rendered jobs"""
+    try:
+      with open(os.path.join(self.workDir, self.cacheFileName)) as cacheFile:
+        return json.load(cacheFile)
+    except (OSError, ValueError):
+      return {}
+
+  def _saveCache(self, cache: Dict[str, Dict[str, Any]]) -> None:
+    """Writes input hashes and output files of rendered jobs"""
+    cacheFilePath = os.path.join(self.workDir, self.cacheFileName)
+    os.makedirs(os.path.dirname(cacheFilePath), exist_ok = True)
+    with open(f"{cacheFilePath}.tmp", "w") as cacheFile:
+      json.dump(cache, cacheFile, indent = 2)
+    os.replace(f"{cacheFilePath}.tmp", cacheFilePath)
+
+  def render(
+    self,
+    nmbWorkers: Optional[int] = None,   # number of worker processes; if None, the number of CPUs is used; 0 renders in this process
+    force:      bool          = False,  # if set, all plots are rendered regardless of whether their inputs changed
+  ) -> List[str]:
+    """Renders all queued plots that changed since the last rendering, clears the queue, and returns the names of all output files of the queued jobs
+    If plots are bundled, they are rendered into a scratch directory in TMPDIR, which is usually node-local, and then collected into the bundle, so that only a few files are written into the plot directory.
+    """
+    bundle = PlotBundle.PlotBundle(self.outputMode, os.path.join(self.workDir, self.bundleDir)) if self.outputMode != "files" else None
+    if bundle is None:
+      outputExists = lambda fileName: os.path.exists(os.path.join(self.workDir, fileName))
+    else:
+      bundledFileNames = bundle.bundledFileNames()
+      outputExists = lambda fileName: fileName in bundledFileNames
+    sourceHash = _plottingSourceHash()
+    cache      = self._loadCache()
+    jobsToRender: List[RenderJob] = []
+    inputHashes:  Dict[str, str]  = {}
+    for job in self.jobs:
+      inputHashes[job.jobId] = job.inputHash(sourceHash)
+      cached = cache.get(job.jobId)
+      if (not force and cached is not None and cached["inputHash"] == inputHashes[job.jobId]
+          and all(outputExists(fileName) for fileName in cached["fileNames"])):
+        continue
+      jobsToRender.append(job)
+    print(f"Rendering {len(jobsToRender)} of {len(self.jobs)} queued plot jobs; {len(self.jobs) - len(jobsToRender)} are unchanged")
+    nmbWorkers = min((os.cpu_count() or 1) if nmbWorkers is None else nmbWorkers, len(jobsToRender))
+    startTime = time.perf_counter()
+    errors: Dict[str, str] = {}
+    if jobsToRender:
+      renderDir = self.workDir if bundle is None else tempfile.mkdtemp(prefix = "renderQueue")
+      try:
+        rootlogonPath = os.path.join(self.workDir, self.rootlogonPath)
+        if nmbWorkers == 0:
+          cwd = os.getcwd()
+          os.chdir(renderDir)
+          try:
+            results = list(map(_renderJob, jobsToRender))
+          finally:
+            os.chdir(cwd)
+        else:
+          # spawn fresh processes, so that workers do not inherit the state of the ROOT instance of this process
+          # unlike multiprocessing.Pool, the executor does not hang if a worker dies, e.g. due to a segfault in ROOT, but fails the pending jobs
+          results = []
+          with ProcessPoolExecutor(nmbWorkers, mp_context = multiprocessing.get_context("spawn"),
+                                   initializer = _initWorker, initargs = (renderDir, rootlogonPath)) as executor:
+            futures = {executor.submit(_renderJob, job) : job for job in jobsToRender}
+            for future in as_completed(futures):
+              try:
+                results.append(future.result())
+              except BrokenProcessPool as e:
+                results.append((futures[future].jobId, [], 0.0, f"{type(e).__name__}: worker process terminated abruptly"))
+        renderedJobIds = set()
+        for jobId, fileNames, _, error in results:
+          if error is not None:
+            errors[jobId] = error
+            cache.pop(jobId, None)
+          else:
+            cache[jobId] = {"inputHash" : inputHashes[jobId], "fileNames" : fileNames}
+            renderedJobIds.add(jobId)
+        if bundle is not None:
+          # plots are grouped by plotting function; plots of unchanged jobs are copied from the existing bundle
+          groups: Dict[str, List[str]] = {}
+          keptFileNames: List[str] = []
+          for job in self.jobs:
+            if job.jobId in cache:
+              groups.setdefault(job.fcnName, []).extend(cache[job.jobId]["fileNames"])
+              if job.jobId not in renderedJobIds:
+                keptFileNames.extend(cache[job.jobId]["fileNames"])
+          bundle.write(groups, renderDir, keptFileNames)
+        self._saveCache(cache)
+      finally:
+        if bundle is not None:
+          shutil.rmtree(renderDir, ignore_errors = True)
+    print(f"Rendered {len(jobsToRender) - len(errors)} plot jobs using {max(nmbWorkers, 1)} process(es) in {time.perf_counter() - startTime:.1f} s")
+    fileNames = [fileName for job in self.jobs if job.jobId in cache for fileName in cache[job.jobId]["fileNames"]]
+    self.jobs = []
+    if errors:
+      raise RuntimeError(f"{len(errors)} plot job(s) failed:\n" + "\n".join(f"{jobId}: {error}" for jobId, error in errors.items()))
+    return fileNames
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("queueFileName", help = "pickle file with saved render queue")
+  parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: number of CPUs)")
+  parser.add_argument("--force",   action = "store_true", help = "render all plots, also unchanged ones")
+  parser.add_argument("--output",  choices = PlotBundle.OUTPUT_MODES, default = None, help = "output mode (default: mode the queue was created with)")
+  args = parser.parse_args()
+
+  renderQueue = RenderQueue.load(args.queueFileName)
+  if args.output is not None:
+    renderQueue.outputMode = args.output
+  renderQueue.render(args.workers, args.force)
@@ -1,22 +1,26 @@
 """Module that provides functions for using ROOT code"""
 
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 import functools
-from typing import Any
+from typing import (
+  Any,
+  Dict,
+  Generator,
+)
 
 import ROOT
 
-import OpenMp
+import KernelLibrary
 
 
 # always flush print() to reduce garbling of log files due to buffering
 print = functools.partial(print, flush = True)
 
 
-# C++ implementation of (complex conjugated) Wigner D function and spherical harmonics
-# also provides complexT typedef for std::complex<double>
-OpenMp.enableRootACLiCOpenMp()
-# OpenMp.printRootACLiCSettings()
-ROOT.gROOT.LoadMacro("./wignerD.C++")
+def loadKernels() -> None:
+  """Makes C++ kernels in `wignerD.C`, e.g. (complex conjugated) Wigner D function, spherical harmonics, and complexT typedef for std::complex<double>, available in ROOT; the kernels are loaded on first call from the prebuilt shared library"""
+  KernelLibrary.loadKernelsInRoot()
 
 
 # see https://root-forum.cern.ch/t/tf1-eval-as-a-function-in-rdataframe/50699/3
@@ -30,3 +34,68 @@ namespace PyVars
   auto& {key} = *reinterpret_cast<{type(value).__cpp_name__}*>({ROOT.addressof(value)});
 }}
 """)
+
+
+@contextmanager
+def implicitMtDisabled() -> Generator[None, None, None]:
+  """Context manager that temporarily disables implicit multi-threading of ROOT, e.g. to write trees with reproducible entry order"""
+  nmbThreads = ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() else 0
+  if nmbThreads > 0:
+    ROOT.DisableImplicitMT()
+  try:
+    yield
+  finally:
+    if nmbThreads > 0:
+      ROOT.EnableImplicitMT(nmbThreads)
+
+
+@contextmanager
+def implicitMtEnabled(nmbThreads: int) -> Generator[None, None, None]:
+  """Context manager that temporarily enables implicit multi-threading of ROOT with the given number of threads, e.g. to run RDataFrame event loops within a thread budget"""
+  nmbThreadsPrevious = ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() else 0
+  if nmbThreadsPrevious != nmbThreads:
+    if nmbThreadsPrevious > 0:
+      ROOT.DisableImplicitMT()  # thread pool has to be recreated to change its size
+    ROOT.EnableImplicitMT(nmbThreads)
+  try:
+    yield
+  finally:
+    if nmbThreadsPrevious != nmbThreads:
+      ROOT.DisableImplicitMT()
+      if nmbThreadsPrevious > 0:
+        ROOT.EnableImplicitMT(nmbThreadsPrevious)
+
+
+@dataclass
+class RdfDiagnostics:
+  """Collects lazy RDataFrame results, e.g. histograms and sums, that are booked up front and filled together, so that each data frame is processed in a single event loop
+  Results are read only after run(), which runs the event loops of all data frames via ROOT.RDF.RunGraphs(); with implicit multi-threading, the event loops run concurrently.
+  """
+  _results: Dict[str, Any] = field(default_factory = dict)  # lazy RResultPtrs by name
+  _hasRun:  bool           = False  # set once the event loops have run
+
+  def __len__(self) -> int:
+    """Returns number of booked results"""
+    return len(self._results)
+
+  def book(
+    self,
+    name:   str,  # name the result is accessed by
+    result: Any,  # lazy result, e.g. returned by RDataFrame.Histo1D() or Sum(); must not have been read yet
+  ) -> Any:
+    """Books lazy result; returns it unchanged, so that booking can be chained"""
+    assert not self._hasRun, f"Cannot book '{name}' after the event loops have run"
+    assert name not in self._results, f"Result '{name}' is already booked"
+    self._results[name] = result
+    return result
+
+  def run(self) -> None:
+    """Runs the event loops of all data frames with booked results"""
+    if not self._hasRun and self._results:
+      ROOT.RDF.RunGraphs(list(self._results.values()))
+    self._hasRun = True
+
+  def __getitem__(self, name: str) -> Any:
+    """Returns value of booked result; runs the event loops if they have not run yet"""
+    self.run()
+    return self._results[name].GetValue()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Measures the time it takes to import the modules of this package in a fresh Python interpreter, e.g. in a short-lived pool worker, and reports which heavy dependencies are pulled in"""
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+from typing import (
+  Dict,
+  List,
+)
+
+import numpy as np
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+MODULE_NAMES = ("KernelLibrary", "MomentCalculator", "PlottingUtilities", "RootUtilities", "testMomentsPhotoProd")
+HEAVY_MODULE_NAMES = ("ROOT", "matplotlib", "scipy", "py3nj", "bidict", "nptyping")
+
+# code that is executed in the fresh interpreter; reports import time and loaded heavy modules as JSON
+IMPORT_CODE = """
+import json, sys, time
+startTime = time.perf_counter()
+import {moduleName}
+importTime = time.perf_counter() - startTime
+print(json.dumps({{"importTime" : importTime, "heavyModules" : [name for name in {heavyModuleNames} if name in sys.modules]}}))
+"""
+
+
+def measureImport(
+  moduleName:     str,  # name of module to import
+  nmbRepetitions: int,  # number of fresh interpreters to start
+) -> Dict:
+  """Imports given module in fresh interpreters and returns import times and the heavy modules that were loaded"""
+  code = IMPORT_CODE.format(moduleName = moduleName, heavyModuleNames = HEAVY_MODULE_NAMES)
+  sourceDir = os.path.dirname(os.path.abspath(__file__))
+  importTimes: List[float] = []
+  heavyModules: List[str] = []
+  for _ in range(nmbRepetitions):
+    result = subprocess.run([sys.executable, "-c", code], cwd = sourceDir, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    if result.returncode != 0:
+      return {"module" : moduleName, "error" : result.stderr.strip().splitlines()[-1]}
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    importTimes.append(measurement["importTime"])
+    heavyModules = measurement["heavyModules"]
+  return {
+    "module"       : moduleName,
+    "minTime"      : float(np.min(importTimes)),
+    "medianTime"   : float(np.median(importTimes)),
+    "heavyModules" : heavyModules,
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = __doc__)
+  parser.add_argument("modules", nargs = "*", default = MODULE_NAMES, help = "modules to import (default: %(default)s)")
+  parser.add_argument("--repetitions", type = int, default = 5, help = "number of fresh interpreters per module (default: %(default)s)")
+  parser.add_argument("--json", dest = "jsonFileName", default = None, help = "write results to given JSON file")
+  args = parser.parse_args()
+
+  results = [measureImport(moduleName, args.repetitions) for moduleName in args.modules]
+  print(f"{'module':<22} {'min [s]':>9} {'median [s]':>11}  heavy modules loaded")
+  for result in results:
+    if "error" in result:
+      print(f"{result['module']:<22} import failed: {result['error']}")
+    else:
+      print(f"{result['module']:<22} {result['minTime']:9.3f} {result['medianTime']:11.3f}  {', '.join(result['heavyModules']) or '-'}")
+  if args.jsonFileName:
+    with open(args.jsonFileName, "w") as jsonFile:
+      json.dump(results, jsonFile, indent = 2)
+    print(f"Wrote results to '{args.jsonFileName}'")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Benchmark suite that times the basis-function kernels, the integral-matrix and moment calculation, the calculation of true moments, and the MC generation on synthetic inputs for a grid of event counts, maximum L values, and thread counts
+The results are written to a JSON file; results of two revisions can be compared using the --compare option.
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import (
+  Any,
+  Callable,
+  Dict,
+  List,
+  Optional,
+)
+
+import numpy as np
+
+import KernelLibrary
+import MomentCalculator
+import OpenMp
+
+
+# always flush print() to reduce garbling of log files due to buffering
+print = functools.partial(print, flush = True)
+
+
+POLARIZATION = 0.3  # photon-beam polarization used for all benchmarks
+
+
+def syntheticData(
+  nmbEvents: int,  # number of events to generate
+  seed:      int,  # seed for random-number generation
+) -> Dict[str, np.ndarray]:
+  """Returns events uniformly distributed in phase space as mapping of column names to NumPy arrays"""
+  rng = np.random.default_rng(seed)
+  return {
+    "theta" : np.arccos(rng.uniform(-1, +1, nmbEvents)),
+    "phi"   : rng.uniform(-np.pi, +np.pi, nmbEvents),
+    "Phi"   : rng.uniform(-np.pi, +np.pi, nmbEvents),
+  }
+
+
+def syntheticAmplitudeSet(
+  maxSpin: int,  # maximum spin of partial waves
+  seed:    int,  # seed for random-number generation
+) -> MomentCalculator.AmplitudeSet:
+  """Returns set of partial-wave amplitudes with random values for both reflectivities and all waves up to the given spin"""
+  rng = np.random.default_rng(seed)
+  return MomentCalculator.AmplitudeSet([
+    MomentCalculator.AmplitudeValue(MomentCalculator.QnWaveIndex(refl, l, m), val = complex(*rng.uniform(-1, +1, 2)))
+    for refl in (-1, +1) for l in range(maxSpin + 1) for m in range(-l, l + 1)
+  ])
+
+
+def timeCall(
+  fcn:            Callable[..., Any],                  # function to time
+  nmbRepetitions: int,                                 # number of timed calls
+  setup:          Optional[Callable[[], Any]] = None,  # function that is called before each timed call and whose result is passed to fcn
+) -> List[float]:
+  """Returns wall times in seconds of repeated calls of given function"""
+  times: List[float] = []
+  for _ in range(nmbRepetitions):
+    args = (setup(), ) if setup is not None else ()  # setup is not timed
+    startTime = time.perf_counter()
+    fcn(*args)
+    times.append(time.perf_counter() - startTime)
+  return times
+
+
+def benchmarkBasisFunctions(
+  kernel:  Callable,  # basis function of KernelLibrary.KernelBinding
+  indices: MomentCalculator.MomentIndices,
+  data:    Dict[str, np.ndarray],
+) -> Callable[[], None]:
+  """Returns function that evaluates given basis function for all moments and events"""
+  def evaluate() -> None:
+    for qnIndex in indices.QnIndices():
+      kernel(qnIndex.momentIndex, qnIndex.L, qnIndex.M, data["theta"], data["phi"], data["Phi"], POLARIZATION)
+  return evaluate
+
+
+def benchmarkMcGeneration(
+  nmbEvents:      int,
+  maxL:           int,
+  nmbThreads:     int,  # number of threads of ROOT's implicit multi-threading, which parallelizes the generation
+  nmbRepetitions: int,
+  seed:           int,
+) -> Optional[List[float]]:
+  """Returns wall times of the generation of MC events distributed according to the intensity of a random PWA model or None if ROOT is not available"""
+  try:
+    import ROOT
+    import RootUtilities
+    import testMomentsPhotoProd
+  except ImportError:
+    return None
+  RootUtilities.loadKernels()
+  pars = testMomentsPhotoProd.intensityFcnParameters(POLARIZATION, syntheticAmplitudeSet(maxL // 2, seed))
+  intensityFcn = ROOT.TF3("intensityBenchmark", ROOT.IntensityFcnPhotoProd(ROOT.nullptr), -1, +1, -180, +180, -180, +180, len(pars))
+  intensityFcn.SetParameters(np.array(pars))
+  # the thread budget does not enable implicit multi-threading, without which the generation would be single-threaded for all thread counts
+  with RootUtilities.implicitMtEnabled(nmbThreads):
+    return timeCall(lambda: testMomentsPhotoProd.genPointsAcceptReject(intensityFcn, nmbEvents, seed = seed), nmbRepetitions)
+
+
+def runBenchmarks(
+  nmbEventsValues:  List[int],
+  maxLValues:       List[int],
+  nmbThreadsValues: List[int],
+  nmbRepetitions:   int,
+  seed:             int,
+  benchmarkNames:   List[str],
+) -> List[Dict[str, Any]]:
+  """Runs all benchmarks on the grid of event counts, maximum L values, and thread counts and returns list of result records"""
+  kernels = KernelLibrary.kernels()
+  records: List[Dict[str, Any]] = []
+  def record(name: str, nmbEvents: Optional[int], maxL: int, nmbThreads: int, times: Optional[List[float]]) -> None:
+    """Adds result record and prints summary"""
+    result: Dict[str, Any] = {"benchmark" : name, "nmbEvents" : nmbEvents, "maxL" : maxL, "nmbThreads" : nmbThreads}
+    if times is None:
+      result["skipped"] = True
+      print(f"{name:<20} events = {nmbEvents}, maxL = {maxL}, threads = {nmbThreads}: skipped")
+    else:
+      result.update({
+        "times"        : times,
+        "minTime"      : float(np.min(times)),
+        "medianTime"   : float(np.median(times)),
+        "eventsPerSec" : nmbEvents / float(np.min(times)) if nmbEvents else None,
+      })
+      print(f"{name:<20} events = {nmbEvents}, maxL = {maxL}, threads = {nmbThreads}: min = {result['minTime']:.4f} s, median = {result['medianTime']:.4f} s")
+    records.append(result)
+
+  for nmbThreads in nmbThreadsValues:
+    with OpenMp.threadBudget(nmbThreads, verbose = False):
+      for maxL in maxLValues:
+        indices = MomentCalculator.MomentIndices(maxL)
+        if "photoProdMomentSet" in benchmarkNames:
+          amplitudeSet = syntheticAmplitudeSet(maxL // 2, seed)
+          record("photoProdMomentSet", None, maxL, nmbThreads, timeCall(lambda: amplitudeSet.photoProdMomentSet(maxL), nmbRepetitions))
+        for nmbEvents in nmbEventsValues:
+          data       = syntheticData(nmbEvents, seed)
+          phaseSpace = syntheticData(nmbEvents, seed + 1)
+          dataSet    = MomentCalculator.DataSet(POLARIZATION, data, phaseSpace, nmbGenEvents = nmbEvents)
+          if "f_meas" in benchmarkNames:
+            record("f_meas", nmbEvents, maxL, nmbThreads, timeCall(benchmarkBasisFunctions(kernels.f_meas, indices, data), nmbRepetitions))
+          if "f_phys" in benchmarkNames:
+            record("f_phys", nmbEvents, maxL, nmbThreads, timeCall(benchmarkBasisFunctions(kernels.f_phys, indices, data), nmbRepetitions))
+          if "integralMatrix" in benchmarkNames:
+            record("integralMatrix", nmbEvents, maxL, nmbThreads, timeCall(
+              lambda integralMatrix: integralMatrix.calculate(), nmbRepetitions,
+              setup = lambda: MomentCalculator.AcceptanceIntegralMatrix(indices, dataSet)))
+          if "calculateMoments" in benchmarkNames:
+            integralMatrix = MomentCalculator.AcceptanceIntegralMatrix(indices, dataSet)
+            integralMatrix.calculate()
+            record("calculateMoments", nmbEvents, maxL, nmbThreads, timeCall(
+              lambda momentCalculator: momentCalculator.calculateMoments(), nmbRepetitions,
+              setup = lambda: MomentCalculator.MomentCalculator(indices, dataSet, _integralMatrix = integralMatrix)))
+          if "mcGeneration" in benchmarkNames:
+            record("mcGeneration", nmbEvents, maxL, nmbThreads, benchmarkMcGeneration(nmbEvents, maxL, nmbThreads, nmbRepetitions, seed))
+  return records
+
+
+def metadata() -> Dict[str, Any]:
+  """Returns information on the revision and the machine, which is stored along with the results"""
+  sourceDir = os.path.dirname(os.path.abspath(__file__))
+  def git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd = sourceDir, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True).stdout.strip()
+  return {
+    "revision"      : git("rev-parse", "HEAD"),
+    "dirty"         : bool(git("status", "--porcelain", "--untracked-files=no")),
+    "timestamp"     : datetime.datetime.now().isoformat(),
+    "host"          : platform.node(),
+    "platform"      : platform.platform(),
+    "nmbCpus"       : os.cpu_count(),
+    "pythonVersion" : platform.python_version(),
+    "numpyVersion"  : np.__version__,
+    "kernelLibrary" : KernelLibrary.kernelLibraryFileName(),
+    "instrumented"  : KernelLibrary.kernels().instrumented,  # hot-path counters add overhead to the timings
+  }
+
+
+def compareResults(
+  results:   Dict[str, Any],  # results of this run
+  baseline:  Dict[str, Any],  # results of reference run
+  tolerance: float,           # relative slowdown that is reported as regression
+) -> int:
+  """Prints ratio of minimum times for all benchmarks present in both results and returns number of regressions"""
+  key = lambda record: (record["benchmark"], record["nmbEvents"], record["maxL"], record["nmbThreads"])
+  baselineRecords = {key(record): record for record in baseline["records"] if not record.get("skipped")}
+  print(f"Comparing with revision {baseline['metadata']['revision']} run on {baseline['metadata']['host']}")
+  nmbRegressions = 0
+  for record in results["records"]:
+    if record.get("skipped") or key(record) not in baselineRecords:
+      continue
+    ratio = record["minTime"] / baselineRecords[key(record)]["minTime"]
+    regression = ratio > 1 + tolerance
+    nmbRegressions += regression
+    print(f"{record['benchmark']:<20} events = {record['nmbEvents']}, maxL = {record['maxL']}, threads = {record['nmbThreads']}: "
+          f"time ratio = {ratio:.3f}{'  <-- REGRESSION' if regression else ''}")
+  return nmbRegressions
+
+
+BENCHMARK_NAMES = ["f_meas", "f_phys", "integralMatrix", "calculateMoments", "photoProdMomentSet", "mcGeneration"]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--events",      type = int, nargs = "+", default = [10000, 100000], help = "numbers of events (default: %(default)s)")
+  parser.add_argument("--maxL",        type = int, nargs = "+", default = [2, 4, 8],       help = "maximum L values of moments (default: %(default)s)")
+  parser.add_argument("--threads",     type = int, nargs = "+", default = [1, 4],          help = "thread budgets (default: %(default)s)")
+  parser.add_argument("--repetitions", type = int, default = 3,     help = "number of timed calls per benchmark (default: %(default)s)")
+  parser.add_argument("--seed",        type = int, default = 12345, help = "seed for synthetic inputs (default: %(default)s)")
+  parser.add_argument("--benchmarks",  nargs = "+", default = BENCHMARK_NAMES, choices = BENCHMARK_NAMES, help = "benchmarks to run (default: all)")
+  parser.add_argument("--output",      default = "./benchmarkResults.json", help = "JSON file the results are written to (default: %(default)s)")
+  parser.add_argument("--compare",     default = None, help = "JSON file with results of another revision to compare with")
+  parser.add_argument("--tolerance",   type = float, default = 0.1, help = "relative slowdown that is reported as regression (default: %(default)s)")
+  args = parser.parse_args()
+
+  results = {
+    "metadata" : metadata(),
+    "settings" : vars(args),
+    "records"  : runBenchmarks(args.events, args.maxL, args.threads, args.repetitions, args.seed, args.benchmarks),
+  }
+  with open(args.output, "w") as resultsFile:
+    json.dump(results, resultsFile, indent = 2)
+  print(f"Wrote results to '{args.output}'")
+  if args.compare:
+    with open(args.compare) as baselineFile:
+      baseline = json.load(baselineFile)
+    sys.exit(1 if compareResults(results, baseline, args.tolerance) > 0 else 0)
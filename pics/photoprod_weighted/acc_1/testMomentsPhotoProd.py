@@ -3,11 +3,18 @@
 # equation numbers refer to https://halldweb.jlab.org/doc-private/DocDB/ShowDocument?docid=6124&version=3
 
 import ctypes
+from dataclasses import dataclass
 import functools
+import hashlib
+import json
 import numpy as np
 import os
 import subprocess
+import tempfile
 from typing import (
+  Any,
+  Callable,
+  Dict,
   List,
   Optional,
   Tuple,
@@ -16,9 +23,14 @@ from typing import (
 
 import ROOT
 
+import AutoTuner
+import KernelLibrary
 import MomentCalculator
+import MomentComparison
 import OpenMp
 import PlottingUtilities
+import ProfilingUtilities
+import RenderQueue
 import RootUtilities
 
 
@@ -47,145 +59,303 @@ class Th3PlotKwargsType(TypedDict):
 TH3_PLOT_KWARGS: Th3PlotKwargsType = {"histTitle" : TH3_TITLE, "binnings" : TH3_BINNINGS}
 
 
+def intensityFcnParameters(
+  polarization: float,                          # photon-beam polarization
+  amplitudeSet: MomentCalculator.AmplitudeSet,  # partial-wave amplitudes
+) -> List[float]:
+  """Returns parameters of intensity function in `wignerD.C` for given polarization and partial-wave amplitudes, which define a rank-1 spin-density matrix"""
+  pars = [polarization, amplitudeSet.maxSpin]
+  for refl in (+1, -1):
+    for amp in amplitudeSet.amplitudes(onlyRefl = refl):
+      pars += [amp.val.real, amp.val.imag]
+  return pars
+
+
+def genPointsAcceptReject(
+  fcn:               ROOT.TF3,              # non-negative function in x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg
+  nmbPoints:         int,                   # number of points to generate
+  seed:              Optional[int] = None,  # seed for random-number generator; if None, seed is drawn from gRandom
+  nmbPointsPerBlock: int = 1000000,         # maximum number of points that are thrown at once
+) -> Dict[str, np.ndarray]:
+  """Generates random points distributed according to given TF3 using the accept-reject method on blocks of uniformly distributed points; returns columns 'cosTheta', 'phiDeg', and 'PhiDeg'
+  If implicit multi-threading of ROOT is enabled, the points are generated by genPointsAcceptRejectMt().
+  """
+  RootUtilities.loadKernels()
+  # use separate random-number streams for the generation and the estimation of the bound, so that generated points do not depend on whether the bound was cached
+  seedSeq = np.random.SeedSequence(seed if seed is not None else ROOT.gRandom.Integer(2**31))
+  rng, rngBound = (np.random.default_rng(childSeedSeq) for childSeedSeq in seedSeq.spawn(2))
+  def throwBlock(
+    nmbPointsInBlock: int,
+    rng:              np.random.Generator = rng,
+  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Throws uniformly distributed points and evaluates function at these points"""
+    cosTheta = rng.uniform(  -1,   +1, nmbPointsInBlock)
+    phiDeg   = rng.uniform(-180, +180, nmbPointsInBlock)
+    PhiDeg   = rng.uniform(-180, +180, nmbPointsInBlock)
+    fcnVals  = np.asarray(ROOT.evalTF3(fcn, cosTheta, phiDeg, PhiDeg))
+    assert np.all(fcnVals >= 0), f"Function '{fcn.GetName()}' has negative values"
+    return (cosTheta, phiDeg, PhiDeg, fcnVals)
+
+  # the bound for the function values is cached in the TF3 object; it is estimated from a block of points with a safety margin of 10%
+  bound = fcn.GetMaximumStored()
+  if bound <= 0:
+    bound = 1.1 * np.max(throwBlock(nmbPointsPerBlock, rngBound)[3])
+    fcn.SetMaximum(bound)
+  if ROOT.IsImplicitMTEnabled():
+    return genPointsAcceptRejectMt(fcn, nmbPoints, int(seedSeq.generate_state(1, np.uint64)[0]))
+  while True:
+    acceptedBlocks: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+    nmbAccepted    = 0
+    acceptanceRate = 1.0
+    boundExceeded  = False
+    while nmbAccepted < nmbPoints:
+      # throw only as many points as needed on average
+      nmbPointsInBlock = min(nmbPointsPerBlock, int(1.1 * (nmbPoints - nmbAccepted) / acceptanceRate) + 1000)
+      cosTheta, phiDeg, PhiDeg, fcnVals = throwBlock(nmbPointsInBlock)
+      if np.max(fcnVals) > bound:
+        # bound was underestimated; restart generation with larger bound to ensure correct distribution
+        bound = 1.1 * np.max(fcnVals)
+        fcn.SetMaximum(bound)
+        print(f"Warning: function '{fcn.GetName()}' exceeds bound; restarting generation with bound = {bound}")
+        boundExceeded = True
+        break
+      accepted = rng.uniform(0, bound, nmbPointsInBlock) < fcnVals
+      acceptedBlocks.append((cosTheta[accepted], phiDeg[accepted], PhiDeg[accepted]))
+      nmbAccepted   += np.count_nonzero(accepted)
+      acceptanceRate = max(np.count_nonzero(accepted) / nmbPointsInBlock, 1e-6)
+    if not boundExceeded:
+      break
+  return {column : np.concatenate([block[index] for block in acceptedBlocks])[:nmbPoints] for index, column in enumerate(("cosTheta", "phiDeg", "PhiDeg"))}
+
+
+def genPointsAcceptRejectMt(
+  fcn:       ROOT.TF3,  # non-negative function in x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg; bound must be set via SetMaximum()
+  nmbPoints: int,       # number of points to generate
+  seed:      int,       # seed for random-number generation
+) -> Dict[str, np.ndarray]:
+  """Generates random points distributed according to given TF3 using the accept-reject method in a multi-threaded RDataFrame event loop; returns columns 'cosTheta', 'phiDeg', and 'PhiDeg'
+  Each slot uses its own copy of the function and the random numbers of each entry are derived from the seed and the entry number, so that the result is reproducible for any number of threads.
+  """
+  RootUtilities.loadKernels()
+  while True:
+    bound     = fcn.GetMaximumStored()
+    generator = ROOT.AcceptRejectGeneratorTF3(fcn, bound, seed, max(1, ROOT.GetThreadPoolSize()), nmbPoints)
+    ROOT.RDataFrame(nmbPoints).Filter(f"reinterpret_cast<AcceptRejectGeneratorTF3*>({ROOT.addressof(generator)})->generate(rdfslot_, rdfentry_)").Count().GetValue()
+    if generator.maxFcnValue() <= bound:
+      return {"cosTheta" : np.array(generator.cosTheta()), "phiDeg" : np.array(generator.phiDeg()), "PhiDeg" : np.array(generator.PhiDeg())}
+    # bound was underestimated; restart generation with larger bound to ensure correct distribution
+    fcn.SetMaximum(1.1 * generator.maxFcnValue())
+    print(f"Warning: function '{fcn.GetName()}' exceeds bound; restarting generation with bound = {fcn.GetMaximumStored()}")
+
+
+@dataclass
+class McSampleCache:
+  """Content-keyed cache for generated MC samples
+  The file name of each sample contains a hash of the full generator configuration, so that a changed configuration never reuses a stale file.
+  Files are created atomically and the least recently used files are removed when the total size of the cache exceeds the given limit.
+  """
+  cacheDir: str = "./mcCache"  # directory that holds the cached .root files
+  maxSize:  int = 10 * 1024**3  # [bytes] maximum total size of cached files
+
+  def fileName(
+    self,
+    namePrefix: str,             # human-readable prefix of file name
+    config:     Dict[str, Any],  # JSON-serializable configuration that fully defines the generated sample
+  ) -> str:
+    """Returns name of the cache file for the given configuration"""
+    key = hashlib.sha256(json.dumps(config, sort_keys = True).encode()).hexdigest()
+    return os.path.join(self.cacheDir, f"{namePrefix}_{key[:16]}.photoProd.root")
+
+  def loadOrGenerate(
+    self,
+    fileName:   str,  # name of cache file as returned by fileName()
+    treeName:   str,  # name of tree in cache file
+    writeTree:  Callable[[str], None],  # generates sample and writes tree into the .root file with the given name
+    regenerate: bool = False,  # if set, sample is regenerated even if it is already in the cache
+  ) -> ROOT.RDataFrame:
+    """Returns RDataFrame for cached sample; the sample is generated first, if it is not in the cache"""
+    if os.path.exists(fileName) and not regenerate:
+      print(f"Reading cached MC data from '{fileName}'")
+      os.utime(fileName)  # mark as recently used
+      return ROOT.RDataFrame(treeName, fileName)
+    print(f"Generating MC data and writing them to '{fileName}'")
+    os.makedirs(self.cacheDir, exist_ok = True)
+    # write into temporary file in the same directory and rename it, so that an interrupted generation never leaves a corrupt file in the cache
+    fd, tempFileName = tempfile.mkstemp(suffix = ".root.tmp", dir = self.cacheDir)
+    os.close(fd)
+    try:
+      writeTree(tempFileName)
+      os.replace(tempFileName, fileName)
+    finally:
+      if os.path.exists(tempFileName):
+        os.remove(tempFileName)
+    self.evict(keepFileName = fileName)
+    return ROOT.RDataFrame(treeName, fileName)
+
+  def evict(
+    self,
+    keepFileName: Optional[str] = None,  # file that is never removed
+  ) -> None:
+    """Removes least recently used files until total size of cache is below limit"""
+    cachedFiles = [os.path.join(self.cacheDir, name) for name in os.listdir(self.cacheDir) if name.endswith(".photoProd.root")]
+    cachedFiles.sort(key = os.path.getmtime)  # least recently used first
+    totalSize = sum(os.path.getsize(cachedFile) for cachedFile in cachedFiles)
+    for cachedFile in cachedFiles:
+      if totalSize <= self.maxSize:
+        break
+      if cachedFile == keepFileName:
+        continue
+      print(f"Removing least recently used MC data file '{cachedFile}' from cache")
+      totalSize -= os.path.getsize(cachedFile)
+      os.remove(cachedFile)
+
+
+MC_SAMPLE_CACHE = McSampleCache()
+
+
+def writePoints(
+  points:   Dict[str, np.ndarray],  # columns 'cosTheta', 'phiDeg', and 'PhiDeg' as returned by genPointsAcceptReject()
+  treeName: str,        # name of tree to write
+  fileName: str,        # name of .root file to write
+  columns:  List[str],  # columns to write; can be any of 'cosTheta', 'theta', 'phiDeg', 'phi', 'PhiDeg', and 'Phi'
+) -> None:
+  """Writes generated points into tree"""
+  with RootUtilities.implicitMtDisabled():  # keep order of generated points
+    ROOT.RDF.FromNumpy(points) \
+        .Define("theta", "std::acos(cosTheta)") \
+        .Define("phi",   "TMath::DegToRad() * phiDeg") \
+        .Define("Phi",   "TMath::DegToRad() * PhiDeg") \
+        .Snapshot(treeName, fileName, ROOT.std.vector[ROOT.std.string](columns))
+
+
 def genDataFromWaves(
   nmbEvents:         int,                            # number of events to generate
   polarization:      float,                          # photon-beam polarization
   amplitudeSet:      MomentCalculator.AmplitudeSet,  # partial-wave amplitudes
   efficiencyFormula: Optional[str] = None,           # detection efficiency used to generate data
-  regenerateData:    bool = False,                   # if set data are regenerated although .root file exists
+  regenerateData:    bool = False,                   # if set data are regenerated although they exist in the cache
   pdfFileNamePrefix: str = "./",                     # name prefix for output files
   nameSuffix:        str = "",                       # suffix for functions and file names
+  seed:              Optional[int] = None,           # seed for random-number generation; if None, seed is drawn from gRandom
 ) -> ROOT.RDataFrame:
   """Generates data according to set of partial-wave amplitudes (assuming rank 1) and given detection efficiency"""
+  RootUtilities.loadKernels()
   print(f"Generating {nmbEvents} events distributed according to PWA model {amplitudeSet} with photon-beam polarization {polarization} weighted by efficiency {efficiencyFormula}")
   # construct and draw efficiency function
   efficiencyFcn = ROOT.TF3(f"efficiencyGen{nameSuffix}", efficiencyFormula if efficiencyFormula else "1", -1, +1, -180, +180, -180, +180)
   PlottingUtilities.drawTF3(efficiencyFcn, **TH3_PLOT_KWARGS, nmbPoints = 100, maxVal = 1.0,
     pdfFileName = f"{pdfFileNamePrefix}{efficiencyFcn.GetName()}.pdf")
 
-  # construct TF3 for intensity distribution in Eq. (153)
+  # construct TF3 for intensity distribution in Eq. (153) using compiled intensity function in `wignerD.C`
   # x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg
-  intensityComponentTerms: List[Tuple[str, str, str]] = []  # terms in sum of each intensity component
-  for refl in (-1, +1):
-    for amp1 in amplitudeSet.amplitudes(onlyRefl = refl):
-      l1 = amp1.qn.l
-      m1 = amp1.qn.m
-      decayAmp1 = f"Ylm({l1}, {m1}, std::acos(x), TMath::DegToRad() * y)"
-      for amp2 in amplitudeSet.amplitudes(onlyRefl = refl):
-        l2 = amp2.qn.l
-        m2 = amp2.qn.m
-        decayAmp2 = f"Ylm({l2}, {m2}, std::acos(x), TMath::DegToRad() * y)"
-        rhos: Tuple[complex, complex, complex] = amplitudeSet.photoProdSpinDensElements(refl, l1, l2, m1, m2)
-        terms = tuple(
-          f"{decayAmp1} * complexT({rho.real}, {rho.imag}) * std::conj({decayAmp2})"  # Eq. (153)
-          if rho != 0 else "" for rho in rhos
-        )
-        intensityComponentTerms.append((terms[0], terms[1], terms[2]))
-  # sum terms for each intensity component
-  intensityComponentsFormula = []
-  for iComponent in range(3):
-    intensityComponentsFormula.append(f"({' + '.join(filter(None, (term[iComponent] for term in intensityComponentTerms)))})")
-  # sum intensity components
-  intensityFormula = (
-    f"std::real({intensityComponentsFormula[0]} "
-    f"- {intensityComponentsFormula[1]} * {polarization} * std::cos(2 * TMath::DegToRad() * z) "
-    f"- {intensityComponentsFormula[2]} * {polarization} * std::sin(2 * TMath::DegToRad() * z))"
-    + (f" * ({efficiencyFormula})" if efficiencyFormula else ""))  # Eq. (163)
-  print(f"Intensity formula = {intensityFormula}")
-  intensityFcn = ROOT.TF3(f"intensity{nameSuffix}", intensityFormula, -1, +1, -180, +180, -180, +180)
+  intensityPars = intensityFcnParameters(polarization, amplitudeSet)
+  print(f"Intensity function parameters = {intensityPars}")
+  intensityFcn = ROOT.TF3(f"intensity{nameSuffix}", ROOT.IntensityFcnPhotoProd(efficiencyFcn if efficiencyFormula else ROOT.nullptr),
+    -1, +1, -180, +180, -180, +180, len(intensityPars))  # Eq. (163)
+  intensityFcn.SetParameters(np.array(intensityPars))
   intensityFcn.SetTitle(";cos#theta;#phi [deg];#Phi [deg]")
-  intensityFcn.SetNpx(100)  # used in numeric integration performed by GetRandom()
-  intensityFcn.SetNpy(100)
-  intensityFcn.SetNpz(100)
   intensityFcn.SetMinimum(0)
   PlottingUtilities.drawTF3(intensityFcn, **TH3_PLOT_KWARGS, pdfFileName = f"{pdfFileNamePrefix}{intensityFcn.GetName()}.pdf")
   #TODO check for negative intensity values for wave set containing only P_+1^+ wave
 
   # generate random data that follow intensity given by partial-wave amplitudes
+  if seed is None:
+    seed = ROOT.gRandom.Integer(2**31)
+  config = {
+    "generator"         : "acceptRejectMt" if ROOT.IsImplicitMTEnabled() else "acceptReject",
+    "amplitudes"        : [(amp.qn.refl, amp.qn.l, amp.qn.m, amp.val.real, amp.val.imag) for amp in amplitudeSet.amplitudes()],
+    "polarization"      : polarization,
+    "efficiencyFormula" : efficiencyFormula,
+    "nmbEvents"         : nmbEvents,
+    "seed"              : seed,
+  }
   treeName = "data"
-  fileName = f"{intensityFcn.GetName()}.photoProd.root"
-  if os.path.exists(fileName) and not regenerateData:
-    print(f"Reading partial-wave MC data from '{fileName}'")
-    return ROOT.RDataFrame(treeName, fileName)
-  print(f"Generating partial-wave MC data and writing them to '{fileName}'")
-  RootUtilities.declareInCpp(**{intensityFcn.GetName() : intensityFcn})  # use Python object in C++
-  pointFunc = f"""
-    double cosTheta, phiDeg, PhiDeg;
-    PyVars::{intensityFcn.GetName()}.GetRandom3(cosTheta, phiDeg, PhiDeg);
-    std::vector<double> point = {{cosTheta, phiDeg, PhiDeg}};
-    return point;
-  """  # C++ code that throws random point in angular space
-  df = ROOT.RDataFrame(nmbEvents) \
-           .Define("point",    pointFunc) \
-           .Define("cosTheta", "point[0]") \
-           .Define("theta",    "std::acos(cosTheta)") \
-           .Define("phiDeg",   "point[1]") \
-           .Define("phi",      "TMath::DegToRad() * phiDeg") \
-           .Define("PhiDeg",   "point[2]") \
-           .Define("Phi",      "TMath::DegToRad() * PhiDeg") \
-           .Filter('if (rdfentry_ == 0) { cout << "Running event loop in genDataFromWaves()" << endl; } return true;') \
-           .Snapshot(treeName, fileName, ROOT.std.vector[ROOT.std.string](["cosTheta", "theta", "phiDeg", "phi", "PhiDeg", "Phi"]))
-    # snapshot is needed or else the `point` column would be regenerated for every triggered loop
-    # noop filter before snapshot logs when event loop is running
-    # !Note! for some reason, this is very slow
-  return df
+  return MC_SAMPLE_CACHE.loadOrGenerate(MC_SAMPLE_CACHE.fileName(intensityFcn.GetName(), config), treeName,
+    lambda fileName: writePoints(genPointsAcceptReject(intensityFcn, nmbEvents, seed), treeName, fileName, ["cosTheta", "theta", "phiDeg", "phi", "PhiDeg", "Phi"]),
+    regenerateData)
 
 
 def genAccepted2BodyPsPhotoProd(
-  nmbEvents:         int,                   # number of events to generate
+  nmbEvents:         int,                   # number of events to generate; for weighted events, this is the number of generated uniformly distributed events
   efficiencyFormula: Optional[str] = None,  # detection efficiency used for acceptance correction
-  regenerateData:    bool = False,          # if set data are regenerated although .root file exists
+  regenerateData:    bool = False,          # if set data are regenerated although they exist in the cache
   pdfFileNamePrefix: str = "./",            # name prefix for output files
+  seed:              Optional[int] = None,  # seed for random-number generation; if None, seed is drawn from gRandom
+  weightedEvents:    bool = False,          # if set, uniformly distributed events are generated and the efficiency is carried as per-event weight in column 'eventWeight'
 ) -> ROOT.RDataFrame:
-  """Generates RDataFrame with two-body phase-space distribution weighted by given detection efficiency"""
+  """Generates RDataFrame with two-body phase-space distribution weighted by given detection efficiency
+  For weighted events, the uniformly distributed events do not depend on the efficiency and are taken from the cache if available, so that switching between efficiency models requires only the evaluation of the efficiency function.
+  """
   print(f"Generating {nmbEvents} events distributed according to two-body phase-space weighted by efficiency {efficiencyFormula}")
   # construct and draw efficiency function
   efficiencyFcn = ROOT.TF3("efficiencyReco", efficiencyFormula if efficiencyFormula else "1", -1, +1, -180, +180, -180, +180)
   PlottingUtilities.drawTF3(efficiencyFcn, **TH3_PLOT_KWARGS, pdfFileName = f"{pdfFileNamePrefix}hEfficiencyReco.pdf", nmbPoints = 100, maxVal = 1.0)
 
   # generate isotropic distributions in cos theta, phi, and Phi and weight with efficiency function
+  if seed is None:
+    seed = ROOT.gRandom.Integer(2**31)
   treeName = "data"
-  fileName = f"{efficiencyFcn.GetName()}.photoProd.root"
-  if os.path.exists(fileName) and not regenerateData:
-    print(f"Reading accepted phase-space MC data from '{fileName}'")
-    return ROOT.RDataFrame(treeName, fileName)
-  print(f"Generating accepted phase-space MC data and writing them to '{fileName}'")
-  #TODO avoid code doubling with genDataFromWaves() and corresponding function in testMomentsAlex
-  RootUtilities.declareInCpp(efficiencyFcn = efficiencyFcn)
-  pointFunc = """
-    double cosTheta, phiDeg, PhiDeg;
-    PyVars::efficiencyFcn.GetRandom3(cosTheta, phiDeg, PhiDeg);
-    std::vector<double> point = {cosTheta, phiDeg, PhiDeg};
-    return point;
-  """  # C++ code that throws random point in angular space
-  df = ROOT.RDataFrame(nmbEvents) \
-           .Define("point",    pointFunc) \
-           .Define("cosTheta", "point[0]") \
-           .Define("theta",    "std::acos(cosTheta)") \
-           .Define("phiDeg",   "point[1]") \
-           .Define("phi",      "TMath::DegToRad() * phiDeg") \
-           .Define("PhiDeg",   "point[2]") \
-           .Define("Phi",      "TMath::DegToRad() * PhiDeg") \
-           .Filter('if (rdfentry_ == 0) { cout << "Running event loop in genData2BodyPSPhotoProd()" << endl; } return true;') \
-           .Snapshot(treeName, fileName, ROOT.std.vector[ROOT.std.string](["theta", "phi", "Phi"]))
-    # snapshot is needed or else the `point` column would be regenerated for every triggered loop
-    # noop filter before snapshot logs when event loop is running
-  return df
+  if weightedEvents:
+    config = {
+      "generator" : "uniform",
+      "nmbEvents" : nmbEvents,
+      "seed"      : seed,
+    }
+    dataUniform = MC_SAMPLE_CACHE.loadOrGenerate(MC_SAMPLE_CACHE.fileName("phaseSpaceUniform", config), treeName,
+      lambda fileName: writePoints(genPointsUniform(nmbEvents, seed), treeName, fileName, ["theta", "phi", "Phi"]),
+      regenerateData)
+    return weightWithEfficiency(dataUniform, efficiencyFcn)
+  config = {
+    "generator"         : "acceptRejectMt" if ROOT.IsImplicitMTEnabled() else "acceptReject",
+    "efficiencyFormula" : efficiencyFormula,
+    "nmbEvents"         : nmbEvents,
+    "seed"              : seed,
+  }
+  return MC_SAMPLE_CACHE.loadOrGenerate(MC_SAMPLE_CACHE.fileName(efficiencyFcn.GetName(), config), treeName,
+    lambda fileName: writePoints(genPointsAcceptReject(efficiencyFcn, nmbEvents, seed), treeName, fileName, ["theta", "phi", "Phi"]),
+    regenerateData)
+
+
+def genPointsUniform(
+  nmbPoints: int,  # number of points to generate
+  seed:      int,  # seed for random-number generator
+) -> Dict[str, np.ndarray]:
+  """Generates uniformly distributed random points; returns columns 'cosTheta', 'phiDeg', and 'PhiDeg'"""
+  rng = np.random.default_rng(seed)
+  return {
+    "cosTheta" : rng.uniform(  -1,   +1, nmbPoints),
+    "phiDeg"   : rng.uniform(-180, +180, nmbPoints),
+    "PhiDeg"   : rng.uniform(-180, +180, nmbPoints),
+  }
+
+
+def weightWithEfficiency(
+  data:          ROOT.RDataFrame,  # data with columns 'theta', 'phi', and 'Phi'
+  efficiencyFcn: ROOT.TF3,         # detection efficiency in x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg
+) -> ROOT.RDataFrame:
+  """Returns in-memory RDataFrame with columns 'theta', 'phi', 'Phi', and 'eventWeight', where the event weights are the values of the efficiency function"""
+  RootUtilities.loadKernels()
+  columns = data.AsNumpy(columns = ["theta", "phi", "Phi"])
+  columns["eventWeight"] = np.asarray(ROOT.evalTF3(efficiencyFcn, np.cos(columns["theta"]), np.degrees(columns["phi"]), np.degrees(columns["Phi"])))
+  print(f"Weighted {len(columns['eventWeight'])} events with efficiency '{efficiencyFcn.GetName()}'; sum of weights = {np.sum(columns['eventWeight'])}")
+  return ROOT.RDF.FromNumpy(columns)
 
 
 if __name__ == "__main__":
   printGitInfo()
-  OpenMp.setNmbOpenMpThreads(5)
   ROOT.gROOT.SetBatch(True)
   ROOT.gRandom.SetSeed(1234567890)
-  # ROOT.EnableImplicitMT(10)
+  ROOT.EnableImplicitMT()
   PlottingUtilities.setupPlotStyle()
+  RootUtilities.loadKernels()
+  threadSettingsSave = AutoTuner.autoTune()  # limits OpenMP, BLAS, and ROOT IMT threads and sets OpenMP schedule according to tuning profile of this host; calibrate beforehand by running AutoTuner.py
   ROOT.gBenchmark.Start("Total execution time")
 
   # set parameters of test case
   plotDirName = "./plots"
   nmbPwaMcEvents = 1000
   nmbPsMcEvents = 1000000
+  weightedPsMcEvents = False  # if set, uniform phase-space MC data are generated only once and the efficiency is carried as per-event weight
   beamPolarization = 1.0
   partialWaveAmplitudes = [  # set of all possible waves up to ell = 2
     # negative-reflectivity waves
@@ -235,7 +405,7 @@ if __name__ == "__main__":
   ROOT.gBenchmark.Start("Time to generate MC data from partial waves")
   HTrue: MomentCalculator.MomentResult = amplitudeSet.photoProdMomentSet(maxL)
   print(f"True moment values\n{HTrue}")
-  dataPwaModel = genDataFromWaves(nmbPwaMcEvents, beamPolarization, amplitudeSet, efficiencyFormulaGen, pdfFileNamePrefix = f"{plotDirName}/", regenerateData = True)
+  dataPwaModel = genDataFromWaves(nmbPwaMcEvents, beamPolarization, amplitudeSet, efficiencyFormulaGen, pdfFileNamePrefix = f"{plotDirName}/")
   ROOT.gBenchmark.Stop("Time to generate MC data from partial waves")
 
   # plot data generated from partial-wave amplitudes
@@ -253,7 +423,7 @@ if __name__ == "__main__":
 
   # generate accepted phase-space data
   ROOT.gBenchmark.Start("Time to generate phase-space MC data")
-  dataAcceptedPs = genAccepted2BodyPsPhotoProd(nmbPsMcEvents, efficiencyFormulaReco, pdfFileNamePrefix = f"{plotDirName}/", regenerateData = True)
+  dataAcceptedPs = genAccepted2BodyPsPhotoProd(nmbPsMcEvents, efficiencyFormulaReco, pdfFileNamePrefix = f"{plotDirName}/", weightedEvents = weightedPsMcEvents)
   ROOT.gBenchmark.Stop("Time to generate phase-space MC data")
 
   # setup moment calculator
@@ -268,9 +438,13 @@ if __name__ == "__main__":
     momentsInBins.append     (MomentCalculator.MomentCalculator(momentIndices, dataSet, _binCenters = {binVarMass : massBinCenter}))
     # dummy truth values; identical for all bins
     momentsInBinsTruth.append(MomentCalculator.MomentCalculator(momentIndices, dataSet, _binCenters = {binVarMass : massBinCenter}, _HPhys = HTrue))
-  moments      = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBins)
+  profiler     = ProfilingUtilities.Profiler()  # records time and memory consumption of the stages of the moment calculation
+  moments      = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBins, profiler = profiler)
   momentsTruth = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBinsTruth)
 
+  moments.planMemory()  # fail early if the calculation does not fit into the memory budget; RDataFrame inputs are planned when their columns are read, which avoids an extra event loop per bin
+  renderQueue = RenderQueue.RenderQueue(cacheFileName = f"{plotDirName}/.renderCache.json", bundleDir = plotDirName)  # plots are rendered in parallel after the calculation; set MOMENTS_PLOT_OUTPUT=pdf or zip to bundle them
+
   # calculate integral matrix
   ROOT.gBenchmark.Start(f"Time to calculate integral matrices using {nmbOpenMpThreads} OpenMP threads")
   moments.calculateIntegralMatrices(forceCalculation = True)
@@ -281,8 +455,8 @@ if __name__ == "__main__":
   # plot acceptance integral matrices for all kinematic bins
   for HData in moments:
     binLabel = "_".join(HData.fileNameBinLabels)
-    PlottingUtilities.plotComplexMatrix(moments[0].integralMatrix.matrixNormalized, pdfFileNamePrefix = f"{plotDirName}/I_acc_{binLabel}")
-    PlottingUtilities.plotComplexMatrix(moments[0].integralMatrix.inverse,          pdfFileNamePrefix = f"{plotDirName}/I_inv_{binLabel}")
+    renderQueue.add("plotComplexMatrix", matrix = moments[0].integralMatrix.matrixNormalized, pdfFileNamePrefix = f"{plotDirName}/I_acc_{binLabel}")
+    renderQueue.add("plotComplexMatrix", matrix = moments[0].integralMatrix.inverse,          pdfFileNamePrefix = f"{plotDirName}/I_inv_{binLabel}")
   ROOT.gBenchmark.Stop(f"Time to calculate integral matrices using {nmbOpenMpThreads} OpenMP threads")
 
   # calculate moments of data generated from partial-wave amplitudes
@@ -294,15 +468,30 @@ if __name__ == "__main__":
   # plot moments in each kinematic bin
   for HData in moments:
     binLabel = "_".join(HData.fileNameBinLabels)
-    PlottingUtilities.plotMomentsInBin(HData = moments[0].HPhys, HTrue = HTrue, pdfFileNamePrefix = f"{plotDirName}/h{binLabel}_")
+    PlottingUtilities.plotMomentsInBin(HData = moments[0].HPhys, HTrue = HTrue, pdfFileNamePrefix = f"{plotDirName}/h{binLabel}_", renderQueue = renderQueue)
   # plot kinematic dependences of all moments #TODO normalize H_0(0, 0) to total number of events
   for qnIndex in momentIndices.QnIndices():
-    PlottingUtilities.plotMoments1D(moments, qnIndex, massBinning, momentsTruth, pdfFileNamePrefix = f"{plotDirName}/h")
+    PlottingUtilities.plotMoments1D(moments, qnIndex, massBinning, momentsTruth, pdfFileNamePrefix = f"{plotDirName}/h", renderQueue = renderQueue)
+  # compare moments with true values in all kinematic bins; the pulls and chi^2 values do not require the plots
+  comparison = MomentComparison.compareMoments(moments, momentsTruth)
+  print(f"Comparison of physical moments with true values\n{comparison.summary()}")
+  comparison.toJson(f"{plotDirName}/pulls.json")
   ROOT.gBenchmark.Stop(f"Time to calculate moments using {nmbOpenMpThreads} OpenMP threads")
 
+  # render all queued plots; the saved queue allows to re-render the plots without repeating the calculation
+  ROOT.gBenchmark.Start("Time to render plots")
+  renderQueue.save(f"{plotDirName}/renderQueue.pkl")
+  renderQueue.render()
+  ROOT.gBenchmark.Stop("Time to render plots")
+
   ROOT.gBenchmark.Stop("Total execution time")
   _ = ctypes.c_float(0.0)  # dummy argument required by ROOT; sigh
   ROOT.gBenchmark.Summary(_, _)
   print("!Note! the 'TOTAL' time above is wrong; ignore")
+  print(f"Profile of moment calculation\n{profiler.summaryTable(byBin = True)}")
+  profiler.toJson(f"{plotDirName}/profile.json")
+  profiler.toCsv (f"{plotDirName}/profile.csv")
+  if KernelLibrary.kernels().instrumented:
+    print(f"Hot-path counters of kernels\n{KernelLibrary.kernels().kernelCountersSummary()}")
 
-  OpenMp.restoreNmbOpenMpThreads()
+  OpenMp.restoreThreadSettings(threadSettingsSave)
@@ -11,14 +11,19 @@ from typing import List
 
 import ROOT
 
+import AutoTuner
+import KernelLibrary
 import MomentCalculator
+import MomentComparison
 import OpenMp
 from PlottingUtilities import (
   HistAxisBinning,
-  plotComplexMatrix,
   plotMomentsInBin,
   setupPlotStyle,
 )
+import ProfilingUtilities
+import RenderQueue
+import RootUtilities
 import testMomentsPhotoProd
 
 
@@ -35,11 +40,12 @@ def printGitInfo() -> None:
 
 if __name__ == "__main__":
   printGitInfo()
-  OpenMp.setNmbOpenMpThreads(5)
   ROOT.gROOT.SetBatch(True)
   ROOT.gRandom.SetSeed(1234567890)
-  # ROOT.EnableImplicitMT(10)
+  ROOT.EnableImplicitMT()
   setupPlotStyle()
+  RootUtilities.loadKernels()
+  threadSettingsSave = AutoTuner.autoTune()  # limits OpenMP, BLAS, and ROOT IMT threads and sets OpenMP schedule according to tuning profile of this host; calibrate beforehand by running AutoTuner.py
   ROOT.gBenchmark.Start("Total execution time")
 
   # set parameters of test case
@@ -111,29 +117,63 @@ if __name__ == "__main__":
   HTrueSig: MomentCalculator.MomentResult = amplitudeSetSig.photoProdMomentSet(maxL)
   print(f"True moment values for signal:\n{HTrueSig}")
   dataPwaModelSig: ROOT.RDataFrame = testMomentsPhotoProd.genDataFromWaves(
-    nmbPwaMcEventsSig, beamPolarization, amplitudeSetSig, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/", nameSuffix = "Sig", regenerateData = True)
-  dataPwaModelSig = dataPwaModelSig.Define("discrVariable", "gRandom->Gaus(0, 0.1)")
+    nmbPwaMcEventsSig, beamPolarization, amplitudeSetSig, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/", nameSuffix = "Sig")
+  # random numbers are derived from entry number, which requires single-threaded event loop
+  dataPwaModelSig = dataPwaModelSig.Define("discrVariable", f"gausRandom({ROOT.gRandom.Integer(2**31)}, rdfentry_, 0, 0.1)")
   treeName = "data"
   fileNameSig = f"intensitySig.photoProd.root"
-  dataPwaModelSig.Snapshot(treeName, fileNameSig)
+  with RootUtilities.implicitMtDisabled():
+    dataPwaModelSig.Snapshot(treeName, fileNameSig)
   dataPwaModelSig = ROOT.RDataFrame(treeName, fileNameSig)
-  histDiscrSig = dataPwaModelSig.Histo1D(ROOT.RDF.TH1DModel("Signal", ";Discriminatory variable;Count / 0.02", 100, -1, +1), "discrVariable").GetValue()
   # generate background distribution
   HTrueBkg: MomentCalculator.MomentResult = amplitudeSetBkg.photoProdMomentSet(maxL)
   print(f"True moment values for signal:\n{HTrueBkg}")
   dataPwaModelBkg: ROOT.RDataFrame = testMomentsPhotoProd.genDataFromWaves(
-    nmbPwaMcEventsBkg, beamPolarization, amplitudeSetBkg, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/", nameSuffix = "Bkg", regenerateData = True)
-  dataPwaModelBkg = dataPwaModelBkg.Define("discrVariable", "gRandom->Uniform(0, 2) - 1")
+    nmbPwaMcEventsBkg, beamPolarization, amplitudeSetBkg, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/", nameSuffix = "Bkg")
+  dataPwaModelBkg = dataPwaModelBkg.Define("discrVariable", f"uniformRandom({ROOT.gRandom.Integer(2**31)}, rdfentry_, -1, +1)")
   fileNameBkg = f"intensityBkg.photoProd.root"
-  dataPwaModelBkg.Snapshot(treeName, fileNameBkg)
+  with RootUtilities.implicitMtDisabled():
+    dataPwaModelBkg.Snapshot(treeName, fileNameBkg)
   dataPwaModelBkg = ROOT.RDataFrame(treeName, fileNameBkg)
-  histDiscrBkg = dataPwaModelBkg.Histo1D(ROOT.RDF.TH1DModel("Background", ";Discriminatory variable;Count / 0.02", 100, -1, +1), "discrVariable").GetValue()
   # concatenate signal and background data frames vertically
   dataPwaModel = ROOT.RDataFrame(treeName, (fileNameSig, fileNameBkg))
-  # plot discriminatory variable
   signalRange = (-0.3, +0.3)
   sideBands   = ((-1, -0.4), (+0.4, +1))
-  histDiscr = dataPwaModel.Histo1D(ROOT.RDF.TH1DModel("Total", ";Discriminatory variable;Count / 0.02", 100, -1, +1), "discrVariable").GetValue()
+  # define event weights
+  dataPwaModel = dataPwaModel.Define("eventWeight", f"""
+    if (({signalRange[0]} < discrVariable) and (discrVariable < {signalRange[1]}))
+      return 1.0;
+    else if (   (({sideBands[0][0]} < discrVariable) and (discrVariable < {sideBands[0][1]}))
+             or (({sideBands[1][0]} < discrVariable) and (discrVariable < {sideBands[1][1]})))
+      return -0.5;
+    else
+      return 0.0;
+  """)
+  # book all diagnostic histograms and sums up front, so that each data frame is read only once
+  diagnostics = RootUtilities.RdfDiagnostics()
+  discrModel = lambda name: ROOT.RDF.TH1DModel(name, ";Discriminatory variable;Count / 0.02", 100, -1, +1)
+  diagnostics.book("Signal",                   dataPwaModelSig.Histo1D(discrModel("Signal"),                   "discrVariable"))
+  diagnostics.book("Background",               dataPwaModelBkg.Histo1D(discrModel("Background"),               "discrVariable"))
+  diagnostics.book("Total",                    dataPwaModel.Histo1D   (discrModel("Total"),                    "discrVariable"))
+  diagnostics.book("hDiscrVariableSimSbSubtr", dataPwaModel.Histo1D   (discrModel("hDiscrVariableSimSbSubtr"), "discrVariable", "eventWeight"))
+  nmbBins = testMomentsPhotoProd.TH3_NMB_BINS
+  histBinning = (nmbBins, -1, +1, nmbBins, -180, +180, nmbBins, -180, +180)
+  diagnostics.book("dataSig",
+    dataPwaModelSig.Filter(f"({signalRange[0]} < discrVariable) and (discrVariable < {signalRange[1]})").Histo3D(
+                            ROOT.RDF.TH3DModel("dataSig",     testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"))
+  diagnostics.book("dataBkg",
+    dataPwaModelBkg.Filter(f"(({sideBands[0][0]} < discrVariable) and (discrVariable < {sideBands[0][1]}))"
+                        f"or (({sideBands[1][0]} < discrVariable) and (discrVariable < {sideBands[1][1]}))").Histo3D(
+                            ROOT.RDF.TH3DModel("dataBkg",     testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"))
+  diagnostics.book("data",        dataPwaModel.Histo3D(ROOT.RDF.TH3DModel("data",        testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"))
+  diagnostics.book("dataSbSubtr", dataPwaModel.Histo3D(ROOT.RDF.TH3DModel("dataSbSubtr", testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg", "eventWeight"))
+  diagnostics.book("sumOfWeights", dataPwaModel.Sum("eventWeight"))
+  # fill all booked results in one event loop per data frame
+  diagnostics.run()
+  # plot discriminatory variable
+  histDiscrSig = diagnostics["Signal"]
+  histDiscrBkg = diagnostics["Background"]
+  histDiscr    = diagnostics["Total"]
   histDiscr.SetLineWidth(2)
   histDiscrSig.SetLineColor(ROOT.kGreen + 2)
   histDiscrBkg.SetLineColor(ROOT.kRed   + 1)
@@ -154,35 +194,14 @@ if __name__ == "__main__":
     box.DrawBox(bounds[0], canv.GetUymin(), bounds[1], canv.GetUymax())
   legend.Draw()
   canv.SaveAs(f"{plotDirName}/{histStack.GetName()}.pdf")
-  # define event weights
-  dataPwaModel = dataPwaModel.Define("eventWeight", f"""
-    if (({signalRange[0]} < discrVariable) and (discrVariable < {signalRange[1]}))
-      return 1.0;
-    else if (   (({sideBands[0][0]} < discrVariable) and (discrVariable < {sideBands[0][1]}))
-             or (({sideBands[1][0]} < discrVariable) and (discrVariable < {sideBands[1][1]})))
-      return -0.5;
-    else
-      return 0.0;
-  """)
-  hist = dataPwaModel.Histo1D(ROOT.RDF.TH1DModel("hDiscrVariableSimSbSubtr", ";Discriminatory variable;Count / 0.02", 100, -1, +1), "discrVariable", "eventWeight")
+  hist = diagnostics["hDiscrVariableSimSbSubtr"]
   hist.Draw()
   canv.SaveAs(f"{plotDirName}/{hist.GetName()}.pdf")
   ROOT.gBenchmark.Stop("Time to generate MC data from partial waves")
   # raise ValueError
 
   # plot angular distributions of data generated from partial-wave amplitudes
-  nmbBins = testMomentsPhotoProd.TH3_NMB_BINS
-  histBinning = (nmbBins, -1, +1, nmbBins, -180, +180, nmbBins, -180, +180)
-  hists = (
-    dataPwaModelSig.Filter(f"({signalRange[0]} < discrVariable) and (discrVariable < {signalRange[1]})").Histo3D(
-                            ROOT.RDF.TH3DModel("dataSig",     testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"),
-    dataPwaModelBkg.Filter(f"(({sideBands[0][0]} < discrVariable) and (discrVariable < {sideBands[0][1]}))"
-                        f"or (({sideBands[1][0]} < discrVariable) and (discrVariable < {sideBands[1][1]}))").Histo3D(
-                            ROOT.RDF.TH3DModel("dataBkg",     testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"),
-    dataPwaModel.Histo3D(ROOT.RDF.TH3DModel("data",        testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg"),
-    dataPwaModel.Histo3D(ROOT.RDF.TH3DModel("dataSbSubtr", testMomentsPhotoProd.TH3_TITLE, *histBinning), "cosTheta", "phiDeg", "PhiDeg", "eventWeight"),
-  )
-  for hist in hists:
+  for hist in (diagnostics[name] for name in ("dataSig", "dataBkg", "data", "dataSbSubtr")):
     hist.SetMinimum(0)
     hist.GetXaxis().SetTitleOffset(1.5)
     hist.GetYaxis().SetTitleOffset(2)
@@ -190,12 +209,12 @@ if __name__ == "__main__":
     hist.Draw("BOX2Z")
     print(f"Integral of histogram '{hist.GetName()}' = {hist.Integral()}")
     canv.SaveAs(f"{plotDirName}/{hist.GetName()}.pdf")
-  print(f"Sum of weights = {dataPwaModel.Sum('eventWeight').GetValue()}")
+  print(f"Sum of weights = {diagnostics['sumOfWeights']}")
   # raise ValueError
 
   # generate accepted phase-space data
   ROOT.gBenchmark.Start("Time to generate phase-space MC data")
-  dataAcceptedPs = testMomentsPhotoProd.genAccepted2BodyPsPhotoProd(nmbAcceptedPsMcEvents, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/", regenerateData = True)
+  dataAcceptedPs = testMomentsPhotoProd.genAccepted2BodyPsPhotoProd(nmbAcceptedPsMcEvents, efficiencyFormula, pdfFileNamePrefix = f"{plotDirName}/")
   ROOT.gBenchmark.Stop("Time to generate phase-space MC data")
 
   # define input data
@@ -217,9 +236,13 @@ if __name__ == "__main__":
     momentsInBins.append(MomentCalculator.MomentCalculator(momentIndices, dataSet, _binCenters = {binVarMass : massBinCenter}))
     # dummy truth values; identical for all bins
     momentsInBinsTruth.append(MomentCalculator.MomentCalculator(momentIndices, dataSet, _binCenters = {binVarMass : massBinCenter}, _HPhys = HTrue))
-  moments      = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBins)
+  profiler     = ProfilingUtilities.Profiler()  # records time and memory consumption of the stages of the moment calculation
+  moments      = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBins, profiler = profiler)
   momentsTruth = MomentCalculator.MomentCalculatorsKinematicBinning(momentsInBinsTruth)
 
+  moments.planMemory()  # fail early if the calculation does not fit into the memory budget; RDataFrame inputs are planned when their columns are read, which avoids an extra event loop per bin
+  renderQueue = RenderQueue.RenderQueue(cacheFileName = f"{plotDirName}/.renderCache.json", bundleDir = plotDirName)  # plots are rendered in parallel after the calculation; set MOMENTS_PLOT_OUTPUT=pdf or zip to bundle them
+
   # calculate integral matrix
   ROOT.gBenchmark.Start(f"Time to calculate integral matrices using {nmbOpenMpThreads} OpenMP threads")
   moments.calculateIntegralMatrices(forceCalculation = True)
@@ -230,8 +253,8 @@ if __name__ == "__main__":
   # plot acceptance integral matrices for all kinematic bins
   for HData in moments:
     binLabel = "_".join(HData.fileNameBinLabels)
-    plotComplexMatrix(moments[0].integralMatrix.matrixNormalized, pdfFileNamePrefix = f"{plotDirName}/I_acc_{binLabel}")
-    plotComplexMatrix(moments[0].integralMatrix.inverse,          pdfFileNamePrefix = f"{plotDirName}/I_inv_{binLabel}")
+    renderQueue.add("plotComplexMatrix", matrix = moments[0].integralMatrix.matrixNormalized, pdfFileNamePrefix = f"{plotDirName}/I_acc_{binLabel}")
+    renderQueue.add("plotComplexMatrix", matrix = moments[0].integralMatrix.inverse,          pdfFileNamePrefix = f"{plotDirName}/I_inv_{binLabel}")
   ROOT.gBenchmark.Stop(f"Time to calculate integral matrices using {nmbOpenMpThreads} OpenMP threads")
 
   # calculate moments of data generated from partial-wave amplitudes
@@ -243,12 +266,27 @@ if __name__ == "__main__":
   # plot moments in each kinematic bin
   for HData in moments:
     binLabel = "_".join(HData.fileNameBinLabels)
-    plotMomentsInBin(HData = moments[0].HPhys, HTrue = HTrue, pdfFileNamePrefix = f"{plotDirName}/h{binLabel}_")
+    plotMomentsInBin(HData = moments[0].HPhys, HTrue = HTrue, pdfFileNamePrefix = f"{plotDirName}/h{binLabel}_", renderQueue = renderQueue)
+  # compare moments with true values in all kinematic bins; the pulls and chi^2 values do not require the plots
+  comparison = MomentComparison.compareMoments(moments, momentsTruth)
+  print(f"Comparison of physical moments with true values\n{comparison.summary()}")
+  comparison.toJson(f"{plotDirName}/pulls.json")
   ROOT.gBenchmark.Stop(f"Time to calculate moments using {nmbOpenMpThreads} OpenMP threads")
 
+  # render all queued plots; the saved queue allows to re-render the plots without repeating the calculation
+  ROOT.gBenchmark.Start("Time to render plots")
+  renderQueue.save(f"{plotDirName}/renderQueue.pkl")
+  renderQueue.render()
+  ROOT.gBenchmark.Stop("Time to render plots")
+
   ROOT.gBenchmark.Stop("Total execution time")
   _ = ctypes.c_float(0.0)  # dummy argument required by ROOT; sigh
   ROOT.gBenchmark.Summary(_, _)
   print("!Note! the 'TOTAL' time above is wrong; ignore")
+  print(f"Profile of moment calculation\n{profiler.summaryTable(byBin = True)}")
+  profiler.toJson(f"{plotDirName}/profile.json")
+  profiler.toCsv (f"{plotDirName}/profile.csv")
+  if KernelLibrary.kernels().instrumented:
+    print(f"Hot-path counters of kernels\n{KernelLibrary.kernels().kernelCountersSummary()}")
 
-  OpenMp.restoreNmbOpenMpThreads()
+  OpenMp.restoreThreadSettings(threadSettingsSave)
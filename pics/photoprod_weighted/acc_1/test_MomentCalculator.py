@@ -0,0 +1,58 @@
+"""Tests for MomentCalculator; the kernel library is built on first use, which requires ROOT"""
+
+import dataclasses
+import pathlib
+
+import numpy as np
+import pytest
+
+import KernelLibrary
+import MomentCalculator
+
+
+@pytest.fixture(scope = "module", autouse = True)
+def kernels() -> None:
+  """Skips tests if the kernel library cannot be built"""
+  try:
+    KernelLibrary.kernels()
+  except RuntimeError as e:
+    pytest.skip(f"Kernel library not available: {e}")
+
+
+def _dataSet(
+  rng:      np.random.Generator,
+  weighted: bool,  # if set, the phase-space data have a column 'eventWeight'
+) -> MomentCalculator.DataSet:
+  """Returns dataset with uniformly distributed angles"""
+  def angles(nmbEvents: int) -> dict:
+    return {"theta" : np.arccos(rng.uniform(-1, 1, nmbEvents)), "phi" : rng.uniform(-np.pi, np.pi, nmbEvents), "Phi" : rng.uniform(-np.pi, np.pi, nmbEvents)}
+  phaseSpaceData = angles(2000)
+  if weighted:
+    phaseSpaceData["eventWeight"] = rng.uniform(0.2, 1.5, 2000)
+  return MomentCalculator.DataSet(polarization = 0.3, data = angles(100), phaseSpaceData = phaseSpaceData, nmbGenEvents = 5000)
+
+
+@pytest.mark.parametrize("realValued", (False, True))
+@pytest.mark.parametrize("weighted",   (False, True))
+def testAcceptedPhaseSpaceMomentsFromHarmonicSums(
+  realValued:  bool,
+  weighted:    bool,
+  tmp_path:    pathlib.Path,
+  monkeypatch: pytest.MonkeyPatch,
+) -> None:
+  """Moments of accepted phase-space data and their covariances obtained from the sums of the integral matrix agree with the ones calculated from the events"""
+  monkeypatch.chdir(tmp_path)  # integral matrices are written to the current directory
+  for seed in range(10):  # roundoff of random sign made the variance of H_0(0, 0) negative in some samples
+    dataSet = _dataSet(np.random.default_rng(seed), weighted)
+    momentCalculator = MomentCalculator.MomentCalculator(MomentCalculator.MomentIndices(maxL = 3), dataSet, realValued = realValued)
+    momentCalculator.calculateIntegralMatrix(forceCalculation = True)
+    assert momentCalculator.integralMatrix.hasHarmonicSums
+    HMeasVals,     V_meas     = momentCalculator.integralMatrix.phaseSpaceMeasMoments(dataSet.polarization)
+    HMeasValsData, V_measData = momentCalculator._calcMeasMomentsFromData(dataclasses.replace(dataSet, data = dataSet.phaseSpaceData))
+    assert np.allclose(HMeasVals, HMeasValsData, rtol = 1e-12, atol = 1e-12 * np.max(np.abs(HMeasValsData)))
+    assert np.allclose(V_meas,    V_measData,    rtol = 1e-10, atol = 1e-12 * np.max(np.abs(V_measData)))
+    # basis function of H_0(0, 0) is constant
+    assert V_meas[0, 0] == 0 and V_measData[0, 0] == 0
+    momentCalculator.calculateMoments(MomentCalculator.MomentCalculator.MomentDataSource.ACCEPTED_PHASE_SPACE)
+    assert np.all(np.isfinite(np.sqrt(np.diag(momentCalculator.HPhys._covReReFlatIndex))))
+    assert np.all(np.isfinite(np.sqrt(np.diag(momentCalculator.HPhys._covImImFlatIndex))))
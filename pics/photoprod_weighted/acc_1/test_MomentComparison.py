@@ -0,0 +1,58 @@
+"""Tests for MomentComparison"""
+
+import numpy as np
+
+import MomentCalculator
+import MomentComparison
+
+
+def _momentsInBins(
+  realValued: bool,  # if set, moments are given in the real-valued layout
+  nmbBins:    int = 3,
+) -> MomentCalculator.MomentCalculatorsKinematicBinning:
+  """Returns moments with random values and diagonal covariances in the given number of kinematic bins"""
+  rng      = np.random.default_rng(12345)
+  indices  = MomentCalculator.MomentIndices(maxL = 2)
+  massVar  = MomentCalculator.KinematicBinningVariable(name = "mass", label = "m", unit = "GeV", nmbDigits = 2)
+  dataSet  = MomentCalculator.DataSet(polarization = 1.0, data = {}, phaseSpaceData = {}, nmbGenEvents = 0)
+  moments: list = []
+  for binIndex in range(nmbBins):
+    momentsInBin = MomentCalculator.MomentCalculator(indices, dataSet, _binCenters = {massVar : 1.0 + binIndex}, realValued = realValued)
+    HPhysReal = MomentCalculator.MomentResultReal(indices)
+    HPhysReal._valsFlatIndex = rng.normal(size = len(indices))
+    HPhysReal._covFlatIndex  = np.diag(rng.uniform(0.5, 2, size = len(indices)))
+    if realValued:
+      momentsInBin._HPhys = HPhysReal.toComplex()
+    else:
+      HPhys = HPhysReal.toComplex()
+      HPhys._valsFlatIndex    += 1j * rng.normal(size = len(indices))  # imaginary parts of H_0 and H_1 are nonzero in the complex-valued layout
+      HPhys._covImImFlatIndex += np.diag(rng.uniform(0.5, 2, size = len(indices)))
+      HPhys._covReReFlatIndex += np.diag(rng.uniform(0.5, 2, size = len(indices)))
+      momentsInBin._HPhys = HPhys
+    moments.append(momentsInBin)
+  return MomentCalculator.MomentCalculatorsKinematicBinning(moments)
+
+
+def testNdfComplexValued() -> None:
+  """All parts except the ones of H_0(0, 0) count as degrees of freedom"""
+  moments    = _momentsInBins(realValued = False)
+  truth      = MomentCalculator.MomentResult(moments[0].indices)
+  comparison = MomentComparison.compareMoments(moments, truth)
+  assert int(comparison.chi2Total().ndf) == len(moments) * 2 * (len(moments[0].indices) - 1)
+
+
+def testNdfRealValued() -> None:
+  """Only the parts of the real-valued layout count as degrees of freedom; the parts that are zero by construction are masked"""
+  moments    = _momentsInBins(realValued = True)
+  indices    = moments[0].indices
+  truth      = MomentCalculator.MomentResult(indices)
+  comparison = MomentComparison.compareMoments(moments, truth)
+  assert int(comparison.chi2Total().ndf) == len(moments) * (len(indices) - 1)
+  imag = indices.imagPartFlags
+  assert np.all(comparison.pulls.mask[:, 0, imag]) and np.all(comparison.pulls.mask[:, 1, ~imag])
+  # chi^2 is the sum of squared pulls of the real-valued layout
+  H000 = np.array([qnIndex == MomentCalculator.QnMomentIndex(momentIndex = 0, L = 0, M = 0) for qnIndex in indices.QnIndices()])
+  expectedChi2 = sum(np.sum(np.where(H000, 0, MomentCalculator.MomentResultReal.fromComplex(momentsInBin.HPhys)._valsFlatIndex**2
+                                     / np.diag(MomentCalculator.MomentResultReal.fromComplex(momentsInBin.HPhys)._covFlatIndex))) for momentsInBin in moments)
+  assert np.isclose(float(comparison.chi2Total().chi2), expectedChi2)
+  assert np.all(comparison.chi2PerBin().ndf[:, 0, 2] == 0) and np.all(np.isnan(comparison.chi2PerBin().pValue[:, 0, 2]))
@@ -0,0 +1,680 @@
+// declarations of the C++ kernels implemented in wignerD.C
+// the kernels are built into a shared library (see KernelLibrary.py); this header makes them known to the ROOT interpreter
+
+#ifndef WIGNERD_H
+#define WIGNERD_H
+
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <complex>
+#include <cstdint>
+#include <cstdlib>
+#include <iostream>
+#include <map>
+#include <memory>
+#include <omp.h>
+#include <tuple>
+#include <vector>
+
+#include "Math/SpecFuncMathMore.h"
+#include "TF3.h"
+#include "TMath.h"
+
+
+// need typedef because templates are not allowed in TFormula expressions
+// see https://root-forum.cern.ch/t/trying-to-define-imaginary-error-function/50032/10
+typedef std::complex<double> complexT;
+
+
+const std::complex<double> I = std::complex<double>(0, 1);
+
+
+// test OpenMP compilation and thread spawning
+void
+testOpenMp();
+
+
+// returns number of threads used by OpenMP
+// number of threads can be controlled by setting the environment variable OMP_NUM_THREADS
+int
+getNmbOpenMpThreads();
+
+
+// function that calculates (-1)^n
+inline
+int
+powMinusOne(const int exponent)
+{
+	if (exponent & 0x1)  // exponent is odd
+		return -1;
+	else                 // exponent is even
+		return +1;
+}
+
+
+// table of ln(n!) for 0 <= n < size; for larger n std::lgamma is used
+// using logarithms avoids the overflow of factorials and of their products for large spins
+inline
+double
+logFactorial(const int n)
+{
+	static const std::vector<double> table = [] {
+		std::vector<double> values(1024, 0);
+		for (size_t i = 1; i < values.size(); ++i) {
+			values[i] = values[i - 1] + std::log((double)i);
+		}
+		return values;
+	}();  // thread-safe initialization
+	return ((size_t)n < table.size()) ? table[n] : std::lgamma(n + 1.0);
+}
+
+
+// optional instrumentation of the batch kernels
+// if WIGNERD_INSTRUMENT is defined, the number of calls and events, the time each OpenMP thread spends in the event loop,
+// and the time spent in sph_legendre and in trigonometric functions are recorded; otherwise all hooks compile to nothing
+// the counters can be read via the C interface (see KernelLibrary.KernelBinding.kernelCounters())
+// !Note! counters are indexed by the OpenMP thread number; they are not reliable if kernels are called concurrently from several host threads
+enum KernelId { KERNEL_YLM_RE_IM_TABLE = 0, KERNEL_F_PHYS, KERNEL_F_PHYS_REAL, KERNEL_F_MEAS, KERNEL_F_MEAS_REAL, KERNEL_INTENSITY_PHOTOPROD, KERNEL_WIGNERD_REFL_CONJ, KERNEL_WIGNERD, NMB_KERNELS };
+enum TimerId  { TIMER_SPH_LEGENDRE = 0, TIMER_TRIG, NMB_TIMERS };
+const int MAX_NMB_INSTRUMENTED_THREADS = 256;
+
+#ifdef WIGNERD_INSTRUMENT
+
+// per-thread accumulators for the timed functions; aligned to cache lines to avoid false sharing
+struct alignas(64) ThreadTimers {
+	double   time [NMB_TIMERS];  // [s]
+	uint64_t count[NMB_TIMERS];
+};
+extern ThreadTimers threadTimers[MAX_NMB_INSTRUMENTED_THREADS];
+
+// adds time between construction and destruction to the accumulator of the calling thread
+class ScopeTimer {
+
+public:
+
+	explicit ScopeTimer(const TimerId id)
+		: _id   (id),
+		  _start(std::chrono::steady_clock::now())
+	{ }
+
+	~ScopeTimer()
+	{
+		const int threadId = omp_get_thread_num();
+		if (threadId < MAX_NMB_INSTRUMENTED_THREADS) {
+			threadTimers[threadId].time [_id] += std::chrono::duration<double>(std::chrono::steady_clock::now() - _start).count();
+			threadTimers[threadId].count[_id] += 1;
+		}
+	}
+
+private:
+
+	const TimerId                                            _id;
+	const std::chrono::time_point<std::chrono::steady_clock> _start;
+
+};
+
+#define WIGNERD_SCOPE_TIMER(timerId) const ScopeTimer scopeTimer(timerId)
+
+#else
+
+#define WIGNERD_SCOPE_TIMER(timerId)
+
+#endif  // WIGNERD_INSTRUMENT
+
+
+// trigonometric functions used by the basis functions; timed if WIGNERD_INSTRUMENT is defined
+inline
+double
+cosTimed(const double x)
+{
+	WIGNERD_SCOPE_TIMER(TIMER_TRIG);
+	return std::cos(x);
+}
+
+inline
+double
+sinTimed(const double x)
+{
+	WIGNERD_SCOPE_TIMER(TIMER_TRIG);
+	return std::sin(x);
+}
+
+// exp(i x)
+inline
+std::complex<double>
+expITimed(const double x)
+{
+	WIGNERD_SCOPE_TIMER(TIMER_TRIG);
+	return std::exp(std::complex<double>(0, x));
+}
+
+
+// coefficients for evaluation of the small-d function d^J_{M1 M2}(theta) for fixed (J, M1, M2)
+// d^J_{M1 M2}(theta) is expressed in terms of the Jacobi polynomial P^{(a, b)}_n(cos theta)
+//   d^J_{M1 M2}(theta) = sign * sqrt(norm) * sin^a(theta / 2) * cos^b(theta / 2) * P^{(a, b)}_n(cos theta)
+// see e.g. Eq. (3.74) in L. C. Biedenharn and J. D. Louck, Angular Momentum in Quantum Physics (1981)
+// the Jacobi polynomial is evaluated using its three-term recurrence, which is numerically stable for |cos theta| <= 1
+// and avoids the alternating sum over products of factorials, which loses precision for large J
+// !NOTE! quantum numbers J, M1, and M2 are given in units of hbar/2
+class SmallDCoeffs {
+
+public:
+
+	SmallDCoeffs(
+		const int twoJ,
+		const int twoM1,
+		const int twoM2
+	) {
+		// choose the representation in which the polynomial degree n is the smallest of J +- M1 and J +- M2
+		const int jpm1 = (twoJ + twoM1) / 2;
+		const int jmm1 = (twoJ - twoM1) / 2;
+		const int jpm2 = (twoJ + twoM2) / 2;
+		const int jmm2 = (twoJ - twoM2) / 2;
+		_n = std::min(std::min(jpm1, jmm1), std::min(jpm2, jmm2));
+		int lambda;
+		if (_n == jpm2) {
+			_a = (twoM1 - twoM2) / 2;
+			lambda = _a;
+		} else if (_n == jmm2) {
+			_a = (twoM2 - twoM1) / 2;
+			lambda = 0;
+		} else if (_n == jpm1) {
+			_a = (twoM2 - twoM1) / 2;
+			lambda = 0;
+		} else {
+			_a = (twoM1 - twoM2) / 2;
+			lambda = _a;
+		}
+		_b = twoJ - 2 * _n - _a;
+		_sign = powMinusOne(lambda);
+		// logarithm of normalization factor binomial(2J - n, n + a) / binomial(n + b, b)
+		_logNorm = (logFactorial(twoJ - _n) - logFactorial(_n + _a) - logFactorial(twoJ - 2 * _n - _a))
+		         - (logFactorial(_n + _b)   - logFactorial(_b)      - logFactorial(_n));
+		// coefficients of three-term recurrence for Jacobi polynomials
+		//   2 k (k + a + b) (2k + a + b - 2) P_k = (2k + a + b - 1) [(2k + a + b) (2k + a + b - 2) x + a^2 - b^2] P_{k - 1} - 2 (k + a - 1) (k + b - 1) (2k + a + b) P_{k - 2}
+		// are stored as P_k = (c1 x + c0) P_{k - 1} - c2 P_{k - 2}
+		_recurrence.reserve(3 * std::max(_n - 1, 0));
+		for (int k = 2; k <= _n; ++k) {
+			const double twoKab = 2 * k + _a + _b;
+			const double denom  = 2 * k * (k + _a + _b) * (twoKab - 2);
+			_recurrence.push_back((twoKab - 1) * twoKab * (twoKab - 2) / denom);
+			_recurrence.push_back((twoKab - 1) * ((double)_a * _a - (double)_b * _b) / denom);
+			_recurrence.push_back(2 * (k + _a - 1) * (k + _b - 1) * twoKab / denom);
+		}
+	}
+
+	// value of d^J_{M1 M2}(theta) for 0 <= theta <= pi
+	double
+	operator () (const double theta) const
+	{
+		const double x = std::cos(theta);
+		// Jacobi polynomial P^{(a, b)}_n(x)
+		double P = 1;
+		if (_n > 0) {
+			double PPrev = 1;
+			P = (_a + 1) + (_a + _b + 2) * (x - 1) / 2;
+			for (int k = 2; k <= _n; ++k) {
+				const double* c = &_recurrence[3 * (k - 2)];
+				const double PNext = (c[0] * x + c[1]) * P - c[2] * PPrev;
+				PPrev = P;
+				P     = PNext;
+			}
+		}
+		// combine prefactors in log space to avoid overflow and underflow for large J; guard against 0 * log(0)
+		const double sinThetaHalf = std::sin(theta / 2);
+		const double cosThetaHalf = std::cos(theta / 2);
+		const double logFactor = 0.5 * _logNorm
+		                       + ((_a > 0) ? _a * std::log(sinThetaHalf) : 0)
+		                       + ((_b > 0) ? _b * std::log(cosThetaHalf) : 0);
+		return _sign * std::exp(logFactor) * P;
+	}
+
+private:
+
+	int                 _n;           // degree of Jacobi polynomial
+	int                 _a;           // parameters of Jacobi polynomial
+	int                 _b;
+	double              _sign;
+	double              _logNorm;
+	std::vector<double> _recurrence;  // coefficients (c1, c0, c2) of recurrence for k = 2, ..., n
+
+};
+
+// returns coefficients of Wigner d-function for given quantum numbers
+// coefficients are cached per thread and per (J, M1, M2), so that repeated calls do not recalculate them; no locking is needed
+const SmallDCoeffs&
+cachedSmallDCoeffs(
+	const int twoJ,
+	const int twoM1,
+	const int twoM2
+);
+
+
+// Wigner D-function D^J_{M1 M2}^*(phi, theta, 0) in canonical basis
+// !NOTE! quantum numbers J, M1, and M2 are given in units of hbar/2
+std::complex<double>
+wignerD(
+	const int    twoJ,
+	const int    twoM1,
+	const int    twoM2,
+	const double phi,   // [rad]
+	const double theta  // [rad]
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// the coefficients for the given quantum numbers are calculated only once
+// loop over events is multi-threaded using OpenMP
+std::vector<std::complex<double>>
+wignerD(
+	const int                  twoJ,
+	const int                  twoM1,
+	const int                  twoM2,
+	const std::vector<double>& phi,   // [rad]
+	const std::vector<double>& theta  // [rad]
+);
+
+
+// complex conjugated Wigner D-function refl^D^J_{M1 M2}^*(phi, theta, 0) in reflectivity basis
+// !NOTE! quantum numbers J, M1, and M2 are given in units of hbar/2
+std::complex<double>
+wignerDReflConj(
+	const int    twoJ,
+	const int    twoM1,
+	const int    twoM2,
+	const int    P,
+	const int    refl,
+	const double phi,   // [rad]
+	const double theta  // [rad]
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// the coefficients for the given quantum numbers are calculated only once
+// loop over events is multi-threaded using OpenMP
+std::vector<std::complex<double>>
+wignerDReflConj(
+	const int                  twoJ,
+	const int                  twoM1,
+	const int                  twoM2,
+	const int                  P,
+	const int                  refl,
+	const std::vector<double>& phi,   // [rad]
+	const std::vector<double>& theta  // [rad]
+);
+
+
+// spherical harmonics; theta-dependent part
+// corresponds to Wigner d-function d^l_{m 0}(theta) (see Eq. (12) in https://halldweb.jlab.org/doc-private/DocDB/ShowDocument?docid=6124&version=3)
+double
+ylm(
+	const int    l,
+	const int    m,
+	const double theta  // [rad]
+);
+
+// spherical harmonics
+std::complex<double>
+Ylm(
+	const int    l,
+	const int    m,
+	const double theta,  // [rad]
+	const double phi     // [rad]
+);
+
+// real part of spherical harmonics
+double
+ReYlm(
+	const int    l,
+	const int    m,
+	const double theta,  // [rad]
+	const double phi     // [rad]
+);
+
+// imaginary part of spherical harmonics
+double
+ImYlm(
+	const int    l,
+	const int    m,
+	const double theta,  // [rad]
+	const double phi     // [rad]
+);
+
+
+// basis functions for (polarized) photoproduction moments
+// equation numbers below refer to https://halldweb.jlab.org/doc-private/DocDB/ShowDocument?docid=6124&version=3
+
+// basis functions for physical moments; Eq. (175)
+std::complex<double>
+f_phys(
+	const int    momentIndex,  // 0, 1, or 2
+	const int    L,
+	const int    M,
+	const double theta,  // [rad]
+	const double phi,    // [rad]
+	const double Phi,    // [rad]
+	const double polarization
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// loop over events is multi-threaded using OpenMP
+std::vector<std::complex<double>>
+f_phys(
+	const int                  momentIndex,  // 0, 1, or 2
+	const int                  L,
+	const int                  M,
+	const std::vector<double>& theta,  // [rad]
+	const std::vector<double>& phi,    // [rad]
+	const std::vector<double>& Phi,    // [rad]
+	const double               polarization
+);
+
+
+// basis functions for measured moments; Eq. (176)
+std::complex<double>
+f_meas(
+	const int    momentIndex,  // 0, 1, or 2
+	const int    L,
+	const int    M,
+	const double theta,  // [rad]
+	const double phi,    // [rad]
+	const double Phi,    // [rad]
+	const double polarization
+);
+
+// vector version that calculates function value for each entry in the input vectors; OpenMP version
+// loop over events is multi-threaded using OpenMP
+std::vector<std::complex<double>>
+f_meas(
+	const int                  momentIndex,  // 0, 1, or 2
+	const int                  L,
+	const int                  M,
+	const std::vector<double>& theta,  // [rad]
+	const std::vector<double>& phi,    // [rad]
+	const std::vector<double>& Phi,    // [rad]
+	const double               polarization
+);
+
+
+// real-valued basis functions for (polarized) photoproduction moments
+// H_0 and H_1 are real-valued and H_2 is purely imaginary; hence the moments are fully described by the real-valued vector (Re[H_0], Re[H_1], Im[H_2])
+// the corresponding basis functions are
+//   for measured moments: (Re[f_meas_0], Re[f_meas_1], Im[f_meas_2])
+//   for physical moments: (f_phys_0, f_phys_1, Re[i * f_phys_2]), where the factor i takes care of H_2 being purely imaginary
+
+// real-valued basis functions for physical moments
+double
+f_physReal(
+	const int    momentIndex,  // 0, 1, or 2
+	const int    L,
+	const int    M,
+	const double theta,  // [rad]
+	const double phi,    // [rad]
+	const double Phi,    // [rad]
+	const double polarization
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// loop over events is multi-threaded using OpenMP
+std::vector<double>
+f_physReal(
+	const int                  momentIndex,  // 0, 1, or 2
+	const int                  L,
+	const int                  M,
+	const std::vector<double>& theta,  // [rad]
+	const std::vector<double>& phi,    // [rad]
+	const std::vector<double>& Phi,    // [rad]
+	const double               polarization
+);
+
+
+// real-valued basis functions for measured moments
+double
+f_measReal(
+	const int    momentIndex,  // 0, 1, or 2
+	const int    L,
+	const int    M,
+	const double theta,  // [rad]
+	const double phi,    // [rad]
+	const double Phi,    // [rad]
+	const double polarization
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// loop over events is multi-threaded using OpenMP
+std::vector<double>
+f_measReal(
+	const int                  momentIndex,  // 0, 1, or 2
+	const int                  L,
+	const int                  M,
+	const std::vector<double>& theta,  // [rad]
+	const std::vector<double>& phi,    // [rad]
+	const std::vector<double>& Phi,    // [rad]
+	const double               polarization
+);
+
+
+// real and imaginary parts of spherical harmonics, i.e. ylm(theta) * cos(M * phi) and ylm(theta) * sin(M * phi), for all 0 <= M <= L <= maxL
+// these are the only (theta, phi)-dependent factors of the basis functions for measured and physical moments
+// returns flattened table with 2 * nmbLM rows and one column per event, where nmbLM = (maxL + 1) * (maxL + 2) / 2
+// row L * (L + 1) / 2 + M holds the real parts and row nmbLM + L * (L + 1) / 2 + M holds the imaginary parts
+// loop over events is multi-threaded using OpenMP
+std::vector<double>
+ylmReImTable(
+	const int                  maxL,
+	const std::vector<double>& theta,  // [rad]
+	const std::vector<double>& phi     // [rad]
+);
+
+
+// intensity distribution for rank-1 spin-density matrix given by partial-wave amplitudes; Eqs. (150) to (153) and (163)
+// for each reflectivity, the amplitude sums S = sum_lm [A^refl_lm Y_lm] and S' = sum_lm [(-1)^m A^refl_l-m Y_lm] are calculated
+// so that the computing time is linear in the number of waves
+// the intensity is then
+//   sum_refl [|S|^2 + |S'|^2 + 2 refl P (cos(2 Phi) Re[S' S^*] - sin(2 Phi) Im[S' S^*])]
+double
+intensityPhotoProd(
+	const double  cosTheta,
+	const double  phiDeg,  // [deg]
+	const double  PhiDeg,  // [deg]
+	const double* par      // [0] = polarization, [1] = maximum spin, [2, ...] = (Re, Im) of amplitudes ordered by reflectivity (+1, -1), l = 0, ..., maximum spin, and m = -l, ..., +l
+);
+
+// vector version that calculates function value for each entry in the input vectors
+// loop over events is multi-threaded using OpenMP
+std::vector<double>
+intensityPhotoProd(
+	const std::vector<double>& cosTheta,
+	const std::vector<double>& phiDeg,  // [deg]
+	const std::vector<double>& PhiDeg,  // [deg]
+	const std::vector<double>& par      // see scalar version
+);
+
+
+// functor that can be used to construct a TF3 for the intensity in intensityPhotoProd() optionally weighted by a detection efficiency
+// x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg
+// the efficiency function is copied so that each copy of the functor, e.g. in a copied TF3, owns its efficiency function
+class IntensityFcnPhotoProd {
+
+public:
+
+	IntensityFcnPhotoProd(const TF3* efficiency = nullptr)
+		: _efficiency((efficiency) ? new TF3(*efficiency) : nullptr)
+	{ }
+
+	IntensityFcnPhotoProd(const IntensityFcnPhotoProd& other)
+		: _efficiency((other._efficiency) ? new TF3(*other._efficiency) : nullptr)
+	{ }
+
+	double
+	operator () (
+		const double* x,
+		const double* par
+	) const {
+		const double intensity = intensityPhotoProd(x[0], x[1], x[2], par);
+		return (_efficiency) ? intensity * _efficiency->Eval(x[0], x[1], x[2]) : intensity;
+	}
+
+private:
+
+	std::unique_ptr<TF3> _efficiency;  // optional detection efficiency
+
+};
+
+
+// evaluates given TF3 for each entry in the input vectors
+// !Note! loop is not multi-threaded, because TF3::Eval() is not thread-safe
+std::vector<double>
+evalTF3(
+	const TF3&                 fcn,
+	const std::vector<double>& x,
+	const std::vector<double>& y,
+	const std::vector<double>& z
+);
+
+
+// counter-based random numbers that depend only on a seed and an entry number
+// used to generate reproducible random numbers in multi-threaded RDataFrame event loops independent of the order in which the entries are processed
+// uses the SplitMix64 generator; see https://prng.di.unimi.it/splitmix64.c
+class EntryRandom {
+
+public:
+
+	EntryRandom(
+		const uint64_t seed,
+		const uint64_t entry,
+		const uint64_t stream = 0  // allows to derive several independent streams for the same entry
+	) : _state(seed)
+	{
+		_state = next() ^ (entry * 0xd1b54a32d192ed03ULL) ^ (stream * 0xaef17502108ef2d9ULL);
+	}
+
+	// uniformly distributed in [0, 1)
+	double
+	uniform()
+	{
+		return (next() >> 11) * 0x1.0p-53;
+	}
+
+	// uniformly distributed in [a, b)
+	double
+	uniform(
+		const double a,
+		const double b
+	) {
+		return a + (b - a) * uniform();
+	}
+
+	// normally distributed; uses Box-Muller transform
+	double
+	gaus(
+		const double mean,
+		const double sigma
+	) {
+		const double u = 1 - uniform();  // in (0, 1]
+		return mean + sigma * std::sqrt(-2 * std::log(u)) * std::cos(2 * TMath::Pi() * uniform());
+	}
+
+private:
+
+	uint64_t
+	next()
+	{
+		uint64_t z = (_state += 0x9e3779b97f4a7c15ULL);
+		z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+		z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+		return z ^ (z >> 31);
+	}
+
+	uint64_t _state;
+
+};
+
+// random number uniformly distributed in [a, b) for given seed and entry number; can be used in RDataFrame Define() with rdfentry_
+double
+uniformRandom(
+	const uint64_t seed,
+	const uint64_t entry,
+	const double   a,
+	const double   b
+);
+
+// normally distributed random number for given seed and entry number; can be used in RDataFrame Define() with rdfentry_
+double
+gausRandom(
+	const uint64_t seed,
+	const uint64_t entry,
+	const double   mean,
+	const double   sigma
+);
+
+
+// accept-reject generator for points distributed according to a TF3 that can be used in multi-threaded RDataFrame event loops
+// each slot uses its own copy of the function and the random numbers for each entry are derived from the seed and the entry number
+// hence the generated points depend neither on the number of threads nor on the order in which the entries are processed
+// x = cos(theta) in [-1, +1], y = phi in [-180, +180] deg, z = Phi in [-180, +180] deg
+class AcceptRejectGeneratorTF3 {
+
+public:
+
+	AcceptRejectGeneratorTF3(
+		const TF3&         fcn,
+		const double       bound,      // upper bound for function values
+		const uint64_t     seed,
+		const unsigned int nmbSlots,   // number of RDataFrame slots
+		const size_t       nmbPoints)  // number of points to generate, i.e. number of entries in event loop
+		: _bound         (bound),
+		  _seed          (seed),
+		  _maxFcnVals    (nmbSlots, 0),
+		  _cosTheta      (nmbPoints),
+		  _phiDeg        (nmbPoints),
+		  _PhiDeg        (nmbPoints)
+	{
+		for (unsigned int slot = 0; slot < nmbSlots; ++slot) {
+			_fcns.emplace_back(new TF3(fcn));
+		}
+	}
+
+	// generates point for given entry; always returns true, so that it can be used in RDataFrame Filter()
+	bool
+	generate(
+		const unsigned int slot,
+		const uint64_t     entry
+	) {
+		EntryRandom rng(_seed, entry);
+		while (true) {
+			const double cosTheta = rng.uniform(  -1, +1);
+			const double phiDeg   = rng.uniform(-180, +180);
+			const double PhiDeg   = rng.uniform(-180, +180);
+			const double fcnVal   = _fcns[slot]->Eval(cosTheta, phiDeg, PhiDeg);
+			_maxFcnVals[slot] = std::max(_maxFcnVals[slot], fcnVal);
+			if (rng.uniform(0, _bound) < fcnVal) {
+				_cosTheta[entry] = cosTheta;
+				_phiDeg  [entry] = phiDeg;
+				_PhiDeg  [entry] = PhiDeg;
+				return true;
+			}
+		}
+	}
+
+	// maximum function value encountered during generation; if this exceeds the bound, the generated distribution is not correct
+	double maxFcnValue() const { return *std::max_element(_maxFcnVals.begin(), _maxFcnVals.end()); }
+
+	const std::vector<double>& cosTheta() const { return _cosTheta; }
+	const std::vector<double>& phiDeg  () const { return _phiDeg;   }
+	const std::vector<double>& PhiDeg  () const { return _PhiDeg;   }
+
+private:
+
+	const double                      _bound;
+	const uint64_t                    _seed;
+	std::vector<std::unique_ptr<TF3>> _fcns;        // function copy for each slot
+	std::vector<double>               _maxFcnVals;  // maximum function value encountered in each slot
+	std::vector<double>               _cosTheta;    // generated points indexed by entry
+	std::vector<double>               _phiDeg;
+	std::vector<double>               _PhiDeg;
+
+};
+
+
+#endif  // WIGNERD_H